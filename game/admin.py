@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import reverse
 
 from game import models
+from game.scores import refresh_team_round_scores
 from guardian.admin import GuardedModelAdmin
 
 
@@ -40,6 +41,19 @@ class QuestionAdmin(admin.ModelAdmin):
     def page_title(self, question):
         return question.page.title
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is models.Response:
+            # the leaderboard's totals, for the teams before and after
+            page_id = form.instance.page_id
+            refresh_team_round_scores(
+                (team_id, page_id)
+                for response_form in formset.forms
+                if response_form.has_changed() or response_form in formset.deleted_forms
+                for team_id in (response_form.initial.get('team'), response_form.instance.team_id)
+                if team_id is not None
+            )
+
     inlines = (
         ResponseInline,
     )
@@ -59,6 +73,24 @@ class ResponseAdmin(admin.ModelAdmin):
     def question_only(self, response):
         return response.question.question
 
+    # Scores edited or deleted here refresh the leaderboard's totals, as
+    # the host's scoring views do. The admin runs each in a transaction.
+
+    def save_model(self, request, obj, form, change):
+        before = set(_team_pages(models.Response.objects.filter(pk=obj.pk))) if change else set()
+        super().save_model(request, obj, form, change)
+        refresh_team_round_scores(before | {(obj.team_id, obj.question.page_id)})
+
+    def delete_model(self, request, obj):
+        team_page = (obj.team_id, obj.question.page_id)
+        super().delete_model(request, obj)
+        refresh_team_round_scores([team_page])
+
+    def delete_queryset(self, request, queryset):
+        team_pages = set(_team_pages(queryset))
+        super().delete_queryset(request, queryset)
+        refresh_team_round_scores(team_pages)
+
     list_display = (
         'value',
         'team',
@@ -70,6 +102,10 @@ class ResponseAdmin(admin.ModelAdmin):
     )
 
 
+def _team_pages(responses):
+    return responses.values_list('team_id', 'question__page_id')
+
+
 class TeamAdmin(admin.ModelAdmin):
     @admin.display(description='Game')
     def game_name(self, team):
@@ -84,8 +120,28 @@ class TeamAdmin(admin.ModelAdmin):
         'game__name',
     )
 
+class TeamRoundScoreAdmin(admin.ModelAdmin):
+    list_display = (
+        'team',
+        'page',
+        'points',
+    )
+    list_filter = (
+        'page__game__name',
+    )
+
+class GameArchiveAdmin(admin.ModelAdmin):
+    list_display = (
+        'game',
+        'archived_at',
+    )
+    exclude = ('data',)
+    readonly_fields = ('game', 'archived_at')
+
 admin.site.register(models.Game, GameAdmin)
 admin.site.register(models.Team, TeamAdmin)
 admin.site.register(models.Page, PageAdmin)
 admin.site.register(models.Question, QuestionAdmin)
 admin.site.register(models.Response, ResponseAdmin)
+admin.site.register(models.TeamRoundScore, TeamRoundScoreAdmin)
+admin.site.register(models.GameArchive, GameArchiveAdmin)
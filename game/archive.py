@@ -0,0 +1,99 @@
+"""
+Finished games' teams, responses and scores, moved out of the hot tables
+into one compressed `GameArchive` row per game.
+
+Otherwise `Response`, `Team` and `TeamRoundScore` grow with every game ever
+played. `./manage.py archive_games --days N` archives the games which have
+been closed for N days: it saves their rows and final leaderboard, then
+deletes the rows. The game, its pages and its questions stay where they are,
+so the host leaderboard and game.json keep working from the archive, read
+only. An archived game can't be reopened.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import Game, GameArchive, Response, TeamRoundScore
+
+
+# bumped if what's stored changes, so old archives can still be read
+ARCHIVE_FORMAT = 1
+
+
+def archivable_games(days, now=None):
+    "Games closed, and untouched, for at least `days` days which still have teams"
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return (
+        Game.objects
+        .filter(
+            state=Game.GameState.CLOSED,
+            last_edit_time__lt=cutoff,
+            archive__isnull=True,
+            team__isnull=False,
+        )
+        .distinct()
+        .order_by('id')
+    )
+
+
+def archive_game(game):
+    """Moves `game`'s teams, responses and scores into its archive. Returns
+    how many teams and responses were archived."""
+    # the leaderboard reads archives
+    from .leaderboard import compute_leaderboard_data
+
+    with transaction.atomic():
+        teams = list(game.team_set.values_list('id', 'name', 'members'))
+        responses = list(
+            Response.objects
+            .filter(question__page__game=game)
+            .order_by('question_id', 'team_id')
+            .values_list('question_id', 'team_id', 'value', 'score', 'graded', 'suggested_score')
+        )
+        round_scores = list(
+            TeamRoundScore.objects
+            .filter(page__game=game)
+            .order_by('page_id', 'team_id')
+            .values_list('team_id', 'page_id', 'points')
+        )
+        rounds, lines, gold_medals = compute_leaderboard_data(game)
+
+        GameArchive.objects.create(game=game, data=_compress({
+            'format': ARCHIVE_FORMAT,
+            'teams': teams,
+            'responses': responses,
+            'round_scores': round_scores,
+            'leaderboard': {
+                'rounds': rounds,
+                'lines': lines,
+                'gold_medals': gold_medals,
+            },
+        }))
+
+        Response.objects.filter(question__page__game=game).delete()
+        TeamRoundScore.objects.filter(page__game=game).delete()
+        game.team_set.all().delete()
+        Game.bump_results_version(game.id)
+
+    return len(teams), len(responses)
+
+
+def load_archive(game, using=DEFAULT_DB_ALIAS):
+    "The archived data for `game`, or None if it hasn't been archived"
+    data = (
+        GameArchive.objects
+        .using(using)
+        .filter(game=game)
+        .values_list('data', flat=True)
+        .first()
+    )
+    if data is None:
+        return None
+    return json.loads(zlib.decompress(data))
+
+
+def _compress(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode(), level=9)
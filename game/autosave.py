@@ -0,0 +1,116 @@
+"""
+Optional write-behind buffer for players' autosaved answers.
+
+With `AUTOSAVE_WRITE_BEHIND` on, `question_response` records each keystroke
+here instead of writing it. Only the latest value per (team, question) is
+kept, and a background thread writes them all every
+`AUTOSAVE_FLUSH_SECONDS` in one statement. Hosts flush before changing a
+page's state, so nothing accepted while a round was open is lost when it
+closes.
+
+The buffer lives in one process. Answers recorded by other workers land
+on their next flush, up to one interval later, so the buffer is best
+suited to a single worker process.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class AutosaveBuffer:
+    def __init__(self, interval):
+        "`interval` is seconds between background flushes, or None for no thread"
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+
+    def record(self, team_id, question_id, value):
+        with self._lock:
+            self._pending[(team_id, question_id)] = value
+        self._start_flusher()
+
+    def pending_value(self, team_id, question_id):
+        "The recorded but not yet written value, if there is one"
+        with self._lock:
+            return self._pending.get((team_id, question_id))
+
+    def flush(self):
+        "Write everything recorded so far. Returns how many answers were written."
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            try:
+                return _write(batch)
+            except Exception:
+                # put them back, unless a newer value came in meanwhile
+                with self._lock:
+                    self._pending = batch | self._pending
+                raise
+
+    def _start_flusher(self):
+        if self.interval is None or self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name='autosave-flusher',
+                daemon=True,
+            )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't write autosaved answers; will retry")
+            finally:
+                close_old_connections()
+
+
+def _write(batch):
+    team_ids = {team_id for team_id, _ in batch}
+    question_ids = {question_id for _, question_id in batch}
+
+    with transaction.atomic():
+        # a host may have scored some of these since they were recorded
+        graded = set(
+            Response.objects
+            .filter(team_id__in=team_ids, question_id__in=question_ids, graded=True)
+            .values_list('team_id', 'question_id')
+        )
+        responses = [
+            Response(team_id=team_id, question_id=question_id, value=value)
+            for (team_id, question_id), value in batch.items()
+            if (team_id, question_id) not in graded
+        ]
+        Response.objects.bulk_create(
+            responses,
+            update_conflicts=True,
+            unique_fields=['question', 'team'],
+            # clearing any suggestion automatic grading made for the old value
+            update_fields=['value', 'suggested_score'],
+        )
+
+    return len(responses)
+
+
+buffer = AutosaveBuffer(settings.AUTOSAVE_FLUSH_SECONDS)
+atexit.register(buffer.flush)
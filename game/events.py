@@ -0,0 +1,108 @@
+"""
+In-process fan-out of "this game changed" notifications to the players'
+event streams (see `game.views.play_events`).
+
+Host views call `game_changed` from whatever thread they run in; each
+listening stream owns a tiny queue on its own event loop.
+
+Changes made in another worker process never reach `game_changed` here.
+For those, one watcher per game -- not per stream -- compares the game's
+version with the database every `EVENT_VERSION_CHECK_SECONDS` and wakes
+all of the game's streams when it moves. So a change made by a host whose
+request landed on another worker reaches players up to that many seconds
+late.
+"""
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .models import Game
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_listeners: dict[int, set] = {}
+# game id -> the task watching its version
+_watchers: dict[int, asyncio.Task] = {}
+
+
+@contextmanager
+def listen(game_id):
+    "Yields a queue which receives an item whenever `game_id` changes."
+    loop = asyncio.get_running_loop()
+    # a listener which hasn't caught up yet only needs to hear about it once
+    queue = asyncio.Queue(maxsize=1)
+    listener = (loop, queue)
+
+    with _lock:
+        _listeners.setdefault(game_id, set()).add(listener)
+        watcher = _watchers.get(game_id)
+        if watcher is None or watcher.done():
+            _watchers[game_id] = loop.create_task(_watch(game_id))
+    try:
+        yield queue
+    finally:
+        with _lock:
+            listeners = _listeners.get(game_id, set())
+            listeners.discard(listener)
+            if not listeners:
+                _listeners.pop(game_id, None)
+                watcher = _watchers.pop(game_id, None)
+                if watcher:
+                    _cancel(watcher)
+
+
+def game_changed(game_id):
+    "Wake every stream listening to `game_id`. Safe to call from any thread."
+    with _lock:
+        listeners = list(_listeners.get(game_id, ()))
+
+    for loop, queue in listeners:
+        try:
+            loop.call_soon_threadsafe(_wake, queue)
+        except RuntimeError:
+            # the stream's loop has already shut down
+            pass
+
+
+def _wake(queue):
+    if not queue.full():
+        queue.put_nowait(True)
+
+
+def _cancel(task):
+    try:
+        same_loop = asyncio.get_running_loop() is task.get_loop()
+    except RuntimeError:
+        same_loop = False
+    if same_loop:
+        task.cancel()
+    else:
+        task.get_loop().call_soon_threadsafe(task.cancel)
+
+
+async def _watch(game_id):
+    # Changes made in this process wake the streams twice: at once, then
+    # when the version is next checked. The second costs each player a
+    # poll answered with 304 Not Modified.
+    version = None
+    while True:
+        try:
+            latest = await (
+                Game.objects
+                .filter(pk=game_id)
+                .values_list('version', flat=True)
+                .afirst()
+            )
+        except DatabaseError:
+            logger.exception("Couldn't check game %s's version", game_id)
+        else:
+            if version is not None and latest != version:
+                game_changed(game_id)
+            version = latest
+        await asyncio.sleep(settings.EVENT_VERSION_CHECK_SECONDS)
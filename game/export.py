@@ -0,0 +1,92 @@
+"""
+Every response in a game, one row each, for analysis after the game.
+
+Rows are read with a chunked iterator and written out as they come, so
+exporting a big game takes no more memory than a small one. The host views
+wrap these in a `StreamingHttpResponse`; the `export_responses` command
+writes them to a file. Archived games are exported from their archive.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+
+from .archive import load_archive
+from .models import Question, Response
+
+
+COLUMNS = ('team', 'round', 'question', 'value', 'score', 'graded')
+
+# rows fetched from the database at a time
+CHUNK_SIZE = 2000
+
+
+def response_rows(game, using=DEFAULT_DB_ALIAS):
+    "(team, round, question, value, score, graded) for each response, in question order"
+    archive = load_archive(game, using)
+    if archive:
+        return _archived_rows(game, archive, using)
+
+    return (
+        Response.objects
+        .using(using)
+        .filter(question__page__game=game)
+        .order_by('question__page__order', 'question__order', 'team__name')
+        .values_list(
+            'team__name',
+            'question__page__order',
+            'question__order',
+            'value',
+            'score',
+            'graded',
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def _archived_rows(game, archive, using):
+    # the questions are still there; only the teams and responses moved
+    positions = {
+        question_id: (page_order, order)
+        for question_id, page_order, order in (
+            Question.objects
+            .using(using)
+            .filter(page__game=game)
+            .values_list('id', 'page__order', 'order')
+        )
+    }
+    team_names = {team_id: name for team_id, name, _ in archive['teams']}
+    rows = [
+        (team_names[team_id], *positions[question_id], value, score, graded)
+        for question_id, team_id, value, score, graded, _ in archive['responses']
+        if question_id in positions
+    ]
+    rows.sort(key=lambda row: (row[1], row[2], row[0]))
+    return rows
+
+
+class _Echo:
+    "Just enough of a file for `csv.writer` to hand back each line"
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+# format -> (lines, content type)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
@@ -0,0 +1,283 @@
+"""
+Automatic grading, run when a page moves to scoring, so that hosts only
+have to look at the responses it can't decide.
+
+Each question's answers are compiled into matchers once, then every
+ungraded response on the page goes through them in a single pass.
+Responses which clearly match get full points. Near misses get a
+`suggested_score` for the host to confirm, and the rest are left alone:
+a wrong-looking answer might still deserve credit.
+"""
+import re
+import unicodedata
+from dataclasses import dataclass
+
+from django.db import transaction
+
+from .models import Response
+from .scores import rebuild_scores
+
+
+# what a matcher can say about a response
+CORRECT = 'correct'
+CLOSE = 'close'
+# not right, and no later matcher should say otherwise; left for the host
+WRONG = 'wrong'
+
+# answers shorter than this must be spelled right
+MIN_TYPO_LENGTH = 5
+
+MATCHERS = []
+
+
+def matcher(factory):
+    """Registers a matcher. `factory(question, answers)` is called once per
+    question and returns a `match(value, normalized)` function giving a
+    verdict for a response, or None if it has nothing to say about the
+    question at all. Matchers are tried in the order they're registered,
+    until one gives a verdict."""
+    MATCHERS.append(factory)
+    return factory
+
+
+# signs and symbols can be the whole difference between answers: -40 and
+# 40, C++ and C#, 1/2 and 1 2
+_NOT_WORDS = re.compile(r'(?:[^\w+#/.-]|_)+')
+_LEADING_ARTICLE = re.compile(r'^(the|an|a) ')
+_NUMBER = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)')
+_NUMBER_DECORATION = re.compile(r'[\s,$£€%]')
+
+
+def normalize(text):
+    """Lowercase, without accents, extra spaces, a leading article, or
+    punctuation other than - + # / and ."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.replace('&', ' and ')
+    # but not a full stop at the end
+    text = _NOT_WORDS.sub(' ', text).strip().rstrip('.')
+    return _LEADING_ARTICLE.sub('', text)
+
+
+def group_key(text):
+    """Lowercase, without accents or extra spaces. Looser than that and a
+    group could hold answers the host would score differently."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def parse_number(text):
+    "The number `text` spells out, allowing for commas and units like $ and %, or None"
+    text = _NUMBER_DECORATION.sub('', text)
+    if not _NUMBER.fullmatch(text):
+        return None
+    return float(text)
+
+
+def edit_distance(a, b, limit):
+    "Levenshtein distance between `a` and `b`, or `limit + 1` if it's more than `limit`"
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+@matcher
+def numeric_match(question, answers):
+    targets = [n for n in map(parse_number, answers) if n is not None]
+    if not targets:
+        return None
+    # a little slack for floating point
+    tolerance = (question.numeric_tolerance or 0) + 1e-9
+
+    def match(value, normalized):
+        number = parse_number(value)
+        if number is None:
+            return None
+        # a number is right or wrong by value alone
+        if any(abs(number - t) <= tolerance for t in targets):
+            return CORRECT
+        return WRONG
+    return match
+
+
+@matcher
+def exact_match(question, answers):
+    accepted = {normalize(answer) for answer in answers} - {''}
+    if not accepted:
+        return None
+
+    def match(value, normalized):
+        return CORRECT if normalized in accepted else None
+    return match
+
+
+@matcher
+def typo_match(question, answers):
+    accepted = [
+        answer
+        for answer in {normalize(answer) for answer in answers}
+        if len(answer) >= MIN_TYPO_LENGTH and parse_number(answer) is None
+    ]
+    if not accepted:
+        return None
+
+    def match(value, normalized):
+        for answer in accepted:
+            # about one slip per six letters
+            limit = max(1, len(answer) // 6)
+            if edit_distance(answer, normalized, limit) <= limit:
+                return CLOSE
+        return None
+    return match
+
+
+def compile_question(question):
+    "A function giving the verdict on a response's value for `question`"
+    answers = [question.answer, *question.accepted_answers.splitlines()]
+    answers = [answer.strip() for answer in answers if answer.strip()]
+    matchers = [
+        match
+        for match in (factory(question, answers) for factory in MATCHERS)
+        if match
+    ]
+    # teams often give the same answer, so each is only judged once
+    verdicts = {}
+
+    def grade(value):
+        try:
+            return verdicts[value]
+        except KeyError:
+            pass
+        normalized = normalize(value)
+        verdict = None
+        for match in matchers:
+            verdict = match(value, normalized)
+            if verdict:
+                break
+        if verdict == WRONG:
+            verdict = None
+        verdicts[value] = verdict
+        return verdict
+    return grade
+
+
+@dataclass
+class ResponseGroup:
+    "Responses to one question which differ only in case, accents and spacing"
+    key: str
+    responses: list
+
+    @property
+    def value(self):
+        return self.responses[0].value
+
+    @property
+    def values(self):
+        "Each distinct way the group's answer was written, so the host sees them all"
+        return list(dict.fromkeys(response.value for response in self.responses))
+
+    @property
+    def response_ids(self):
+        return ",".join(str(response.id) for response in self.responses)
+
+    @property
+    def graded(self):
+        return all(response.graded for response in self.responses)
+
+    @property
+    def score(self):
+        "The score every response has, if they're all graded the same"
+        scores = {response.score for response in self.responses}
+        if self.graded and len(scores) == 1:
+            return scores.pop()
+        return None
+
+    @property
+    def suggested_score(self):
+        return next(
+            (r.suggested_score for r in self.responses if r.suggested_score is not None),
+            None,
+        )
+
+
+def group_responses(responses):
+    "Groups responses by their `group_key` in one pass, biggest group first"
+    groups = {}
+    for response in responses:
+        key = group_key(response.value)
+        if key not in groups:
+            groups[key] = ResponseGroup(key, [])
+        groups[key].responses.append(response)
+    return sorted(groups.values(), key=lambda group: len(group.responses), reverse=True)
+
+
+def grade_page(page):
+    """Grade the page's ungraded responses. Returns how many were scored
+    and how many were given a suggested score."""
+    questions = list(page.question_set.all())
+    graders = {question.id: compile_question(question) for question in questions}
+
+    correct = {question.id: [] for question in questions}
+    close = {question.id: [] for question in questions}
+    # suggestions made for what a response used to say
+    stale = []
+    responses = (
+        Response.objects
+        .filter(question__page=page, graded=False)
+        .values_list('id', 'question_id', 'value', 'suggested_score')
+    )
+    for response_id, question_id, value, suggested_score in responses.iterator(chunk_size=2000):
+        verdict = graders[question_id](value)
+        if verdict == CORRECT:
+            correct[question_id].append(response_id)
+        elif verdict == CLOSE:
+            close[question_id].append(response_id)
+        elif suggested_score is not None:
+            stale.append(response_id)
+
+    with transaction.atomic():
+        # everything right on one question gets the same score, so one
+        # UPDATE per question beats a row-by-row bulk_update
+        scored = suggested = 0
+        for question in questions:
+            scored += _update(
+                correct[question.id],
+                score=question.possible_points,
+                graded=True,
+                suggested_score=None,
+            )
+            suggested += _update(close[question.id], suggested_score=question.possible_points)
+        _update(stale, suggested_score=None)
+
+        if scored:
+            rebuild_scores(page.game_id, page.id)
+
+    return scored, suggested
+
+
+# stay well under the database's limit on query parameters
+_UPDATE_BATCH_SIZE = 500
+
+
+def _update(response_ids, **fields):
+    """Updates the responses which are still ungraded; the host may have
+    scored some since they were read. Returns how many were updated."""
+    updated = 0
+    for start in range(0, len(response_ids), _UPDATE_BATCH_SIZE):
+        batch = response_ids[start:start + _UPDATE_BATCH_SIZE]
+        updated += Response.objects.filter(pk__in=batch, graded=False).update(**fields)
+    return updated
@@ -0,0 +1,324 @@
+"""
+Whole games -- pages and their questions -- read from a file, so a game can
+be written in a text editor and imported in one go rather than entered one
+form post at a time.
+
+Three formats are understood. JSON, with everything but the titles and
+question text optional:
+
+    {"name": "Pub quiz", "pages": [
+        {"title": "Round 1", "description": "", "is_hidden": false,
+         "questions": [
+            {"question": "Capital of France?", "answer": "Paris",
+             "possible_points": 1, "accepted_answers": ["Paris, France"],
+             "numeric_tolerance": null}
+        ]}
+    ]}
+
+CSV, one question per row, with a header naming the columns. `page` and
+`question` are required; `answer`, `possible_points`, `accepted_answers`
+(separated by `|`) and `numeric_tolerance` are optional. Rows with the same
+`page` go on the same page, in the order the pages first appear.
+
+And Markdown, where `#` names the game, `##` starts a page (`(hidden)` at
+the end hides it), text under a page heading is its description, and each
+numbered item is a question. Indented `Answer:`, `Also:`, `Points:` and
+`Tolerance:` lines fill in the rest:
+
+    # Pub quiz
+
+    ## Round 1
+    1. Capital of France?
+       Answer: Paris
+       Also: Paris, France
+
+The whole file is checked before anything is saved, and every problem is
+reported at once. Then the game, its pages, and its questions are created
+with a bulk INSERT each, in one transaction. `clone_game` copies an
+existing game the same way.
+"""
+import csv
+import io
+import json
+import re
+from pathlib import PurePath
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Game, Page, Question
+
+
+FORMATS = {}
+
+# file extensions for each format
+EXTENSIONS = {
+    '.json': 'json',
+    '.csv': 'csv',
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+}
+
+_PAGE_FIELDS = {'title', 'description', 'is_hidden', 'hide_questions'}
+_QUESTION_FIELDS = {'question', 'answer', 'possible_points', 'accepted_answers', 'numeric_tolerance'}
+
+
+def file_format(name):
+    """Registers a parser. It's given the file's text and returns the game
+    as JSON would describe it, raising ValidationError if it can't."""
+    def decorator(parse):
+        FORMATS[name] = parse
+        return parse
+    return decorator
+
+
+def format_for(filename):
+    "The format a file's extension suggests, or None"
+    return EXTENSIONS.get(PurePath(filename).suffix.lower())
+
+
+def import_game(text, format, name=None, default_name=None):
+    """Creates a game from `text`, which is in `format`, and returns it.
+    `name` overrides the name the file gives, and `default_name` is used
+    when it gives none. Raises ValidationError listing everything wrong
+    with the file; nothing is saved unless the whole file is good."""
+    try:
+        parse = FORMATS[format]
+    except KeyError:
+        raise ValidationError(f"Unknown format {format!r}")
+
+    data = parse(text)
+    game, pages = build_game(data, name=name or data.get('name') or default_name)
+    save_game(game, pages)
+    return game
+
+
+def build_game(data, name):
+    """Unsaved instances for a game described like the JSON format: the
+    game, and a list of (page, [questions]). Raises ValidationError listing
+    every problem found."""
+    errors = []
+    game = Game(name=name or '')
+    _check(game, "The game", errors, exclude=['passcode'])
+
+    pages = []
+    raw_pages = data.get('pages')
+    if not isinstance(raw_pages, list) or not raw_pages:
+        errors.append("The game has no pages.")
+        raw_pages = []
+
+    for page_order, raw_page in enumerate(raw_pages, start=1):
+        where = f"Page {page_order}"
+        if not isinstance(raw_page, dict):
+            errors.append(f"{where} isn't an object.")
+            continue
+
+        raw_questions = raw_page.get('questions', [])
+        if not isinstance(raw_questions, list):
+            errors.append(f"{where}: questions must be a list.")
+            raw_questions = []
+        page = Page(order=page_order, **_fields(raw_page, _PAGE_FIELDS, where, errors))
+        _check(page, where, errors, exclude=['game'])
+
+        questions = []
+        for question_order, raw_question in enumerate(raw_questions, start=1):
+            q_where = f"{where}, question {question_order}"
+            if not isinstance(raw_question, dict):
+                errors.append(f"{q_where} isn't an object.")
+                continue
+            fields = _fields(raw_question, _QUESTION_FIELDS, q_where, errors)
+            accepted = fields.get('accepted_answers')
+            if isinstance(accepted, list):
+                fields['accepted_answers'] = '\n'.join(map(str, accepted))
+            question = Question(order=question_order, **fields)
+            _check(question, q_where, errors, exclude=['page'])
+            questions.append(question)
+
+        pages.append((page, questions))
+
+    if errors:
+        raise ValidationError(errors)
+    return game, pages
+
+
+def save_game(game, pages):
+    "Saves what `build_game` made: one INSERT each for the game, pages, and questions"
+    with transaction.atomic():
+        game.save()
+        for page, _ in pages:
+            page.game = game
+        Page.objects.bulk_create(page for page, _ in pages)
+
+        questions = []
+        for page, page_questions in pages:
+            for question in page_questions:
+                question.page = page
+                questions.append(question)
+        Question.objects.bulk_create(questions)
+
+
+def clone_game(game, name=None):
+    """A closed copy of `game`, with its pages and questions but none of
+    its teams or responses, in a constant number of queries."""
+    copy = Game(name=name or _copy_name(game.name))
+
+    questions = {}
+    for question in Question.objects.filter(page__game=game):
+        questions.setdefault(question.page_id, []).append(Question(
+            order=question.order,
+            question=question.question,
+            answer=question.answer,
+            possible_points=question.possible_points,
+            accepted_answers=question.accepted_answers,
+            numeric_tolerance=question.numeric_tolerance,
+        ))
+    pages = [
+        (
+            Page(
+                order=page.order,
+                title=page.title,
+                description=page.description,
+                is_hidden=page.is_hidden,
+                hide_questions=page.hide_questions,
+            ),
+            questions.get(page.id, []),
+        )
+        for page in game.page_set.all()
+    ]
+
+    save_game(copy, pages)
+    return copy
+
+
+def _copy_name(name):
+    suffix = " (copy)"
+    max_length = Game._meta.get_field('name').max_length
+    return name[:max_length - len(suffix)] + suffix
+
+
+def _fields(raw, allowed, where, errors):
+    unknown = set(raw) - allowed - {'questions'}
+    if unknown:
+        errors.append(f"{where}: unknown field(s) {', '.join(sorted(unknown))}.")
+    # leave out blanks, so the model's defaults apply
+    return {
+        key: value
+        for key, value in raw.items()
+        if key in allowed and value not in (None, '')
+    }
+
+
+def _check(instance, where, errors, exclude):
+    try:
+        instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+    except ValidationError as e:
+        for field, messages in e.message_dict.items():
+            for message in messages:
+                errors.append(f"{where}: {field.replace('_', ' ')}: {message}")
+
+
+@file_format('json')
+def parse_json(text):
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValidationError(f"Not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValidationError("Expected a JSON object with the game's pages.")
+    return data
+
+
+@file_format('csv')
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    columns = set(reader.fieldnames or ())
+    if not {'page', 'question'} <= columns:
+        raise ValidationError("The CSV needs a header row with at least 'page' and 'question' columns.")
+    unknown = columns - _QUESTION_FIELDS - {'page'}
+    if unknown:
+        raise ValidationError(f"Unknown CSV column(s): {', '.join(sorted(unknown))}.")
+
+    pages = {}
+    try:
+        for row in reader:
+            title = (row['page'] or '').strip()
+            question = {
+                key: (value or '').strip()
+                for key, value in row.items()
+                if key in _QUESTION_FIELDS
+            }
+            question['accepted_answers'] = [
+                answer.strip()
+                for answer in question.get('accepted_answers', '').split('|')
+                if answer.strip()
+            ]
+            pages.setdefault(title, []).append(question)
+    except csv.Error as e:
+        raise ValidationError(f"Not valid CSV: {e}")
+
+    return {
+        'pages': [
+            {'title': title, 'questions': questions}
+            for title, questions in pages.items()
+        ],
+    }
+
+
+_HEADING = re.compile(r'^(#{1,2})\s+(.*?)\s*$')
+_HIDDEN = re.compile(r'\s*\(hidden\)$', re.IGNORECASE)
+_ITEM = re.compile(r'^\d+[.)]\s+(.*?)\s*$')
+_QUESTION_LINE = re.compile(r'^\s+(answer|also|points|tolerance):\s*(.*?)\s*$', re.IGNORECASE)
+
+
+@file_format('markdown')
+def parse_markdown(text):
+    data = {'pages': []}
+    errors = []
+    page = question = None
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        heading = _HEADING.match(line)
+        item = _ITEM.match(line)
+        detail = _QUESTION_LINE.match(line)
+
+        if heading and heading[1] == '#':
+            if data.get('name') or data['pages']:
+                errors.append(f"Line {number}: the game's name must come first, and only once.")
+            data['name'] = heading[2]
+        elif heading:
+            title = _HIDDEN.sub('', heading[2])
+            page = {'title': title, 'is_hidden': title != heading[2], 'questions': []}
+            data['pages'].append(page)
+            question = None
+        elif item:
+            if page is None:
+                errors.append(f"Line {number}: a question before the first page (## heading).")
+                continue
+            question = {'question': item[1], 'accepted_answers': []}
+            page['questions'].append(question)
+        elif question is not None and detail:
+            key, value = detail[1].lower(), detail[2]
+            if key == 'answer':
+                question['answer'] = value
+            elif key == 'also':
+                question['accepted_answers'].append(value)
+            elif key == 'points':
+                question['possible_points'] = value
+            else:
+                question['numeric_tolerance'] = value
+        elif question is not None and line.strip():
+            if line[0].isspace():
+                question['question'] += '\n' + line.strip()
+            else:
+                errors.append(f"Line {number}: expected a numbered question or a ## page heading.")
+        elif page is not None and question is None:
+            page['description'] = page.get('description', '') + line.rstrip() + '\n'
+        elif line.strip():
+            errors.append(f"Line {number}: text before the first page (## heading).")
+
+    for page in data['pages']:
+        page['description'] = page.get('description', '').strip()
+
+    if errors:
+        raise ValidationError(errors)
+    return data
@@ -0,0 +1,240 @@
+"""
+The leaderboard, worked out and rendered once per game and score version,
+then shared by every player and host who looks at it.
+
+When the host puts the leaderboard up, every team opens it at once, and
+their pages differ only in which row is highlighted. So each team's row is
+rendered twice -- plain, and highlighted for that team -- and each player's
+table is put together from those. The JSON for `host_leaderboard_stats` is
+kept alongside.
+
+Archived games, whose teams and scores have been moved out of the hot
+tables, get the final board that was archived with them.
+
+Boards live in each worker process and are keyed by the game's `version`
+(pages shown or hidden) and `results_version` (scores and teams changed),
+so the first request after a response is scored builds a new one. When
+several requests miss at once, one of them builds the board while the rest
+wait for it.
+"""
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .archive import load_archive
+from .models import Game, GameArchive, Page
+from .scores import team_round_totals
+
+
+# games kept per worker; a night of trivia only has a handful open
+_MAX_BOARDS = 16
+
+_lock = threading.Lock()
+_boards: OrderedDict[int, 'Leaderboard'] = OrderedDict()
+# held while a game's board is being built
+_building: dict[int, threading.Lock] = {}
+
+
+@dataclass(frozen=True)
+class Leaderboard:
+    """Shared between requests, so treat it as read-only. `rounds`, `lines`
+    and `gold_medals` are as `compute_leaderboard_data` returns them."""
+    game_id: int
+    version: int
+    results_version: int
+    rounds: list
+    # [team name, points per round..., total], best first
+    lines: list
+    gold_medals: list
+    # team name -> members
+    teams: dict
+    # (team name, plain row, highlighted row), in the order of `lines`
+    rows: tuple
+    json: bytes
+
+    def table_rows(self, team_name=None):
+        "The table's rows as HTML, with `team_name`'s highlighted"
+        return mark_safe(''.join(
+            highlighted if name == team_name else plain
+            for name, plain, highlighted in self.rows
+        ))
+
+
+def get_leaderboard(game):
+    """The board for `game`, whose versions should be fresh from the
+    database, or None if it's been deleted."""
+    board = _cached(game)
+    if board:
+        return board
+
+    with _lock:
+        building = _building.setdefault(game.id, threading.Lock())
+    with building:
+        # whoever held the lock may have just built it
+        return _cached(game) or _store(_build(game.id))
+
+
+def invalidate(game_id):
+    with _lock:
+        _boards.pop(game_id, None)
+
+
+def _cached(game):
+    with _lock:
+        board = _boards.get(game.id)
+        # a board built from newer data than the caller saw is still good
+        if (
+            board
+            and board.version >= game.version
+            and board.results_version >= game.results_version
+        ):
+            _boards.move_to_end(game.id)
+            return board
+    return None
+
+
+def _store(board):
+    if board:
+        with _lock:
+            _boards[board.game_id] = board
+            _boards.move_to_end(board.game_id)
+            while len(_boards) > _MAX_BOARDS:
+                game_id, _ = _boards.popitem(last=False)
+                _building.pop(game_id, None)
+    return board
+
+
+def _build(game_id):
+    # the versions are read first, so the board is never older than its key;
+    # whether there's an archive comes along, so live games don't pay for
+    # looking
+    game = (
+        Game.objects
+        .filter(pk=game_id)
+        .only('name', 'version', 'results_version')
+        .annotate(archived=Exists(GameArchive.objects.filter(game=OuterRef('pk'))))
+        .first()
+    )
+    if game is None:
+        return None
+
+    archive = load_archive(game) if game.archived else None
+    if archive:
+        # the teams and scores are gone, but the final board was kept
+        teams = {name: members for _, name, members in archive['teams']}
+        board = archive['leaderboard']
+        rounds, lines, gold_medals = board['rounds'], board['lines'], board['gold_medals']
+    else:
+        teams = {}
+        team_names = {}
+        for team_id, name, members in game.team_set.values_list('id', 'name', 'members'):
+            team_names[team_id] = name
+            teams[name] = members
+        rounds, lines, gold_medals = _rank_leaderboard(
+            _leaderboard_rounds(game),
+            team_names,
+            team_round_totals(game),
+        )
+
+    rows = tuple(
+        (line[0], _render_row(line, teams, gold_medals, False), _render_row(line, teams, gold_medals, True))
+        for line in lines
+    )
+    payload = {
+        'game': {
+            'name': game.name,
+        },
+        'rounds': [
+            {'name': str(round)}
+            for round in rounds
+        ],
+        'teams': [
+            {'name': name, 'members': members}
+            for name, members in teams.items()
+        ],
+        'leaderboard': [
+            {'name': line[0], 'scores': line[1:], 'has_gold_medal': line[0] in gold_medals}
+            for line in lines
+        ],
+    }
+
+    return Leaderboard(
+        game_id=game.id,
+        version=game.version,
+        results_version=game.results_version,
+        rounds=rounds,
+        lines=lines,
+        gold_medals=gold_medals,
+        teams=teams,
+        rows=rows,
+        json=json.dumps(payload, cls=DjangoJSONEncoder).encode(),
+    )
+
+
+def _render_row(line, teams, gold_medals, highlighted):
+    return render_to_string('game/_leaderboard_row.html', {
+        'name': line[0],
+        'members': teams[line[0]],
+        'scores': line[1:],
+        'gold_medal': line[0] in gold_medals,
+        'highlighted': highlighted,
+    })
+
+
+def compute_leaderboard_data(game, totals=None):
+    """Returns the rounds, the sorted leaderboard, and the gold medal winners.
+
+    `totals` are (team id, page order, points) rows. They default to the
+    per-team, per-page totals maintained by `game.scores`, which cost
+    (teams x rounds) rows rather than one per response."""
+    if totals is None:
+        totals = team_round_totals(game)
+
+    team_names = dict(game.team_set.values_list('id', 'name'))
+    return _rank_leaderboard(_leaderboard_rounds(game), team_names, totals)
+
+
+def _leaderboard_rounds(game):
+    "Orders of the pages which get a column on the leaderboard"
+    return [
+        round.order
+        for round in (
+            game.page_set
+            .exclude(is_hidden=True, state=Page.PageState.LOCKED)
+        )]
+
+
+def _rank_leaderboard(rounds, team_names, totals):
+    rounds = rounds + ['total']
+    l_board = { team_id: {r: 0 for r in rounds} for team_id in team_names }
+    for team_id, page_order, points in totals:
+        try:
+            l_board[team_id][page_order] += points
+            l_board[team_id]['total'] += points
+        except KeyError:
+            if page_order not in l_board[team_id]:
+                # this is a total for a hidden page that was re-locked
+                # after scoring; it is intentionally omitted
+                pass
+            else:
+                # something else might be going on, and we should fail
+                raise
+
+    # now we want a list of lists, sorted by total score
+    final_board = [[team_names[team_id]] + list(rest.values()) for team_id, rest in l_board.items()]
+    final_board.sort(key=lambda line: line[-1], reverse=True)
+
+    # find first place winners
+    gold_medals = []
+    if len(final_board) > 0:
+        top_score = final_board[0][-1]
+        if top_score:
+            gold_medals = [line[0] for line in final_board if line[-1] == top_score]
+
+    return rounds, final_board, gold_medals
@@ -0,0 +1,39 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.archive import archivable_games, archive_game
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the teams, responses and scores of games closed for a while "
+        "into compressed archives, then clear out expired sessions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            required=True,
+            help="Archive games closed (and unedited) for at least this many days",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only list the games which would be archived",
+        )
+
+    def handle(self, *args, days, dry_run, **options):
+        for game in archivable_games(days):
+            if dry_run:
+                self.stdout.write(f"Would archive {game} ({game.id})")
+                continue
+            # one game at a time, so a failure doesn't undo the rest
+            teams, responses = archive_game(game)
+            self.stdout.write(f"Archived {game} ({game.id}): {teams} teams, {responses} responses")
+
+        if not dry_run:
+            engine = import_module(settings.SESSION_ENGINE)
+            engine.SessionStore.clear_expired()
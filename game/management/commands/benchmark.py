@@ -0,0 +1,414 @@
+"""
+Benchmarks for the hot paths, run against a synthetic game which is created
+inside a transaction and rolled back afterwards, so they're safe to run on a
+development database.
+
+    ./manage.py benchmark leaderboard --teams 500 --questions 100
+    ./manage.py benchmark leaderboard_page --teams 60 --questions 50
+    ./manage.py benchmark autograde --teams 500 --questions 20 --pages 1
+    ./manage.py benchmark sqlite_writes --teams 20 --questions 200
+    ./manage.py benchmark import --questions 1000 --pages 10
+    ./manage.py benchmark export --teams 500 --questions 100
+    ./manage.py benchmark clone --teams 0 --questions 200
+    ./manage.py benchmark archive --teams 60 --questions 50
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from game import models
+from game.grading import compile_question, grade_page, normalize
+from game.scores import rebuild_scores, response_round_totals
+from game import archive, export, importer, leaderboard as leaderboard_cache
+from game.leaderboard import compute_leaderboard_data
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+class Command(BaseCommand):
+    help = "Time the hot paths against a synthetic game (nothing is saved)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('subject', choices=sorted(BENCHMARKS))
+        parser.add_argument('--teams', type=int, default=500)
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--pages', type=int, default=10)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help="Runs per measurement; the fastest one is reported",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, subject, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            BENCHMARKS[subject](self, **options)
+            transaction.set_rollback(True)
+
+    def report(self, label, func, repeat):
+        "Time `func` (best of `repeat`), then run it once more to find its peak memory."
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            result = func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.stdout.write(
+            f"{label:<30} {min(timings) * 1000:>10.1f} ms {peak / 1024:>12.0f} KiB peak"
+        )
+        return result
+
+
+def seed_game(teams, questions, pages, graded=True):
+    "A game with every team answering every question"
+    game = models.Game.objects.create(
+        name='Benchmark',
+        state=models.Game.GameState.NO_NEW_TEAMS,
+    )
+    page_objs = models.Page.objects.bulk_create(
+        models.Page(
+            game=game,
+            order=order,
+            title=f"Round {order}",
+            state=models.Page.PageState.SCORING,
+        )
+        for order in range(1, pages + 1)
+    )
+    question_objs = models.Question.objects.bulk_create(
+        models.Question(
+            page=page_objs[n % pages],
+            order=n // pages + 1,
+            question=f"Question {n}",
+            answer=f"Answer {n}",
+            possible_points=random.randint(1, 3),
+        )
+        for n in range(questions)
+    )
+    team_objs = models.Team.objects.bulk_create(
+        models.Team(game=game, name=f"Team {n}")
+        for n in range(teams)
+    )
+    models.Response.objects.bulk_create(
+        (
+            models.Response(
+                team=team,
+                question=question,
+                value=f"Guess {team.id}",
+                graded=graded,
+                score=random.randint(0, question.possible_points) if graded else 0,
+            )
+            for team in team_objs
+            for question in question_objs
+        ),
+        batch_size=5000,
+    )
+    return game
+
+
+@benchmark('leaderboard')
+def leaderboard(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages)
+    rebuild_scores(game.id)
+    command.stdout.write(
+        f"{teams} teams x {questions} questions on {pages} pages "
+        f"({teams * questions} graded responses)"
+    )
+
+    before = command.report(
+        "per-response Python loop",
+        lambda: _leaderboard_before_totals(game),
+        repeat,
+    )
+    group_by = command.report(
+        "GROUP BY over responses",
+        lambda: compute_leaderboard_data(game, response_round_totals(game)),
+        repeat,
+    )
+    totals = command.report(
+        "maintained totals",
+        lambda: compute_leaderboard_data(game),
+        repeat,
+    )
+
+    if not (before == group_by == totals):
+        raise CommandError("The leaderboards don't match!")
+
+
+@benchmark('leaderboard_page')
+def leaderboard_page(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages)
+    rebuild_scores(game.id)
+    game.refresh_from_db()
+    team_names = list(game.team_set.values_list('name', flat=True))
+    command.stdout.write(f"{teams} teams each opening the leaderboard once")
+
+    def per_request():
+        # as the view did before boards were shared: work out the board
+        # and render its table for each team
+        for name in team_names:
+            _, lines, gold_medals = compute_leaderboard_data(game)
+            members = dict(game.team_set.values_list('name', 'members'))
+            ''.join(
+                leaderboard_cache._render_row(line, members, gold_medals, line[0] == name)
+                for line in lines
+            )
+
+    def shared():
+        leaderboard_cache.invalidate(game.id)
+        for name in team_names:
+            leaderboard_cache.get_leaderboard(game).table_rows(name)
+
+    command.report("computed per request", per_request, repeat)
+    command.report("built once, shared", shared, repeat)
+    leaderboard_cache.invalidate(game.id)
+
+
+@benchmark('import')
+def import_file(command, questions, pages, repeat, **options):
+    lines = ["# Benchmark"]
+    for page in range(1, pages + 1):
+        lines.append(f"## Round {page}")
+        for n in range(1, questions // pages + 1):
+            lines += [
+                f"{n}. Question {n} of round {page}?",
+                f"   Answer: Answer {n}",
+                f"   Also: Another answer {n}",
+                f"   Points: {random.randint(1, 3)}",
+            ]
+    text = "\n".join(lines)
+    command.stdout.write(f"{pages} pages of {questions // pages} questions, as Markdown")
+
+    command.report("import_game", lambda: importer.import_game(text, 'markdown'), repeat)
+
+
+@benchmark('export')
+def export_responses(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages)
+    command.stdout.write(f"{teams * questions} responses")
+
+    def drain(lines):
+        for _ in lines:
+            pass
+
+    command.report(
+        "CSV",
+        lambda: drain(export.csv_lines(export.response_rows(game))),
+        repeat,
+    )
+    command.report(
+        "NDJSON",
+        lambda: drain(export.ndjson_lines(export.response_rows(game))),
+        repeat,
+    )
+
+
+@benchmark('clone')
+def clone(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages)
+    command.stdout.write(f"{pages} pages of {questions // pages} questions")
+
+    command.report("clone_game", lambda: importer.clone_game(game), repeat)
+
+
+@benchmark('archive')
+def archive_game(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages)
+    rebuild_scores(game.id)
+    command.stdout.write(f"{teams} teams x {questions} questions ({teams * questions} responses)")
+
+    # a game can only be archived once, so this is timed by hand
+    start = time.perf_counter()
+    archive.archive_game(game)
+    command.stdout.write(f"{'archive_game':<30} {(time.perf_counter() - start) * 1000:>10.1f} ms")
+    stored = len(models.GameArchive.objects.get(game=game).data)
+    command.stdout.write(f"{'archive size':<30} {stored / 1024:>10.1f} KiB")
+    command.report("leaderboard from archive", lambda: leaderboard_cache._build(game.id), repeat)
+
+
+def _leaderboard_before_totals(game):
+    # compute_leaderboard_data as it was before TeamRoundScore, for comparison
+    responses = (
+        models.Response.objects
+        .select_related("team", "question", "question__page")
+        .filter(team__game=game, graded=True)
+    )
+    rounds = [
+        round.order
+        for round in (
+            game.page_set
+            .exclude(is_hidden=True, state=models.Page.PageState.LOCKED)
+        )] + ['total']
+    l_board = { t.name: {r: 0 for r in rounds} for t in game.team_set.all() }
+    for r in responses:
+        if r.question.page.order in l_board[r.team.name]:
+            l_board[r.team.name][r.question.page.order] += r.score
+            l_board[r.team.name]['total'] += r.score
+
+    final_board = [[team_name] + list(rest.values()) for team_name, rest in l_board.items()]
+    final_board.sort(key=lambda line: line[-1], reverse=True)
+
+    gold_medals = []
+    if len(final_board) > 0:
+        top_score = final_board[0][-1]
+        if top_score:
+            gold_medals = [line[0] for line in final_board if line[-1] == top_score]
+
+    return rounds, final_board, gold_medals
+
+
+@benchmark('autograde')
+def autograde(command, teams, questions, pages, repeat, **options):
+    game = seed_game(teams, questions, pages, graded=False)
+    page = game.page_set.first()
+    page_questions = list(page.question_set.all())
+
+    # mostly right, with the usual slips in case, spelling, and articles
+    variants = [
+        lambda answer: answer,
+        lambda answer: answer.upper(),
+        lambda answer: f"the {answer}",
+        lambda answer: answer[:-1],
+        lambda answer: "no idea",
+        lambda answer: f"Guess {random.randint(1, 50)}",
+    ]
+    responses = list(models.Response.objects.filter(question__page=page).select_related('question'))
+    for response in responses:
+        response.value = random.choice(variants)(response.question.answer)
+    models.Response.objects.bulk_update(responses, ['value'], batch_size=2000)
+    values = [(response.question_id, response.value) for response in responses]
+    command.stdout.write(f"{len(responses)} responses to {len(page_questions)} questions on one page")
+
+    command.report(
+        "match, re-normalizing answers",
+        lambda: _autograde_uncompiled(page_questions, values),
+        repeat,
+    )
+    command.report(
+        "match, compiled per question",
+        lambda: _autograde_compiled(page_questions, values),
+        repeat,
+    )
+
+    def regrade():
+        models.Response.objects.filter(question__page=page).update(
+            graded=False, score=0, suggested_score=None,
+        )
+        return grade_page(page)
+    scored, suggested = command.report("grade_page (with reset)", regrade, repeat)
+    command.stdout.write(f"scored {scored}, suggested {suggested}")
+
+
+def _autograde_compiled(questions, values):
+    graders = {question.id: compile_question(question) for question in questions}
+    return [graders[question_id](value) for question_id, value in values]
+
+
+def _autograde_uncompiled(questions, values):
+    # the exact-match test without compiling: normalize the answer afresh
+    # for every response
+    by_id = {question.id: question for question in questions}
+    return [
+        normalize(value) == normalize(by_id[question_id].answer)
+        for question_id, value in values
+    ]
+
+
+@benchmark('sqlite_writes')
+def sqlite_writes(command, teams, questions, **options):
+    # each team is a thread writing `questions` autosaves, each a
+    # transaction that reads before it writes, like sessions and
+    # update_or_create do
+    command.stdout.write(
+        f"{teams} concurrent writers x {questions} read-then-write transactions, "
+        "on a scratch database"
+    )
+    for label, engine, db_options in (
+        ("stock sqlite3", 'django.db.backends.sqlite3', {}),
+        ("triviagame.sqlite", 'triviagame.sqlite', {}),
+        ("  with serialize_writes", 'triviagame.sqlite', {'serialize_writes': True}),
+    ):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'writes.sqlite3')
+            seconds, errors = hammer_sqlite(engine, path, db_options, teams, questions)
+        command.stdout.write(f"{label:<30} {seconds * 1000:>10.1f} ms {errors:>8} lock errors")
+
+
+def hammer_sqlite(engine, path, db_options, writers, transactions):
+    "Returns the seconds taken and how many transactions failed on a lock"
+    alias = 'sqlite_writes'
+    # configure_settings fills in the defaults, but wants its dict keyed by 'default'
+    connections.settings[alias] = connections.configure_settings({
+        DEFAULT_DB_ALIAS: {'ENGINE': engine, 'NAME': path, 'OPTIONS': db_options},
+    })[DEFAULT_DB_ALIAS]
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE autosave (team integer, question integer, value text, "
+                "PRIMARY KEY (team, question))"
+            )
+        connections[alias].close()
+
+        errors = []
+        ready = threading.Barrier(writers + 1)
+
+        def write(team):
+            connection = connections[alias]
+            ready.wait()
+            try:
+                for n in range(transactions):
+                    try:
+                        with transaction.atomic(using=alias), connection.cursor() as cursor:
+                            key = [team, n % 10]
+                            cursor.execute(
+                                "SELECT value FROM autosave WHERE team = %s AND question = %s",
+                                key,
+                            )
+                            if cursor.fetchone():
+                                cursor.execute(
+                                    "UPDATE autosave SET value = %s WHERE team = %s AND question = %s",
+                                    [f"guess {n}", *key],
+                                )
+                            else:
+                                cursor.execute(
+                                    "INSERT INTO autosave VALUES (%s, %s, %s)",
+                                    [*key, f"guess {n}"],
+                                )
+                    except OperationalError:
+                        errors.append(n)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(team,)) for team in range(writers)]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, len(errors)
+    finally:
+        del connections[alias]
+        del connections.settings[alias]
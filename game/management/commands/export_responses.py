@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from game import export
+from game.models import Game
+
+
+class Command(BaseCommand):
+    help = "Write every response in a game as CSV or NDJSON, one row per response."
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_id', type=int)
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument(
+            '--output',
+            '-o',
+            help="File to write (default: standard output)",
+        )
+
+    def handle(self, *args, game_id, format, output, **options):
+        game = Game.objects.filter(pk=game_id).first()
+        if game is None:
+            raise CommandError(f"No such game: {game_id}")
+
+        lines, _ = export.FORMATS[format]
+        rows = export.response_rows(game)
+        if output:
+            with open(output, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(lines(rows))
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from game import importer
+from host.permissions import grant_game_perms
+
+
+class Command(BaseCommand):
+    help = "Create a game, with all its pages and questions, from a JSON, CSV, or Markdown file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path)
+        parser.add_argument(
+            '--format',
+            choices=sorted(importer.FORMATS),
+            help="The file's format (default: from its extension)",
+        )
+        parser.add_argument('--name', help="Name for the game, instead of the file's")
+        parser.add_argument(
+            '--host',
+            action='append',
+            default=[],
+            help="Username to make a host of the game (may be repeated)",
+        )
+
+    def handle(self, *args, path, format, name, host, **options):
+        format = format or importer.format_for(path.name)
+        if format is None:
+            raise CommandError(f"Can't tell the format of {path}; use --format.")
+
+        User = get_user_model()
+        hosts = list(User.objects.filter(username__in=host))
+        missing = set(host) - {user.username for user in hosts}
+        if missing:
+            raise CommandError(f"No such user(s): {', '.join(sorted(missing))}")
+
+        try:
+            text = path.read_text(encoding='utf-8-sig')
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f"Can't read {path}: {e}")
+
+        try:
+            with transaction.atomic():
+                game = importer.import_game(text, format, name=name, default_name=path.stem)
+                for user in hosts:
+                    grant_game_perms(user, game)
+        except ValidationError as e:
+            raise CommandError("\n".join([f"Can't import {path}:", *e.messages]))
+
+        self.stdout.write(
+            f"Imported {game} ({game.id}) with {game.page_set.count()} pages"
+        )
@@ -0,0 +1,309 @@
+"""
+Simulates a game night against a running server, to see how many teams it
+can carry. It seeds a game straight into the database, so point it at a
+server sharing this project's database:
+
+    ./manage.py runserver                  # or: uvicorn triviagame.asgi:application
+    ./manage.py loadgen --teams 100 --duration 120
+
+Each simulated team joins and creates a team like a browser would, polls
+the page list, loads the open round's answer sheet, types answers a few
+characters at a time, and keeps an eye on the leaderboard. The seeded game
+is deleted afterwards unless you pass --keep.
+"""
+import asyncio
+import random
+import re
+import ssl
+import statistics
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+
+from game import models
+
+
+class Command(BaseCommand):
+    help = "Drive simulated teams against a running server and report latencies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='?', default='http://127.0.0.1:8000')
+        parser.add_argument('--teams', type=int, default=50)
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=60,
+            help="Seconds to keep playing once every team has joined",
+        )
+        parser.add_argument('--questions', type=int, default=10)
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=3,
+            help="Seconds between page list polls, as the browser does",
+        )
+        parser.add_argument(
+            '--typing',
+            type=float,
+            default=1.5,
+            help="Average seconds between a team's autosaves",
+        )
+        parser.add_argument(
+            '--leaderboard',
+            type=float,
+            default=30,
+            help="Average seconds between a team's leaderboard visits",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help="Leave the seeded game in the database afterwards",
+        )
+
+    def handle(self, *args, url, teams, **options):
+        random.seed(options['seed'])
+        game, questions = _seed_game(options['questions'])
+        self.stdout.write(f"Seeded game {game.id} with {len(questions)} questions")
+
+        stats = Stats()
+        try:
+            asyncio.run(_run(url, game, questions, teams, stats, options))
+        finally:
+            if options['keep']:
+                self.stdout.write(f"Kept game {game.id}")
+            else:
+                _delete_game(game)
+
+        self.stdout.write(stats.report())
+
+
+def _seed_game(question_count):
+    game = models.Game.objects.create(
+        name='Load test',
+        state=models.Game.GameState.ACCEPTING_TEAMS,
+    )
+    page = models.Page.objects.create(
+        game=game,
+        order=1,
+        title="Round 1",
+        state=models.Page.PageState.OPEN,
+    )
+    # a locked round, so the page list has a little of everything
+    models.Page.objects.create(game=game, order=2, title="Round 2")
+    questions = models.Question.objects.bulk_create(
+        models.Question(page=page, order=n, question=f"Question {n}", answer=f"Answer {n}")
+        for n in range(1, question_count + 1)
+    )
+    return game, questions
+
+
+def _delete_game(game):
+    # questions protect their pages, so they go first
+    with transaction.atomic():
+        models.Question.objects.filter(page__game=game).delete()
+        game.delete()
+
+
+async def _run(url, game, questions, teams, stats, options):
+    loop = asyncio.get_running_loop()
+    players = [Player(url, stats, n) for n in range(teams)]
+
+    # stagger joining over a few seconds, like people clicking a link
+    await asyncio.gather(*(
+        player.join(game, delay=random.uniform(0, min(10, teams / 10)))
+        for player in players
+    ))
+
+    deadline = loop.time() + options['duration']
+    await asyncio.gather(*(
+        player.play(questions, deadline, options)
+        for player in players
+        if player.joined
+    ))
+
+
+class Stats:
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok):
+        self.timings[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def report(self):
+        lines = [
+            f"{'endpoint':<20} {'requests':>9} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+        ]
+        for name, timings in sorted(self.timings.items()):
+            if len(timings) > 1:
+                cuts = statistics.quantiles(timings, n=100, method='inclusive')
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = timings[0]
+            error_rate = self.errors[name] / len(timings)
+            lines.append(
+                f"{name:<20} {len(timings):>9} {error_rate:>8.1%} "
+                f"{p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {p99 * 1000:>9.1f}"
+            )
+        return "\n".join(lines)
+
+
+class Player:
+    "One team's browser"
+
+    def __init__(self, url, stats, number):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.stats = stats
+        self.number = number
+        self.cookies = {}
+        self.joined = False
+
+    async def join(self, game, delay):
+        await asyncio.sleep(delay)
+        # picks up the CSRF cookie
+        await self.get('join_game', reverse('join_game'))
+        await self.post('join_game', reverse('join_game'), {
+            'id': game.id,
+            'code': game.passcode,
+        })
+        status, _, _ = await self.post('create_team', reverse('create_team'), {
+            'name': f"Load team {self.number}",
+            'members': "Some bots",
+        })
+        self.joined = status == 302
+        if self.joined:
+            await self.get('play', reverse('play'))
+
+    async def play(self, questions, deadline, options):
+        await asyncio.gather(
+            self._poll(deadline, options['poll']),
+            self._answer(questions, deadline, options['typing']),
+            self._check_leaderboard(deadline, options['leaderboard']),
+        )
+
+    async def _poll(self, deadline, interval):
+        loop = asyncio.get_running_loop()
+        etag = None
+        while loop.time() < deadline:
+            await asyncio.sleep(interval)
+            headers = {'HX-Request': 'true'}
+            if etag:
+                headers['If-None-Match'] = etag
+            _, response_headers, _ = await self.get(
+                'page_list_hx', reverse('page_list_hx'), headers,
+            )
+            etag = response_headers.get('etag', etag)
+
+    async def _answer(self, questions, deadline, typing):
+        loop = asyncio.get_running_loop()
+        await self.get('answer_sheet', reverse('answer_sheet', args=(1,)))
+        await self.get(
+            'page_questions_hx',
+            reverse('page_questions_hx', args=(1,)),
+            {'HX-Request': 'true'},
+        )
+
+        questions = random.sample(questions, len(questions))
+        for question in questions:
+            answer = f"Guess {random.randint(1, 10000)} from {self.number}"
+            # autosave fires as they type, a few characters at a time
+            for end in range(4, len(answer) + 4, 4):
+                if loop.time() >= deadline:
+                    return
+                await asyncio.sleep(random.expovariate(1 / typing))
+                await self.post(
+                    'respond',
+                    reverse('respond', args=(question.id,)),
+                    {'response_value': answer[:end]},
+                    {'HX-Request': 'true'},
+                )
+
+    async def _check_leaderboard(self, deadline, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(random.expovariate(1 / interval))
+            if loop.time() >= deadline:
+                return
+            await self.get('leaderboard', reverse('leaderboard'))
+
+    async def get(self, name, path, headers=None):
+        return await self.request(name, 'GET', path, headers=headers)
+
+    async def post(self, name, path, data, headers=None):
+        headers = dict(headers or {})
+        headers['X-CSRFToken'] = self.cookies.get('csrftoken', '')
+        data = dict(data, csrfmiddlewaretoken=self.cookies.get('csrftoken', ''))
+        return await self.request(name, 'POST', path, data, headers)
+
+    async def request(self, name, method, path, data=None, headers=None):
+        "Returns (status, headers, body); the status is None if the request failed"
+        body = urlencode(data).encode() if data is not None else b''
+        lines = [
+            # HTTP/1.0 and a connection per request keeps this simple: no
+            # chunked bodies, and the body ends when the server hangs up
+            f"{method} {path} HTTP/1.0",
+            f"Host: {self.host}:{self.port}",
+            "Connection: close",
+            f"Referer: http{'s' if self.ssl else ''}://{self.host}:{self.port}{path}",
+        ]
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        if data is not None:
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+            lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+        raw_request = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(30):
+                reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+                try:
+                    writer.write(raw_request)
+                    await writer.drain()
+                    raw_response = await reader.read()
+                finally:
+                    writer.close()
+        except (OSError, TimeoutError):
+            self.stats.record(name, time.perf_counter() - start, ok=False)
+            return None, {}, b''
+        elapsed = time.perf_counter() - start
+
+        status, response_headers, response_body = self._parse(raw_response)
+        self.stats.record(name, elapsed, ok=status is not None and status < 400)
+        return status, response_headers, response_body
+
+    def _parse(self, raw_response):
+        head, _, body = raw_response.partition(b"\r\n\r\n")
+        head_lines = head.decode('latin-1').split("\r\n")
+        match = re.match(r"HTTP/\d\.\d (\d{3})", head_lines[0])
+        if not match:
+            return None, {}, b''
+
+        headers = {}
+        for line in head_lines[1:]:
+            key, _, value = line.partition(":")
+            key, value = key.strip().lower(), value.strip()
+            if key == 'set-cookie':
+                cookie = SimpleCookie()
+                cookie.load(value)
+                for morsel in cookie.values():
+                    if morsel.value:
+                        self.cookies[morsel.key] = morsel.value
+                    else:
+                        # an expired cookie, like the emptied message store
+                        self.cookies.pop(morsel.key, None)
+            else:
+                headers[key] = value
+        return int(match.group(1)), headers, body
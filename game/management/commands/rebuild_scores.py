@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from game.models import Game
+from game.scores import find_drift, rebuild_scores
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-team, per-round totals which the leaderboard reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'game_ids',
+            nargs='*',
+            type=int,
+            help="Games to rebuild (default: all of them)",
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report totals which disagree with the responses",
+        )
+
+    def handle(self, *args, game_ids, check, **options):
+        games = Game.objects.order_by('id')
+        if game_ids:
+            games = games.filter(pk__in=game_ids)
+            missing = set(game_ids) - set(games.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"No such game(s): {', '.join(map(str, sorted(missing)))}")
+
+        drifted = 0
+        for game in games:
+            if check:
+                drift = find_drift(game)
+                for (team_id, page_order), (maintained, summed) in sorted(drift.items()):
+                    self.stdout.write(
+                        f"{game} ({game.id}): team {team_id}, round {page_order} "
+                        f"has {maintained} points but its responses add up to {summed}"
+                    )
+                drifted += bool(drift)
+            else:
+                rebuild_scores(game.id)
+                self.stdout.write(f"Rebuilt scores for {game} ({game.id})")
+
+        if drifted:
+            raise CommandError(f"{drifted} game(s) need their scores rebuilt")
@@ -0,0 +1,48 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_team_round_scores(apps, schema_editor):
+    Response = apps.get_model('game', 'Response')
+    TeamRoundScore = apps.get_model('game', 'TeamRoundScore')
+    rows = (
+        Response.objects
+        .filter(graded=True)
+        .values('team_id', 'question__page_id')
+        .annotate(points=models.Sum('score'))
+        .order_by()
+    )
+    TeamRoundScore.objects.bulk_create(
+        TeamRoundScore(
+            team_id=row['team_id'],
+            page_id=row['question__page_id'],
+            points=row['points'],
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0018_game_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamRoundScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField(default=0)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.page')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.team')),
+            ],
+            options={
+                'ordering': ['page', 'team'],
+                'constraints': [models.UniqueConstraint(fields=('team', 'page'), name='one_score_per_team_round')],
+            },
+        ),
+        migrations.RunPython(fill_team_round_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0019_team_round_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='results_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
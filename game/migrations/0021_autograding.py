@@ -0,0 +1,29 @@
+# Generated by Django 6.1.2 on 2026-10-18 20:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0020_game_results_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='accepted_answers',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='numeric_tolerance',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(limit_value=0)]),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='suggested_score',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.1.2 on 2026-10-18 21:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0021_autograding'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='response',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game.question'),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='team',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game.team'),
+        ),
+        migrations.AlterField(
+            model_name='teamroundscore',
+            name='page',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game.page'),
+        ),
+        migrations.AlterField(
+            model_name='teamroundscore',
+            name='team',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='game.team'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['question', 'graded', 'team', 'score'], name='response_by_question'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['team', 'graded', 'question', 'score'], name='response_by_team'),
+        ),
+        migrations.AddIndex(
+            model_name='teamroundscore',
+            index=models.Index(fields=['page', 'team', 'points'], name='round_score_by_page'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.1.2 on 2026-10-18 21:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0022_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='game.game')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -24,6 +24,10 @@ class Game(models.Model):
         blank=True,
         editable=False,
     )
+    # bumped whenever something players can see about the game changes
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # bumped whenever scores change or teams are added, edited, or removed
+    results_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['-last_edit_time']
@@ -33,6 +37,31 @@ class Game(models.Model):
 
     def __str__(self):
         return self.name
+
+    # only ever changed by the bumps below
+    COUNTERS = ('version', 'results_version')
+
+    def save(self, *args, **kwargs):
+        # what was loaded may be stale by now, and writing it back would
+        # repeat versions already handed out as ETags
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_version(cls, game_id):
+        # done in the database so concurrent bumps can't be lost
+        cls.objects.filter(pk=game_id).update(version=models.F('version') + 1)
+
+    @classmethod
+    def bump_results_version(cls, game_id):
+        cls.objects.filter(pk=game_id).update(
+            results_version=models.F('results_version') + 1,
+        )
     
     @property
     def is_closed(self):
@@ -176,6 +205,14 @@ class Question(models.Model):
         default=1,
         validators=[MinValueValidator(limit_value=1)],
     )
+    # more answers for automatic grading to accept, one per line
+    accepted_answers = models.TextField(blank=True)
+    # how far off a numeric answer may be and still count
+    numeric_tolerance = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(limit_value=0)],
+    )
 
     def __str__(self):
         return f"{self.order}. {self.question}"
@@ -192,13 +229,23 @@ class Question(models.Model):
     def points_range(self):
         return range(0, self.possible_points + 1)
 
+    def response_groups(self):
+        "Responses grouped by their answer, ignoring case and accents, biggest group first"
+        # grading imports this module
+        from .grading import group_responses
+        return group_responses(self.response_set.all())
+
 
 class Response(models.Model):
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    # the composite indexes below start with these, so single-column
+    # indexes would only slow down autosaves
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, db_index=False)
     value = models.CharField(max_length=100)
     graded = models.BooleanField(default=False)
     score = models.SmallIntegerField(default=0)
+    # proposed by automatic grading when it isn't sure; see game/grading.py
+    suggested_score = models.SmallIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.value
@@ -211,3 +258,61 @@ class Response(models.Model):
                 name='one_answer_per_team',
             ),
         ]
+        indexes = [
+            # game.json, response totals, and grading, by question; they
+            # cover everything but grading's `value`
+            models.Index(
+                fields=['question', 'graded', 'team', 'score'],
+                name='response_by_question',
+            ),
+            # refreshing a team's round total
+            models.Index(
+                fields=['team', 'graded', 'question', 'score'],
+                name='response_by_team',
+            ),
+        ]
+
+
+class TeamRoundScore(models.Model):
+    "A team's total graded score on one page, kept up to date by scoring"
+    # covered by the unique constraint
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, db_index=False)
+    # covered by the index below
+    page = models.ForeignKey(Page, on_delete=models.CASCADE, db_index=False)
+    points = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.team} :: {self.page.order}. {self.points}"
+
+    class Meta:
+        ordering = ['page', 'team']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['team', 'page'],
+                name='one_score_per_team_round',
+            ),
+        ]
+        indexes = [
+            # the leaderboard reads every total on a game's pages
+            models.Index(
+                fields=['page', 'team', 'points'],
+                name='round_score_by_page',
+            ),
+        ]
+
+
+class GameArchive(models.Model):
+    """A finished game's teams, responses and scores, moved out of the hot
+    tables by `archive_games`; see game/archive.py"""
+    game = models.OneToOneField(
+        Game,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='archive',
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+    # zlib-compressed JSON
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.game} (archived {self.archived_at:%Y-%m-%d})"
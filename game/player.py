@@ -0,0 +1,56 @@
+"""
+Works out which game and team the player's session belongs to, at most
+once per request: every view and helper that calls `get_player` shares the
+first call's lookup.
+
+The lookups always go to the primary, even in a `reads_from_replica` view:
+a lagging replica can be missing a team that was just created, and a
+missing team gets dropped from the session.
+"""
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Game, Team
+
+
+def get_player(request):
+    "The session's (game, team); either may be None"
+    try:
+        return request._cached_player
+    except AttributeError:
+        request._cached_player = _load_player(request.session)
+        return request._cached_player
+
+
+def _load_player(session):
+    # one query (the team with its game) for a player in good standing;
+    # the rest only happens when the session has gone stale
+    game_id = session.get('game')
+    team_id = session.get('team')
+
+    team = None
+    if team_id is not None:
+        team = Team.objects.using(DEFAULT_DB_ALIAS).select_related('game').filter(pk=team_id).first()
+        if team is None:
+            del session['team']
+
+    if team and game_id is not None and team.game_id != int(game_id):
+        # somehow in a team from a different game; the game wins, if it's
+        # still around
+        game = Game.objects.using(DEFAULT_DB_ALIAS).filter(pk=game_id).first()
+        if game:
+            del session['team']
+            return game, None
+
+    if team:
+        if game_id is None or team.game_id != int(game_id):
+            # somehow only in a team, so put them back in its game
+            session['game'] = team.game_id
+        return team.game, team
+
+    if game_id is None:
+        return None, None
+
+    game = Game.objects.using(DEFAULT_DB_ALIAS).filter(pk=game_id).first()
+    if game is None:
+        del session['game']
+    return game, None
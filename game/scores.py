@@ -0,0 +1,134 @@
+"""
+Keeps `TeamRoundScore`, the per-team, per-page score totals which the
+leaderboard reads, in step with graded responses.
+
+Anything that changes a response's `score` or `graded` must refresh the
+affected totals in the same transaction.
+"""
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Game, Response, TeamRoundScore
+
+
+def refresh_team_round_score(team_id, page_id):
+    points = (
+        Response.objects
+        .filter(team_id=team_id, question__page_id=page_id, graded=True)
+        .aggregate(points=Sum('score'))
+    ).get('points', None) or 0
+
+    TeamRoundScore.objects.update_or_create(
+        team_id=team_id,
+        page_id=page_id,
+        defaults={'points': points},
+    )
+    # the game which has this page
+    Game.objects.filter(page=page_id).update(
+        results_version=F('results_version') + 1,
+    )
+
+
+def refresh_team_round_scores(team_page_ids):
+    "Like `refresh_team_round_score`, for many (team id, page id) pairs at once"
+    team_page_ids = set(team_page_ids)
+    if not team_page_ids:
+        return
+
+    team_ids = {team_id for team_id, _ in team_page_ids}
+    page_ids = {page_id for _, page_id in team_page_ids}
+    sums = {
+        (team_id, page_id): points
+        for team_id, page_id, points in (
+            Response.objects
+            .filter(team_id__in=team_ids, question__page_id__in=page_ids, graded=True)
+            .values('team_id', 'question__page_id')
+            .annotate(points=Sum('score'))
+            .order_by()
+            .values_list('team_id', 'question__page_id', 'points')
+        )
+    }
+
+    TeamRoundScore.objects.bulk_create(
+        [
+            TeamRoundScore(team_id=team_id, page_id=page_id, points=sums.get((team_id, page_id), 0))
+            for team_id, page_id in team_page_ids
+        ],
+        update_conflicts=True,
+        unique_fields=['team', 'page'],
+        update_fields=['points'],
+    )
+    Game.objects.filter(page__in=page_ids).update(
+        results_version=F('results_version') + 1,
+    )
+
+
+def team_round_totals(game):
+    "(team id, page order, points) rows from the maintained totals"
+    return (
+        TeamRoundScore.objects
+        .filter(page__game=game)
+        .values_list('team_id', 'page__order', 'points')
+    )
+
+
+def response_round_totals(game):
+    "Like `team_round_totals`, but summed by the database from the responses"
+    return (
+        Response.objects
+        .filter(question__page__game=game, graded=True)
+        .values('team_id', 'question__page__order')
+        .annotate(points=Sum('score'))
+        .order_by()
+        .values_list('team_id', 'question__page__order', 'points')
+    )
+
+
+def find_drift(game):
+    """Maintained totals which disagree with the responses, as a dict of
+    (team id, page order) -> (maintained points, summed points)."""
+    def nonzero(rows):
+        return {
+            (team_id, page_order): points
+            for team_id, page_order, points in rows
+            if points
+        }
+    maintained = nonzero(team_round_totals(game))
+    summed = nonzero(response_round_totals(game))
+
+    return {
+        key: (maintained.get(key, 0), summed.get(key, 0))
+        for key in maintained.keys() | summed.keys()
+        if maintained.get(key, 0) != summed.get(key, 0)
+    }
+
+
+def rebuild_scores(game_id, page_id=None):
+    "Recompute every total for a game (or just one of its pages) from scratch."
+    responses = Response.objects.filter(
+        question__page__game_id=game_id,
+        graded=True,
+    )
+    totals = TeamRoundScore.objects.filter(page__game_id=game_id)
+    if page_id is not None:
+        responses = responses.filter(question__page_id=page_id)
+        totals = totals.filter(page_id=page_id)
+
+    rows = (
+        responses
+        .values('team_id', 'question__page_id')
+        .annotate(points=Sum('score'))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        totals.delete()
+        TeamRoundScore.objects.bulk_create(
+            TeamRoundScore(
+                team_id=row['team_id'],
+                page_id=row['question__page_id'],
+                points=row['points'],
+            )
+            for row in rows
+        )
+        Game.bump_results_version(game_id)
@@ -1,10 +1,12 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from guardian.shortcuts import assign_perm
 
 
-from .models import Game
+from . import leaderboard, snapshot
+from .models import Game, Page, Question, Team
 
 
 User = get_user_model()
@@ -15,3 +17,47 @@ def grant_game_create(sender, **kwargs):
     if kwargs['created']:
         new_user = kwargs['instance']
         assign_perm('game.add_game', new_user)
+
+
+# Any change to a game, its pages, or its questions gets a new version,
+# which player polls use as their ETag, and drops the game's snapshot.
+
+def _game_changed(game_id):
+    Game.bump_version(game_id)
+    snapshot.invalidate(game_id)
+    # a snapshot rebuilt mid-transaction may hold uncommitted rows
+    transaction.on_commit(lambda: snapshot.invalidate(game_id))
+
+
+@receiver(post_save, sender=Game)
+def game_saved(sender, instance, created, **kwargs):
+    if created:
+        # ids can be reused after a rollback
+        snapshot.invalidate(instance.pk)
+        leaderboard.invalidate(instance.pk)
+    else:
+        _game_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Game)
+def game_deleted(sender, instance, **kwargs):
+    snapshot.invalidate(instance.pk)
+    leaderboard.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, instance, **kwargs):
+    _game_changed(instance.game_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    _game_changed(instance.page.game_id)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_changed(sender, instance, **kwargs):
+    Game.bump_results_version(instance.game_id)
@@ -0,0 +1,114 @@
+"""
+Per-worker cache of a game's structure -- the game, its pages, and their
+questions -- for the player views, which read it far more often than hosts
+change it.
+
+Snapshots are dropped by signal handlers when anything in the game is saved
+or deleted. Changes made by other worker processes are caught by comparing
+the cached game's version with the database's.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from .models import Game, Page, Question
+
+
+# games kept per worker; a night of trivia only has a handful open
+_MAX_SNAPSHOTS = 16
+
+_lock = threading.Lock()
+_snapshots: OrderedDict[int, 'GameSnapshot'] = OrderedDict()
+
+
+@dataclass(frozen=True)
+class GameSnapshot:
+    """The model instances here are shared between requests. Treat them as
+    read-only; their related objects are all preloaded."""
+    game: Game
+    pages: tuple[Page, ...]
+    questions: Mapping[int, Question]
+
+    def page(self, order):
+        for page in self.pages:
+            if page.order == order:
+                return page
+        return None
+
+    def question(self, question_id):
+        return self.questions.get(question_id)
+
+
+def get_snapshot(game_id, version=None):
+    """Snapshot of game `game_id`, or None if there's no such game.
+
+    Pass the game's current `version` when you already have it; otherwise
+    it's looked up so that snapshots from before another process's change
+    aren't served."""
+    if version is None:
+        version = (
+            Game.objects
+            .filter(pk=game_id)
+            .values_list('version', flat=True)
+            .first()
+        )
+        if version is None:
+            return None
+
+    return _cached(game_id, version) or _store(game_id, _build(game_id))
+
+
+def invalidate(game_id):
+    with _lock:
+        _snapshots.pop(game_id, None)
+
+
+def _cached(game_id, version):
+    with _lock:
+        snapshot = _snapshots.get(game_id)
+        if snapshot and snapshot.game.version == version:
+            _snapshots.move_to_end(game_id)
+            return snapshot
+    return None
+
+
+def _store(game_id, snapshot):
+    if snapshot:
+        with _lock:
+            _snapshots[game_id] = snapshot
+            _snapshots.move_to_end(game_id)
+            while len(_snapshots) > _MAX_SNAPSHOTS:
+                _snapshots.popitem(last=False)
+    return snapshot
+
+
+def _build(game_id):
+    # two queries: pages (with their game), then all of their questions
+    pages = list(
+        Page.objects
+        .filter(game_id=game_id)
+        .select_related('game')
+        .prefetch_related('question_set')
+    )
+
+    if pages:
+        game = pages[0].game
+    else:
+        game = Game.objects.filter(pk=game_id).first()
+        if game is None:
+            return None
+
+    questions = {}
+    for page in pages:
+        # every page should share one game instance
+        page.game = game
+        for question in page.question_set.all():
+            questions[question.id] = question
+
+    return GameSnapshot(
+        game=game,
+        pages=tuple(pages),
+        questions=MappingProxyType(questions),
+    )
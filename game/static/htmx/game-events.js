@@ -0,0 +1,24 @@
+// Listens to the server's game event stream and turns each event into a
+// `gameChanged` event on <body>. While the stream is connected, polling
+// triggers guarded by `[!window.gameEventsConnected]` stay quiet; if the
+// stream drops, polling picks back up on its own.
+window.gameEventsConnected = false;
+
+(() => {
+  const elem = htmx.find("[data-game-events]");
+  if (!elem || !window.EventSource) {
+    return;
+  }
+
+  const source = new EventSource(elem.dataset.gameEvents);
+  source.onopen = () => {
+    window.gameEventsConnected = true;
+  };
+  source.onerror = () => {
+    // EventSource retries by itself unless the server told it to stop
+    window.gameEventsConnected = false;
+  };
+  source.addEventListener("gameChanged", () => {
+    htmx.trigger(document.body, "gameChanged");
+  });
+})();
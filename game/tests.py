@@ -1,8 +1,34 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from guardian.shortcuts import assign_perm
+
+from game import autosave, events, grading, importer, leaderboard, models, snapshot
+from game.management.commands import loadgen
+from game.management.commands import benchmark
+from game.management.commands.benchmark import hammer_sqlite
+from game.scores import rebuild_scores, refresh_team_round_score, response_round_totals
+from game.leaderboard import compute_leaderboard_data
+from triviagame.sqlite import base as sqlite_base
 
-from game import models
-from game.views import compute_leaderboard_data
+User = get_user_model()
 
 
 class HomeViewTests(TestCase):
@@ -24,6 +50,33 @@ class HomeViewTests(TestCase):
         self.assertNotIn('team', self.client.session)
 
 
+    def test_home_puts_a_lone_team_back_in_its_game(self):
+        game = models.Game.objects.create(name='Game', state=models.Game.GameState.ACCEPTING_TEAMS)
+        team = models.Team.objects.create(game=game, name='Team')
+
+        session = self.client.session
+        session['team'] = team.id
+        session.save()
+
+        response = self.client.get(reverse('home'))
+
+        self.assertEqual(response.context['game'], game)
+        self.assertEqual(self.client.session['game'], game.id)
+
+    def test_player_views_look_up_the_player_once(self):
+        game = models.Game.objects.create(name='Game', state=models.Game.GameState.ACCEPTING_TEAMS)
+        team = models.Team.objects.create(game=game, name='Team')
+        session = self.client.session
+        session['game'] = game.id
+        session['team'] = team.id
+        session.save()
+        self.client.get(reverse('play'))  # warm the snapshot
+
+        with self.assertNumQueries(2):  # session, team with its game
+            response = self.client.get(reverse('page_list_hx'), HTTP_HX_REQUEST='true')
+
+        self.assertEqual(response.status_code, 200)
+
 class ModelPropertyTests(TestCase):
     def test_page_total_points_sums_question_points(self):
         game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
@@ -61,12 +114,17 @@ class ComputeLeaderboardDataTests(TestCase):
         models.Response.objects.create(team=team_alpha, question=visible_question, value='a', graded=True, score=5)
         models.Response.objects.create(team=team_beta, question=visible_question, value='b', graded=True, score=3)
         models.Response.objects.create(team=team_alpha, question=hidden_question, value='h', graded=True, score=9)
+        rebuild_scores(game.id)
 
         rounds, leaderboard, gold_medals = compute_leaderboard_data(game)
 
         self.assertEqual(rounds, [1, 'total'])
         self.assertEqual(leaderboard, [['Alpha', 5, 5], ['Beta', 3, 3]])
         self.assertEqual(gold_medals, ['Alpha'])
+        self.assertEqual(
+            compute_leaderboard_data(game, response_round_totals(game)),
+            (rounds, leaderboard, gold_medals),
+        )
 
     def test_compute_leaderboard_returns_all_first_place_teams_when_tied(self):
         game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
@@ -77,7 +135,833 @@ class ComputeLeaderboardDataTests(TestCase):
 
         models.Response.objects.create(team=team_alpha, question=question, value='a', graded=True, score=4)
         models.Response.objects.create(team=team_beta, question=question, value='b', graded=True, score=4)
+        rebuild_scores(game.id)
 
         _, _, gold_medals = compute_leaderboard_data(game)
 
         self.assertEqual(gold_medals, ['Alpha', 'Beta'])
+
+    def test_response_totals_are_one_grouped_query(self):
+        game = models.Game.objects.create(name='Trivia')
+        team = models.Team.objects.create(game=game, name='Alpha')
+        page = models.Page.objects.create(game=game, order=1, title='Round 1')
+        for order in (1, 2, 3):
+            question = models.Question.objects.create(page=page, order=order, question=f'Q{order}')
+            models.Response.objects.create(team=team, question=question, value='a', graded=True, score=1)
+
+        with self.assertNumQueries(1):
+            totals = list(response_round_totals(game))
+
+        self.assertEqual(totals, [(team.id, 1, 3)])
+
+
+class TeamRoundScoreTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia')
+        self.team = models.Team.objects.create(game=self.game, name='Team')
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1')
+        self.q1 = models.Question.objects.create(page=self.page, order=1, question='Q1', possible_points=3)
+        self.q2 = models.Question.objects.create(page=self.page, order=2, question='Q2')
+
+    def test_refresh_sums_only_graded_responses(self):
+        models.Response.objects.create(team=self.team, question=self.q1, value='a', graded=True, score=3)
+        models.Response.objects.create(team=self.team, question=self.q2, value='b', graded=False, score=0)
+
+        refresh_team_round_score(self.team.id, self.page.id)
+
+        total = models.TeamRoundScore.objects.get(team=self.team, page=self.page)
+        self.assertEqual(total.points, 3)
+
+    def test_rebuild_command_replaces_stale_totals(self):
+        models.TeamRoundScore.objects.create(team=self.team, page=self.page, points=99)
+        models.Response.objects.create(team=self.team, question=self.q2, value='b', graded=True, score=1)
+
+        call_command('rebuild_scores', self.game.id, stdout=StringIO())
+
+        total = models.TeamRoundScore.objects.get(team=self.team, page=self.page)
+        self.assertEqual(total.points, 1)
+
+    def test_rebuild_command_check_reports_drift_without_fixing_it(self):
+        models.TeamRoundScore.objects.create(team=self.team, page=self.page, points=99)
+        out = StringIO()
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_scores', '--check', stdout=out)
+
+        self.assertIn('has 99 points but its responses add up to 0', out.getvalue())
+        self.assertEqual(models.TeamRoundScore.objects.get(team=self.team, page=self.page).points, 99)
+
+
+class PlayerPollETagTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.team = models.Team.objects.create(game=self.game, name='Team')
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1')
+
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = self.team.id
+        session.save()
+
+    def test_unchanged_game_answers_page_list_poll_with_304(self):
+        first = self.client.get(reverse('page_list_hx'), HTTP_HX_REQUEST='true')
+        self.assertEqual(first.status_code, 200)
+
+        with self.assertNumQueries(2):  # session, game version
+            second = self.client.get(
+                reverse('page_list_hx'),
+                HTTP_HX_REQUEST='true',
+                HTTP_IF_NONE_MATCH=first['ETag'],
+            )
+
+        self.assertEqual(second.status_code, 304)
+
+    def test_page_changes_bump_the_version_and_the_etag(self):
+        first = self.client.get(reverse('page_list_hx'), HTTP_HX_REQUEST='true')
+        self.game.refresh_from_db()
+        old_version = self.game.version
+
+        self.page.state = models.Page.PageState.OPEN
+        self.page.save()
+        self.game.refresh_from_db()
+        second = self.client.get(
+            reverse('page_list_hx'),
+            HTTP_HX_REQUEST='true',
+            HTTP_IF_NONE_MATCH=first['ETag'],
+        )
+
+        self.assertEqual(self.game.version, old_version + 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+
+class GameSnapshotTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1')
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1')
+        self.game.refresh_from_db()
+
+    def test_snapshot_is_built_in_two_queries_then_served_from_cache(self):
+        with self.assertNumQueries(2):
+            built = snapshot.get_snapshot(self.game.id, self.game.version)
+        with self.assertNumQueries(0):
+            cached = snapshot.get_snapshot(self.game.id, self.game.version)
+            self.assertEqual(cached.page(1).mystery_description(), self.page.mystery_description())
+            self.assertEqual(cached.question(self.question.id).page.title, 'Round 1')
+
+        self.assertIs(built, cached)
+
+    def test_saving_a_page_replaces_the_snapshot(self):
+        before = snapshot.get_snapshot(self.game.id)
+
+        self.page.state = models.Page.PageState.OPEN
+        self.page.save()
+        after = snapshot.get_snapshot(self.game.id)
+
+        self.assertIsNot(before, after)
+        self.assertTrue(after.page(1).is_open)
+
+    def test_stale_version_from_another_process_is_rebuilt(self):
+        before = snapshot.get_snapshot(self.game.id)
+
+        # another process's bump never reaches our signal handlers
+        models.Game.bump_version(self.game.id)
+
+        self.assertIsNot(before, snapshot.get_snapshot(self.game.id))
+
+    def test_players_cannot_load_questions_from_other_games(self):
+        other_game = models.Game.objects.create(name='Other', state=models.Game.GameState.ACCEPTING_TEAMS)
+        other_page = models.Page.objects.create(game=other_game, order=1, title='Other', state=models.Page.PageState.OPEN)
+        other_question = models.Question.objects.create(page=other_page, order=1, question='Other Q')
+        team = models.Team.objects.create(game=self.game, name='Team')
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = team.id
+        session.save()
+
+        response = self.client.get(reverse('question_hx', args=(other_question.id,)))
+
+        self.assertEqual(response['HX-Redirect'], reverse('play'))
+
+
+class LeaderboardCacheTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1')
+        self.team = models.Team.objects.create(game=self.game, name='Alpha', members='Ann')
+        self.other_team = models.Team.objects.create(game=self.game, name='Beta', members='Bob')
+        self.response = models.Response.objects.create(team=self.team, question=self.question, value='a')
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = self.team.id
+        session.save()
+
+    def test_players_share_one_board_with_their_own_row_highlighted(self):
+        self.client.get(reverse('leaderboard'))  # build the board
+
+        with self.assertNumQueries(2):  # session, team with its game
+            response = self.client.get(reverse('leaderboard'))
+
+        self.assertContains(response, '👉 <u>Alpha</u> 👈', html=True)
+        self.assertNotContains(response, '👉 <u>Beta')
+        self.assertContains(response, '<td>Bob</td>', html=True)
+
+    def test_scoring_builds_a_new_board(self):
+        self.game.refresh_from_db()
+        before = leaderboard.get_leaderboard(self.game)
+        self.assertEqual(before.gold_medals, [])
+
+        self.response.score = 3
+        self.response.graded = True
+        self.response.save()
+        refresh_team_round_score(self.team.id, self.page.id)
+        self.game.refresh_from_db()
+        after = leaderboard.get_leaderboard(self.game)
+
+        self.assertIsNot(before, after)
+        self.assertEqual(after.lines[0], ['Alpha', 3, 3])
+        self.assertEqual(after.gold_medals, ['Alpha'])
+        self.assertIs(after, leaderboard.get_leaderboard(self.game))
+
+    def test_simultaneous_misses_build_the_board_once(self):
+        self.game.refresh_from_db()
+        board = leaderboard.Leaderboard(
+            game_id=self.game.id,
+            version=self.game.version,
+            results_version=self.game.results_version,
+            rounds=['total'],
+            lines=[],
+            gold_medals=[],
+            teams={},
+            rows=(),
+            json=b'{}',
+        )
+        builds = []
+        served = []
+        start = threading.Barrier(8)
+
+        def build(game_id):
+            builds.append(game_id)
+            time.sleep(0.05)
+            return board
+
+        def read():
+            start.wait()
+            served.append(leaderboard.get_leaderboard(self.game))
+
+        with mock.patch.object(leaderboard, '_build', build):
+            threads = [threading.Thread(target=read) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(builds, [self.game.id])
+        self.assertEqual(served, [board] * 8)
+
+
+class PageQuestionsTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.OPEN)
+        self.questions = [
+            models.Question.objects.create(page=self.page, order=n, question=f'Q{n}')
+            for n in range(1, 6)
+        ]
+        self.team = models.Team.objects.create(game=self.game, name='Team')
+        models.Response.objects.create(team=self.team, question=self.questions[0], value='first guess')
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = self.team.id
+        session.save()
+
+    def test_all_cards_render_with_one_response_query(self):
+        url = reverse('page_questions_hx', args=(1,))
+        self.client.get(url)  # warm the snapshot
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(
+            sum('"game_response"' in q['sql'] for q in queries.captured_queries),
+            1,
+        )
+        for question in self.questions:
+            self.assertContains(response, f'id="question-{question.id}"')
+        self.assertContains(response, 'first guess')
+
+    def test_empty_page_says_so(self):
+        models.Page.objects.create(game=self.game, order=2, title='Round 2', state=models.Page.PageState.OPEN)
+
+        response = self.client.get(reverse('page_questions_hx', args=(2,)))
+
+        # this replaces the placeholders, so it has to carry the message
+        self.assertContains(response, "There aren't any questions here.")
+
+    def test_locked_page_redirects(self):
+        self.page.state = models.Page.PageState.LOCKED
+        self.page.save()
+
+        response = self.client.get(reverse('page_questions_hx', args=(1,)))
+
+        self.assertEqual(response['HX-Redirect'], reverse('play'))
+
+
+class AutosaveBufferTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.team = models.Team.objects.create(game=self.game, name='Team')
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.OPEN)
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1')
+        self.buffer = autosave.AutosaveBuffer(interval=None)
+
+    def test_flush_writes_only_the_latest_value_in_one_batch(self):
+        other = models.Question.objects.create(page=self.page, order=2, question='Q2')
+        models.Response.objects.create(team=self.team, question=other, value='old')
+        for value in ('P', 'Pa', 'Paris'):
+            self.buffer.record(self.team.id, self.question.id, value)
+        self.buffer.record(self.team.id, other.id, 'new')
+
+        with self.assertNumQueries(4):  # savepoint, graded check, upsert, release
+            self.assertEqual(self.buffer.flush(), 2)
+
+        self.assertEqual(models.Response.objects.get(question=self.question).value, 'Paris')
+        self.assertEqual(models.Response.objects.get(question=other).value, 'new')
+        self.assertIsNone(self.buffer.pending_value(self.team.id, self.question.id))
+
+    def test_flush_never_overwrites_a_graded_response(self):
+        models.Response.objects.create(team=self.team, question=self.question, value='Rome', graded=True)
+        self.buffer.record(self.team.id, self.question.id, 'Paris')
+
+        self.buffer.flush()
+
+        self.assertEqual(models.Response.objects.get(question=self.question).value, 'Rome')
+
+    def test_changed_answers_lose_their_suggested_score(self):
+        models.Response.objects.create(team=self.team, question=self.question, value='Parris', suggested_score=1)
+        self.buffer.record(self.team.id, self.question.id, 'London')
+
+        self.buffer.flush()
+
+        self.assertIsNone(models.Response.objects.get(question=self.question).suggested_score)
+
+    @override_settings(AUTOSAVE_WRITE_BEHIND=True)
+    def test_write_behind_answers_are_shown_and_written_when_the_round_closes(self):
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = self.team.id
+        session.save()
+        host = User.objects.create_user(username='host', password='hostpass123')
+        assign_perm('host_game', host, self.game)
+        host_client = Client()
+        host_client.force_login(host)
+
+        with mock.patch.object(autosave, 'buffer', self.buffer):
+            self.client.post(reverse('respond', args=(self.question.id,)), {'response_value': 'Paris'})
+            self.assertFalse(models.Response.objects.exists())
+            card = self.client.get(reverse('question_hx', args=(self.question.id,)))
+            self.assertContains(card, 'value="Paris"')
+
+            host_client.post(
+                reverse('set_page_state', args=(self.game.id,)),
+                {'page': self.page.id, 'state': 'SCORING'},
+                HTTP_HX_REQUEST='true',
+            )
+
+        self.assertEqual(models.Response.objects.get(question=self.question).value, 'Paris')
+
+
+class GameEventsTests(TestCase):
+    async def test_game_changed_wakes_listeners_from_another_thread(self):
+        with events.listen(42) as changes:
+            notifier = threading.Thread(target=events.game_changed, args=(42,))
+            notifier.start()
+            notifier.join()
+
+            async with asyncio.timeout(1):
+                self.assertTrue(await changes.get())
+
+        self.assertNotIn(42, events._listeners)
+
+    async def test_repeated_changes_collapse_into_one_wakeup(self):
+        with events.listen(42) as changes:
+            events.game_changed(42)
+            events.game_changed(42)
+            await asyncio.sleep(0)
+
+            self.assertEqual(changes.qsize(), 1)
+
+    @override_settings(EVENT_VERSION_CHECK_SECONDS=0.01)
+    async def test_one_watcher_per_game_hears_other_processes_changes(self):
+        game = await models.Game.objects.acreate(name='Trivia')
+
+        with events.listen(game.id) as first, events.listen(game.id) as second:
+            self.assertEqual(len(events._watchers), 1)
+            # let the watcher read the version it starts from
+            await asyncio.sleep(0.05)
+            # as another worker process would, without telling `events`
+            await sync_to_async(models.Game.bump_version)(game.id)
+
+            async with asyncio.timeout(1):
+                self.assertTrue(await first.get())
+                self.assertTrue(await second.get())
+
+        self.assertNotIn(game.id, events._watchers)
+
+    def test_play_events_declines_to_stream_under_wsgi(self):
+        game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        session = self.client.session
+        session['game'] = game.id
+        session.save()
+
+        response = self.client.get(reverse('play_events'))
+
+        self.assertEqual(response.status_code, 204)
+
+
+class ScoreAdminTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser(username='admin', password='adminpass123')
+        self.client.login(username='admin', password='adminpass123')
+        self.game = models.Game.objects.create(name='Trivia')
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1', possible_points=3)
+        self.team = models.Team.objects.create(game=self.game, name='Team')
+        self.response = models.Response.objects.create(question=self.question, team=self.team, value='A', graded=True, score=1)
+        rebuild_scores(self.game.id)
+
+    def board(self):
+        self.game.refresh_from_db()
+        return leaderboard.get_leaderboard(self.game).lines
+
+    def test_admin_score_edits_reach_the_leaderboard(self):
+        self.assertEqual(self.board(), [['Team', 1, 1]])
+
+        response = self.client.post(
+            reverse('admin:game_response_change', args=(self.response.id,)),
+            {
+                'question': self.question.id,
+                'team': self.team.id,
+                'value': 'A',
+                'score': 3,
+                'graded': 'on',
+                'suggested_score': '',
+            },
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.board(), [['Team', 3, 3]])
+
+    def test_admin_question_inline_edits_reach_the_leaderboard(self):
+        self.board()
+        prefix = 'response_set'
+
+        response = self.client.post(
+            reverse('admin:game_question_change', args=(self.question.id,)),
+            {
+                'page': self.page.id,
+                'order': 1,
+                'question': 'Q1',
+                'answer': '',
+                'possible_points': 3,
+                'accepted_answers': '',
+                'numeric_tolerance': '',
+                f'{prefix}-TOTAL_FORMS': 1,
+                f'{prefix}-INITIAL_FORMS': 1,
+                f'{prefix}-MIN_NUM_FORMS': 0,
+                f'{prefix}-MAX_NUM_FORMS': 1000,
+                f'{prefix}-0-id': self.response.id,
+                f'{prefix}-0-question': self.question.id,
+                f'{prefix}-0-team': self.team.id,
+                f'{prefix}-0-value': 'A',
+                f'{prefix}-0-score': 2,
+                f'{prefix}-0-graded': 'on',
+                f'{prefix}-0-suggested_score': '',
+            },
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.board(), [['Team', 2, 2]])
+
+    def test_admin_deletes_reach_the_leaderboard(self):
+        self.board()
+
+        self.client.post(
+            reverse('admin:game_response_delete', args=(self.response.id,)),
+            {'post': 'yes'},
+        )
+
+        self.assertEqual(self.board(), [['Team', 0, 0]])
+
+
+class BenchmarkCommandTests(TestCase):
+    def run_leaderboard(self):
+        call_command(
+            'benchmark', 'leaderboard',
+            '--teams', '3', '--questions', '4', '--pages', '2', '--repeat', '1',
+            stdout=StringIO(),
+        )
+
+    def test_leaderboard_benchmark_passes_when_the_paths_agree(self):
+        self.run_leaderboard()
+
+    def test_leaderboard_benchmark_fails_when_the_paths_disagree(self):
+        with mock.patch.object(benchmark, '_leaderboard_before_totals', return_value=None):
+            with self.assertRaises(CommandError):
+                self.run_leaderboard()
+
+
+# a scratch database of its own, which Django's test cases would refuse
+class SqliteBackendTests(unittest.TestCase):
+    def test_concurrent_read_then_write_transactions_never_hit_a_lock(self):
+        for options in ({}, {'serialize_writes': True}):
+            with self.subTest(options=options), tempfile.TemporaryDirectory() as directory:
+                _, errors = hammer_sqlite(
+                    'triviagame.sqlite',
+                    os.path.join(directory, 'writes.sqlite3'),
+                    options,
+                    writers=8,
+                    transactions=25,
+                )
+                self.assertEqual(errors, 0)
+
+    def test_serialized_writes_outside_a_transaction_wait_for_the_lock(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'writes.sqlite3')
+            settings_dict = connections.configure_settings({
+                DEFAULT_DB_ALIAS: {
+                    'ENGINE': 'triviagame.sqlite',
+                    'NAME': path,
+                    'OPTIONS': {'serialize_writes': True},
+                },
+            })[DEFAULT_DB_ALIAS]
+            db = sqlite_base.DatabaseWrapper(settings_dict)
+            with db.cursor() as cursor:
+                cursor.execute("CREATE TABLE autosave (value text)")
+            db.close()
+            written = threading.Event()
+
+            def write():
+                db = sqlite_base.DatabaseWrapper(settings_dict)
+                try:
+                    with db.cursor() as cursor:
+                        cursor.execute("INSERT INTO autosave VALUES (%s)", ['guess'])
+                    written.set()
+                finally:
+                    db.close()
+
+            thread = threading.Thread(target=write)
+            with sqlite_base._write_locks[path]:
+                thread.start()
+                self.assertFalse(written.wait(0.2))
+            thread.join()
+
+            self.assertTrue(written.is_set())
+
+
+class LoadgenTests(TestCase):
+    def test_report_counts_errors_and_percentiles_per_endpoint(self):
+        stats = loadgen.Stats()
+        for ms in range(1, 101):
+            stats.record('respond', ms / 1000, ok=ms % 10 != 0)
+        stats.record('play', 0.005, ok=True)
+
+        lines = stats.report().splitlines()
+
+        self.assertEqual(lines[1].split(), ['play', '1', '0.0%', '5.0', '5.0', '5.0'])
+        self.assertEqual(lines[2].split(), ['respond', '100', '10.0%', '50.5', '95.1', '99.0'])
+
+    def test_player_keeps_cookies_and_forgets_expired_ones(self):
+        player = loadgen.Player('http://127.0.0.1:8000', loadgen.Stats(), 0)
+        player.cookies['messages'] = 'old'
+
+        status, headers, body = player._parse(
+            b"HTTP/1.1 302 Found\r\n"
+            b"Location: /play/\r\n"
+            b"Set-Cookie: sessionid=abc; HttpOnly; Path=/\r\n"
+            b'Set-Cookie: messages=""; expires=Thu, 01 Jan 1970 00:00:00 GMT; Path=/\r\n'
+            b"\r\n"
+        )
+
+        self.assertEqual(status, 302)
+        self.assertEqual(headers['location'], '/play/')
+        self.assertEqual(player.cookies, {'sessionid': 'abc'})
+
+
+class ImporterTests(TestCase):
+    MARKDOWN = """# Pub quiz
+
+## Round 1
+Warm up.
+
+1. Capital of France?
+   Answer: Paris
+   Also: Paris, France
+2. Sides on a hexagon?
+   Answer: 6
+   Points: 2
+
+## Bonus (hidden)
+1. Longest river?
+   Answer: Nile
+"""
+
+    def test_markdown_game_is_created_in_a_constant_number_of_queries(self):
+        # savepoint, game, pages, questions, release
+        with self.assertNumQueries(5):
+            game = importer.import_game(self.MARKDOWN, 'markdown')
+
+        self.assertEqual(game.name, 'Pub quiz')
+        pages = list(game.page_set.all())
+        self.assertEqual([(p.order, p.title, p.is_hidden) for p in pages], [
+            (1, 'Round 1', False),
+            (2, 'Bonus', True),
+        ])
+        self.assertEqual(pages[0].description, 'Warm up.')
+        questions = list(pages[0].question_set.all())
+        self.assertEqual([(q.order, q.answer, q.possible_points) for q in questions], [
+            (1, 'Paris', 1),
+            (2, '6', 2),
+        ])
+        self.assertEqual(questions[0].accepted_answers, 'Paris, France')
+
+    def test_csv_rows_are_grouped_into_pages(self):
+        text = (
+            "page,question,answer,accepted_answers\n"
+            "Round 1,Q1,A1,a1|one\n"
+            "Round 2,Q2,A2,\n"
+            "Round 1,Q3,A3,\n"
+        )
+
+        game = importer.import_game(text, 'csv', default_name='From CSV')
+
+        self.assertEqual(game.name, 'From CSV')
+        self.assertEqual(
+            list(models.Question.objects.filter(page__game=game).values_list('page__order', 'order', 'question')),
+            [(1, 1, 'Q1'), (1, 2, 'Q3'), (2, 1, 'Q2')],
+        )
+        self.assertEqual(models.Question.objects.get(question='Q1').accepted_answers, 'a1\none')
+
+    def test_every_problem_is_reported_and_nothing_is_saved(self):
+        text = json.dumps({'name': 'Bad', 'pages': [
+            {'title': 'Round 1', 'questions': [{'question': 'Q1', 'possible_points': 0}]},
+            {'title': '', 'questions': [{'question': 'Q2', 'points': 2}]},
+        ]})
+
+        with self.assertRaises(ValidationError) as raised:
+            importer.import_game(text, 'json')
+
+        self.assertEqual(raised.exception.messages, [
+            'Page 1, question 1: possible points: Ensure this value is greater than or equal to 1.',
+            'Page 2: title: This field cannot be blank.',
+            'Page 2, question 1: unknown field(s) points.',
+        ])
+        self.assertFalse(models.Game.objects.exists())
+
+    def test_command_imports_a_file_for_its_hosts(self):
+        host = User.objects.create_user(username='host')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'quiz.md')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.MARKDOWN)
+            call_command('import_game', path, '--host', 'host', stdout=StringIO())
+
+        game = models.Game.objects.get(name='Pub quiz')
+        self.assertEqual(models.Question.objects.filter(page__game=game).count(), 3)
+        self.assertTrue(host.has_perm('game.change_game', game))
+
+
+class ExportResponsesCommandTests(TestCase):
+    def test_command_writes_every_response(self):
+        game = models.Game.objects.create(name='Trivia')
+        team = models.Team.objects.create(game=game, name='Alpha')
+        page = models.Page.objects.create(game=game, order=1, title='Round 1')
+        for order in (1, 2):
+            question = models.Question.objects.create(page=page, order=order, question=f'Q{order}')
+            models.Response.objects.create(team=team, question=question, value=f'a, {order}', graded=True, score=order)
+        out = StringIO()
+
+        call_command('export_responses', game.id, '--format', 'csv', stdout=out)
+
+        self.assertEqual(out.getvalue().splitlines(), [
+            'team,round,question,value,score,graded',
+            'Alpha,1,1,"a, 1",1,True',
+            'Alpha,1,2,"a, 2",2,True',
+        ])
+
+    def test_command_rejects_unknown_games(self):
+        with self.assertRaises(CommandError):
+            call_command('export_responses', 999, stdout=StringIO())
+
+class GradingTests(TestCase):
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+
+    def grade(self, value, **question):
+        question = models.Question(page=self.page, order=1, question='Q', **question)
+        return grading.compile_question(question)(value)
+
+    def test_normalized_and_alternative_answers_are_correct(self):
+        self.assertEqual(self.grade('the  BEATLES!', answer='Beatles'), grading.CORRECT)
+        self.assertEqual(self.grade('Pelé', answer='pele'), grading.CORRECT)
+        self.assertEqual(self.grade('Fab Four', answer='The Beatles', accepted_answers='Fab Four\nThe Quarrymen'), grading.CORRECT)
+        self.assertIsNone(self.grade('The Rolling Stones', answer='The Beatles'))
+
+    def test_numbers_within_tolerance_are_correct(self):
+        self.assertEqual(self.grade('1,000', answer='1000'), grading.CORRECT)
+        self.assertEqual(self.grade('$1005', answer='1000', numeric_tolerance=5), grading.CORRECT)
+        self.assertIsNone(self.grade('1006', answer='1000', numeric_tolerance=5))
+
+    def test_signs_and_symbols_matter(self):
+        self.assertIsNone(self.grade('40', answer='-40'))
+        self.assertIsNone(self.grade('C', answer='C++'))
+        self.assertIsNone(self.grade('C#', answer='C++'))
+        self.assertIsNone(self.grade('1 2', answer='1/2'))
+        self.assertEqual(self.grade('c++', answer='C++'), grading.CORRECT)
+        self.assertEqual(self.grade('1/2', answer='1/2'), grading.CORRECT)
+
+    def test_numbers_are_not_matched_as_text(self):
+        # "40" would otherwise normalize to the same thing as an accepted "40!"
+        self.assertIsNone(self.grade('40', answer='-40', accepted_answers='40!'))
+
+    def test_typos_are_only_close(self):
+        self.assertEqual(self.grade('Mississipi', answer='Mississippi'), grading.CLOSE)
+        self.assertIsNone(self.grade('cat', answer='car'))
+
+    def test_grade_page_scores_matches_and_leaves_the_rest(self):
+        question = models.Question.objects.create(page=self.page, order=1, question='Q', answer='Paris', possible_points=2)
+        teams = models.Team.objects.bulk_create(models.Team(game=self.game, name=f'Team {n}') for n in range(4))
+        right, close, wrong, already = models.Response.objects.bulk_create([
+            models.Response(question=question, team=teams[0], value='paris'),
+            models.Response(question=question, team=teams[1], value='Parris'),
+            models.Response(question=question, team=teams[2], value='London'),
+            models.Response(question=question, team=teams[3], value='Paris', graded=True, score=1),
+        ])
+
+        self.assertEqual(grading.grade_page(self.page), (1, 1))
+
+        for response in (right, close, wrong, already):
+            response.refresh_from_db()
+        self.assertEqual((right.graded, right.score), (True, 2))
+        self.assertEqual((close.graded, close.suggested_score), (False, 2))
+        self.assertEqual((wrong.graded, wrong.suggested_score), (False, None))
+        self.assertEqual(already.score, 1)
+        self.assertEqual(models.TeamRoundScore.objects.get(team=teams[0]).points, 2)
+
+    def test_grade_page_leaves_responses_the_host_scores_meanwhile(self):
+        question = models.Question.objects.create(page=self.page, order=1, question='Q', answer='Paris', possible_points=2)
+        team = models.Team.objects.create(game=self.game, name='Team')
+        response = models.Response.objects.create(question=question, team=team, value='Paris')
+
+        compile_question = grading.compile_question
+        def host_scores_while_grading(question):
+            grade = compile_question(question)
+            def scored_then_grade(value):
+                models.Response.objects.filter(pk=response.pk).update(score=1, graded=True)
+                return grade(value)
+            return scored_then_grade
+
+        with mock.patch.object(grading, 'compile_question', host_scores_while_grading):
+            self.assertEqual(grading.grade_page(self.page), (0, 0))
+
+        response.refresh_from_db()
+        self.assertEqual((response.graded, response.score), (True, 1))
+
+    def test_regrading_clears_stale_suggestions(self):
+        question = models.Question.objects.create(page=self.page, order=1, question='Q', answer='Paris', possible_points=2)
+        team = models.Team.objects.create(game=self.game, name='Team')
+        # suggested for an earlier answer
+        response = models.Response.objects.create(question=question, team=team, value='London', suggested_score=2)
+
+        grading.grade_page(self.page)
+
+        response.refresh_from_db()
+        self.assertIsNone(response.suggested_score)
+
+
+# "SCAN game_response" reads every row; "SCAN ... USING INDEX" and
+# "SEARCH ..." don't
+_TABLE_SCAN = re.compile(r'SCAN (?!\d+-ROW VALUES CLAUSE|CONSTANT ROW)\S+$')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "reads SQLite's EXPLAIN QUERY PLAN")
+class QueryPlanTests(TestCase):
+    "Every query on the hot paths has to find its rows through an index"
+
+    def setUp(self):
+        self.game = models.Game.objects.create(name='Trivia', state=models.Game.GameState.ACCEPTING_TEAMS)
+        self.open_page = models.Page.objects.create(game=self.game, order=1, title='Round 1', state=models.Page.PageState.OPEN)
+        self.scoring_page = models.Page.objects.create(game=self.game, order=2, title='Round 2', state=models.Page.PageState.SCORING)
+        self.questions = models.Question.objects.bulk_create(
+            models.Question(page=page, order=n, question=f'Q{n}', answer='Paris')
+            for page in (self.open_page, self.scoring_page)
+            for n in range(1, 4)
+        )
+        self.teams = models.Team.objects.bulk_create(
+            models.Team(game=self.game, name=f'Team {n}') for n in range(3)
+        )
+        self.responses = models.Response.objects.bulk_create(
+            models.Response(team=team, question=question, value='paris')
+            for team in self.teams
+            for question in self.questions
+        )
+        rebuild_scores(self.game.id)
+
+        session = self.client.session
+        session['game'] = self.game.id
+        session['team'] = self.teams[0].id
+        session.save()
+
+        host = User.objects.create_user(username='host', password='pw')
+        assign_perm('host_game', host, self.game)
+        assign_perm('view_game', host, self.game)
+        self.host_client = Client()
+        self.host_client.login(username='host', password='pw')
+
+    def assertNoTableScans(self, queries):
+        for query in queries:
+            if not re.match(r'(SELECT|INSERT|UPDATE|DELETE)\b', query['sql']):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertFalse(
+                [line for line in plan if _TABLE_SCAN.match(line)],
+                "\n".join([query['sql'], *plan]),
+            )
+
+    def test_player_paths(self):
+        question = self.questions[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('play'))
+            self.client.get(reverse('page_list_hx'), HTTP_HX_REQUEST='true')
+            self.client.get(reverse('page_questions_hx', args=(1,)), HTTP_HX_REQUEST='true')
+            self.client.get(reverse('question_hx', args=(question.id,)), HTTP_HX_REQUEST='true')
+            self.client.post(
+                reverse('respond', args=(question.id,)),
+                {'response_value': 'London'},
+                HTTP_HX_REQUEST='true',
+            )
+            self.client.get(reverse('leaderboard'))
+
+        self.assertNoTableScans(queries.captured_queries)
+
+    def test_host_paths(self):
+        scoring_response = self.responses[3]
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.host_client.get(reverse('game_data', args=(self.game.id,))).streaming_content)
+            self.host_client.get(reverse('host_leaderboard_stats', args=(self.game.id,)))
+            b''.join(self.host_client.get(reverse('export_responses_csv', args=(self.game.id,))).streaming_content)
+            self.host_client.get(reverse('score_page', args=(self.game.id, self.scoring_page.id)))
+            self.host_client.post(
+                reverse('assign_score', args=(self.game.id,)),
+                {'response': scoring_response.id, 'score': '1'},
+                HTTP_HX_REQUEST='true',
+            )
+            grading.grade_page(self.scoring_page)
+            list(response_round_totals(self.game))
+
+        self.assertNoTableScans(queries.captured_queries)
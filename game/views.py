@@ -1,47 +1,33 @@
+import asyncio
 import random
+from http import HTTPStatus
 
+from django.conf import settings
 from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
 from django.db import Error as DjangoDbError
 from django.forms import ValidationError, HiddenInput
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.http.response import HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils.crypto import get_random_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django_htmx.http import HttpResponseClientRedirect, trigger_client_event
 
-from . import models
+from triviagame.replica import reads_from_replica
+from . import autosave, events, models
+from .leaderboard import get_leaderboard
+from .player import get_player
+from .snapshot import get_snapshot
 from .forms import JoinGameForm, CreateTeamForm, ReJoinTeamForm
 
 
 def home(request):
-    game = None
-    team = None
+    # get_player also straightens out stale or mismatched sessions
+    game, team = get_player(request)
 
-    if 'game' in request.session:
-        game_cookie = int(request.session['game'])
-        try:
-            game = models.Game.objects.get(pk=game_cookie)
-        except models.Game.DoesNotExist:
-            del request.session['game']
-    
-    if 'team' in request.session:
-        team_cookie = int(request.session['team'])
-        try:
-            team = models.Team.objects.get(pk=team_cookie)
-        except models.Team.DoesNotExist:
-            del request.session['team']
-
-    # if we're somehow in a team from a different game, fix that
-    if game and team and team.game != game:
-        team = None
-        del request.session['team']
-    
-    # if we're somehow only in a team, fix that
-    if team and not game:
-        game = team.game
-        request.session['game'] = game
-    
     return render(request, 'home.html', {
         'game': game,
         'team': team,
@@ -98,11 +84,11 @@ def join_game(request, id=0, code=None):
 _REJOIN_MESSAGE = "If you're trying to rejoin a team you created, ask the host for your rejoin code."
 
 def create_team(request):
-    if 'game' not in request.session:
+    game, _ = get_player(request)
+    if not game:
         _flash_not_in_game(request)
         return HttpResponseRedirect(reverse('home'))
 
-    game = models.Game.objects.get(pk=request.session['game'])
     if game.is_open_but_not_accepting_teams:
         return render(request, 'not_accepting_teams.html', {
             'game': game,
@@ -182,16 +168,14 @@ def play(request):
     if request.htmx:
         raise Http404("code bug - did not expect an htmx request to play endpoint")
 
-    if 'game' not in request.session:
-        _flash_not_in_game(request)
-        return HttpResponseRedirect(reverse('home'))
-    if 'team' not in request.session:
-        _flash_no_team(request)
-        return HttpResponseRedirect(reverse('home'))
+    snapshot, team, response = _get_snapshot_team(request)
+    if response:
+        return response
 
     config = {
-        'game': models.Game.objects.get(pk=request.session['game']),
-        'team': models.Team.objects.get(pk=request.session['team']),
+        'game': snapshot.game,
+        'pages': snapshot.pages,
+        'team': team,
     }
 
     if not config['game'].is_open:
@@ -200,39 +184,50 @@ def play(request):
     return render(request, 'game/pages.html', config)
 
 
+def _player_poll_etag(request):
+    # Player polls only change when the game does, so the game's version
+    # makes a good ETag. Looking up the player is the only query an
+    # unchanged poll costs, and the view reuses it otherwise.
+    game, team = get_player(request)
+    if not team:
+        return None
+
+    return f"{settings.COMMIT_HASH}-{game.id}-{team.id}-{game.version}"
+
+
+# `no_cache` makes browsers revalidate every poll; a 304 shows up to htmx
+# as the cached 200, which it swaps in unchanged
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_player_poll_etag)
 def play_poll_hx(request):
     if not request.htmx:
         raise Http404()
 
-    if 'game' not in request.session:
-        _flash_not_in_game(request)
-        return HttpResponseClientRedirect(reverse('home'))
-    if 'team' not in request.session:
-        _flash_no_team(request)
-        return HttpResponseClientRedirect(reverse('home'))
-    
-    game = models.Game.objects.get(pk=request.session['game'])
-    if game.is_open:
+    snapshot, _, response = _get_snapshot_team(request, HttpResponseClientRedirect)
+    if response:
+        return response
+
+    if snapshot.game.is_open:
         return HttpResponseClientRedirect(reverse('play'))
     
     # if closed, an empty response works
     return HttpResponse()
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_player_poll_etag)
 def page_list_hx(request):
     if not request.htmx:
         raise Http404()
 
-    if 'game' not in request.session:
-        _flash_not_in_game(request)
-        return HttpResponseClientRedirect(reverse('home'))
-    if 'team' not in request.session:
-        _flash_no_team(request)
-        return HttpResponseClientRedirect(reverse('home'))
+    snapshot, team, response = _get_snapshot_team(request, HttpResponseClientRedirect)
+    if response:
+        return response
 
     config = {
-        'game': models.Game.objects.get(pk=request.session['game']),
-        'team': models.Team.objects.get(pk=request.session['team']),
+        'game': snapshot.game,
+        'pages': snapshot.pages,
+        'team': team,
     }
 
     if not config['game'].is_open:
@@ -242,43 +237,103 @@ def page_list_hx(request):
     return render(request, 'game/_page_list.html', config)
 
 
-def _get_game_team(request, Redirect=HttpResponseRedirect):
-    if 'game' not in request.session:
+# how often an idle event stream sends a comment to keep proxies from
+# closing the connection
+_EVENT_KEEPALIVE_SECONDS = 5
+
+
+async def play_events(request):
+    # Server-sent events telling the player's page when the host changed
+    # something. The page keeps polling whenever this stream isn't up.
+    game_id = await request.session.aget('game')
+
+    # A 204 tells EventSource to give up for good. Under WSGI, an endless
+    # stream would pin a worker per player, so polling is the better deal.
+    if game_id is None or not isinstance(request, ASGIRequest):
+        return HttpResponse(status=HTTPStatus.NO_CONTENT)
+
+    response = StreamingHttpResponse(
+        _game_event_stream(int(game_id)),
+        content_type='text/event-stream',
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _game_event_stream(game_id):
+    # The stream itself never touches the database. Changes from other
+    # worker processes arrive through `events`' per-game watcher, up to
+    # EVENT_VERSION_CHECK_SECONDS late.
+    with events.listen(game_id) as changes:
+        # if the connection drops, ask the browser to retry soon
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                async with asyncio.timeout(_EVENT_KEEPALIVE_SECONDS):
+                    await changes.get()
+            except TimeoutError:
+                yield ": keepalive\n\n"
+            else:
+                # EventSource drops events with no data, so send the game id
+                yield f"event: gameChanged\ndata: {game_id}\n\n"
+
+
+def _get_snapshot_team(request, Redirect=HttpResponseRedirect, require_open=False):
+    """Returns the player's game snapshot, team, and a response if they
+    aren't on a team or, with `require_open`, if they can't play yet"""
+    game, team = get_player(request)
+    response = _player_problem(request, game, team, Redirect)
+    if response:
+        return None, None, response
+
+    # the player's game is fresh, so its version needs no second look
+    snapshot = get_snapshot(game.id, game.version)
+    response = _snapshot_problem(request, snapshot, require_open, Redirect)
+    if response:
+        return None, None, response
+
+    return snapshot, team, None
+
+
+def _player_problem(request, game, team, Redirect):
+    if not game:
         _flash_not_in_game(request)
-        return None, None, Redirect(reverse('home'))
+        return Redirect(reverse('home'))
 
-    if 'team' not in request.session:
+    if not team:
         _flash_no_team(request)
-        return None, None, Redirect(reverse('home'))
-    
-    try:
-        game = models.Game.objects.get(pk=request.session['game'])
-    except models.Game.DoesNotExist:
-        game = None
+        return Redirect(reverse('home'))
+
+    return None
 
-    if not game.is_open:
+
+def _snapshot_problem(request, snapshot, require_open, Redirect):
+    if not snapshot:
+        _flash_not_in_game(request)
+        return Redirect(reverse('home'))
+
+    if require_open and not snapshot.game.is_open:
         _flash_game_not_open(request)
-        return game, None, Redirect(reverse('play'))
+        return Redirect(reverse('play'))
 
-    try:
-        team = models.Team.objects.get(pk=request.session['team'])
-    except models.Team.DoesNotExist:
-        _flash_no_team(request)
-        return game, None, Redirect(reverse('home'))
-    
-    return game, team, None
+    return None
+
+
+def _get_unlocked_question(snapshot, question_id):
+    question = snapshot.question(question_id)
+    if question and question.page.state == models.Page.PageState.LOCKED:
+        return None
+    return question
 
 
 def answer_sheet(request, page_order):
-    game, team, response = _get_game_team(request)
+    snapshot, team, response = _get_snapshot_team(request, require_open=True)
     if response:
         return response
 
-    try:
-        page = game.page_set.get(order=page_order)
-        if page.state == models.Page.PageState.LOCKED:
-            page = None
-    except models.Page.DoesNotExist:
+    page = snapshot.page(page_order)
+    if page and page.state == models.Page.PageState.LOCKED:
         page = None
 
     if not page:
@@ -286,24 +341,20 @@ def answer_sheet(request, page_order):
         return HttpResponseRedirect(reverse('play'))
 
     return render(request, 'game/answer.html', {
-        'game': game,
+        'game': snapshot.game,
         'team': team,
         'page': page,
     })
 
 
 def question_hx(request, question_id):
-    _, team, response = _get_game_team(request, HttpResponseClientRedirect)
+    snapshot, team, response = _get_snapshot_team(
+        request, HttpResponseClientRedirect, require_open=True,
+    )
     if response:
         return response
 
-    try:
-        question = models.Question.objects.get(pk=question_id)
-        if question.page.state == models.Page.PageState.LOCKED:
-            question = None
-    except models.Question.DoesNotExist:
-        question = None
-
+    question = _get_unlocked_question(snapshot, question_id)
     if not question:
         _flash_bad_question(request)
         return HttpResponseClientRedirect(reverse('play'))
@@ -312,6 +363,7 @@ def question_hx(request, question_id):
         response = models.Response.objects.get(team=team, question=question)
     except models.Response.DoesNotExist:
         response = None
+    response = _with_pending_value(team, question, response)
     
     http_response = render(request, 'game/_question.html', {
         'team': team,
@@ -322,18 +374,52 @@ def question_hx(request, question_id):
     return _generate_validation(http_response, response, question, None)
 
 
-def question_response(request, question_id):
-    _, team, response = _get_game_team(request, HttpResponseClientRedirect)
+def page_questions_hx(request, page_order):
+    # every question card on the page at once, rather than one
+    # question_hx round trip per card
+    snapshot, team, response = _get_snapshot_team(
+        request, HttpResponseClientRedirect, require_open=True,
+    )
     if response:
         return response
 
-    try:
-        question = models.Question.objects.get(pk=question_id)
-        if question.page.state == models.Page.PageState.LOCKED:
-            question = None
-    except models.Question.DoesNotExist:
-        question = None
+    page = snapshot.page(page_order)
+    if not page or page.is_locked:
+        _flash_bad_page(request)
+        return HttpResponseClientRedirect(reverse('play'))
+
+    responses = {
+        r.question_id: r
+        for r in models.Response.objects.filter(team=team, question__page=page)
+    }
+    cards = [
+        (question, _with_pending_value(team, question, responses.get(question.id)))
+        for question in page.question_set.all()
+    ]
+
+    return render(request, 'game/_question_cards.html', {
+        'team': team,
+        'cards': cards,
+    })
 
+
+def _with_pending_value(team, question, response):
+    pending_value = autosave.buffer.pending_value(team.id, question.id)
+    if pending_value is not None and not (response and response.graded):
+        # show what they typed, even though it isn't written yet
+        response = response or models.Response(team=team, question=question)
+        response.value = pending_value
+    return response
+
+
+def question_response(request, question_id):
+    snapshot, team, response = _get_snapshot_team(
+        request, HttpResponseClientRedirect, require_open=True,
+    )
+    if response:
+        return response
+
+    question = _get_unlocked_question(snapshot, question_id)
     if not question:
         _flash_bad_question(request)
         return HttpResponseClientRedirect(reverse('play'))
@@ -360,11 +446,17 @@ def question_response(request, question_id):
         
         if keep_going:
             if response:
+                if response.value != new_response:
+                    # any suggestion was for the old answer
+                    response.suggested_score = None
                 response.value = new_response
             else:
                 response = models.Response(team=team, question=question, value=new_response)
 
-            response.save()
+            if settings.AUTOSAVE_WRITE_BEHIND:
+                autosave.buffer.record(team.id, question.id, new_response)
+            else:
+                response.save()
             did_save = True
 
     return _generate_validation(HttpResponse(), response, question, did_save)
@@ -397,72 +489,25 @@ def _generate_validation(http_response, response: models.Response, question: mod
     )
 
 
+@reads_from_replica
 def leaderboard(request):
-    if 'game' not in request.session:
-        _flash_not_in_game(request)
-        return HttpResponseRedirect(reverse('home'))
-    if 'team' not in request.session:
-        _flash_no_team(request)
-        return HttpResponseRedirect(reverse('home'))
-
-    game = models.Game.objects.get(pk=request.session['game'])
-    team = models.Team.objects.get(pk=request.session['team'])
+    snapshot, team, response = _get_snapshot_team(request)
+    if response:
+        return response
 
-    rounds, ldr_board, gold_medals = compute_leaderboard_data(game)
+    # the team's game was just loaded, so its versions are current
+    board = get_leaderboard(team.game)
 
     return render(request, 'game/leaderboard.html', {
-        'game': game,
+        'game': snapshot.game,
         'team': team,
-        'teams': { t.name: t.members for t in game.team_set.all() },
-        'rounds': rounds,
-        'leaderboard': ldr_board,
-        'gold_medals': gold_medals,
+        'rounds': board.rounds,
+        'leaderboard': board.lines,
+        'gold_medals': board.gold_medals,
+        'rows': board.table_rows(team.name),
     })
 
 
-def compute_leaderboard_data(game):
-    # HACK: it should be possible to ask the database to do this,
-    # but I'm not smart enough to write the query.
-    # We want the sum of scores per team per page.
-    responses = (
-        models.Response.objects
-        .select_related("team", "question", "question__page")
-        .filter(team__game=game, graded=True)
-    )
-    rounds = [
-        round.order
-        for round in (
-            game.page_set
-            .exclude(is_hidden=True, state=models.Page.PageState.LOCKED)
-        )] + ['total']
-    l_board = { t.name: {r: 0 for r in rounds} for t in game.team_set.all() }
-    for r in responses:
-        try:
-            l_board[r.team.name][r.question.page.order] += r.score
-            l_board[r.team.name]['total'] += r.score
-        except KeyError:
-            if r.question.page.order not in l_board[r.team.name]:
-                # this is an answer on a hidden page that was re-locked
-                # after scoring; it is intentionally omitted
-                pass
-            else:
-                # something else might be going on, and we should fail
-                raise
-    
-    # now we want a list of lists, sorted by total score
-    final_board = [[team_name] + list(rest.values()) for team_name, rest in l_board.items()]
-    final_board.sort(key=lambda line: line[-1], reverse=True)
-
-    # find first place winners
-    gold_medals = []
-    if len(final_board) > 0:
-        top_score = final_board[0][-1]
-        if top_score:
-            gold_medals = [line[0] for line in final_board if line[-1] == top_score]
-
-    return rounds, final_board, gold_medals
-
-
 def _flash_not_in_game(request):
     messages.error(request, "You're not in a game.")
 
@@ -20,3 +20,7 @@ class Bs5Select(widgets.Select):
 class Bs5RadioSelect(widgets.RadioSelect):
     template_name = "django/forms/widgets/bs5_radio.html"
     option_template_name = "django/forms/widgets/bs5_radio_option.html"
+
+
+class Bs5FileInput(widgets.FileInput):
+    template_name = "django/forms/widgets/bs5_input.html"
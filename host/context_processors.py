@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from host.permissions import get_game_permissions
+
+
+def game_permissions(request):
+    # a checker for `{% get_obj_perms user for game as "perms" game_perms %}`
+    return {
+        'game_perms': SimpleLazyObject(lambda: get_game_permissions(request)),
+    }
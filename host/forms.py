@@ -1,8 +1,10 @@
 from django import forms
 from django.contrib.auth import get_user_model
 
+from game.importer import EXTENSIONS, FORMATS, format_for
 from game.models import Game, Page, Question
 from game.widgets import (
+    Bs5FileInput,
     Bs5TextInput,
     Bs5NumberInput,
     Bs5Textarea,
@@ -31,6 +33,43 @@ class GameForm(forms.ModelForm):
         }
 
 
+class ImportGameForm(forms.Form):
+    # a game with hundreds of questions is still well under this
+    MAX_FILE_SIZE = 2 * 1024 * 1024
+
+    file = forms.FileField(
+        label='Game file (JSON, CSV, or Markdown)',
+        widget=Bs5FileInput(attrs={
+            'accept': ','.join(EXTENSIONS),
+        }),
+    )
+    name = forms.CharField(
+        label='Game name (if not the one in the file)',
+        max_length=60,
+        required=False,
+        widget=Bs5TextInput(attrs={
+            'data-1p-ignore': True,
+            'autocomplete': 'off',
+        }),
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if file.size > self.MAX_FILE_SIZE:
+            raise forms.ValidationError("That file is too big to be a game.")
+
+        self.cleaned_data['format'] = format_for(file.name)
+        if self.cleaned_data['format'] not in FORMATS:
+            raise forms.ValidationError(
+                f"Expected a file ending in {', '.join(EXTENSIONS)}."
+            )
+        try:
+            self.cleaned_data['text'] = file.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError("The file must be UTF-8 text.")
+        return file
+
+
 class GameHostForm(forms.Form):
     host = forms.ModelChoiceField(
         None,
@@ -74,15 +113,24 @@ class QuestionForm(forms.ModelForm):
             'question',
             'answer',
             'possible_points',
+            'accepted_answers',
+            'numeric_tolerance',
         ]
         widgets = {
             'question': MonacoEditor,
             'answer': MonacoEditor,
             'possible_points': Bs5NumberInput,
+            'accepted_answers': Bs5Textarea(attrs={'rows': 3}),
+            'numeric_tolerance': Bs5NumberInput(attrs={'step': 'any'}),
         }
         labels = {
             'question': 'Question (Markdown allowed)',
             'answer': 'Answer (Markdown allowed)',
+            'accepted_answers': 'Also accept (one per line)',
+        }
+        help_texts = {
+            'accepted_answers': 'Responses matching the answer or one of these are scored automatically when the page moves to scoring.',
+            'numeric_tolerance': 'For numeric answers, how far off a response can be and still be scored correct.',
         }
 
 
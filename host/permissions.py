@@ -0,0 +1,133 @@
+"""
+Every per-game permission a host has, loaded in one query and kept for the
+rest of the request.
+
+Guardian's backend looks permissions up again on every `has_perm` call,
+which the host decorators and templates make several times a request.
+Set `GAME_PERMS_CACHE_SECONDS` to also keep each user's permissions for a
+few seconds between requests. That cache lives in one worker process, so
+other workers can take up to that long to notice a host was added or
+removed; `grant_game_perms` and `revoke_game_perms` clear it in this one.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.shortcuts import assign_perm, remove_perm
+from guardian.utils import get_group_obj_perms_model, get_user_obj_perms_model
+
+from game.models import Game
+
+
+# what a host of a game gets
+HOST_PERMS = ('host_game', 'change_game', 'view_game')
+
+_lock = threading.Lock()
+_cached: dict[int, tuple[float, dict]] = {}
+
+
+class GamePermissions:
+    """Answers the same questions as guardian's `ObjectPermissionChecker`,
+    so it can be handed to the `get_obj_perms` template tag, but only for
+    games."""
+
+    def __init__(self, user):
+        self.user = user
+        self._perms = None
+
+    def has_perm(self, perm, game):
+        if not self.user.is_active:
+            return False
+        if self.user.is_superuser:
+            return True
+        return perm.split('.')[-1] in self._game_perms(game)
+
+    def get_perms(self, game):
+        if not self.user.is_active:
+            return []
+        return sorted(self._game_perms(game))
+
+    def _game_perms(self, game):
+        if self._perms is None:
+            if self.user.is_superuser:
+                # guardian gives superusers every permission on the model
+                self._perms = frozenset(
+                    Permission.objects
+                    .filter(content_type=ContentType.objects.get_for_model(Game))
+                    .values_list('codename', flat=True)
+                )
+            else:
+                self._perms = _load(self.user)
+
+        if self.user.is_superuser:
+            return self._perms
+        return self._perms.get(game.pk, ())
+
+
+def get_game_permissions(request):
+    "The request user's `GamePermissions`, made once per request"
+    try:
+        return request._game_permissions
+    except AttributeError:
+        request._game_permissions = GamePermissions(request.user)
+        return request._game_permissions
+
+
+def grant_game_perms(user, game):
+    with transaction.atomic():
+        for perm in HOST_PERMS:
+            assign_perm(perm, user, game)
+    invalidate(user)
+
+
+def revoke_game_perms(user, game):
+    with transaction.atomic():
+        for perm in HOST_PERMS:
+            remove_perm(perm, user, game)
+    invalidate(user)
+
+
+def invalidate(user):
+    def forget():
+        with _lock:
+            _cached.pop(user.pk, None)
+
+    forget()
+    # and again once committed, in case a request cached them meanwhile
+    transaction.on_commit(forget)
+
+
+def _load(user):
+    ttl = settings.GAME_PERMS_CACHE_SECONDS
+    if ttl:
+        with _lock:
+            expires, perms = _cached.get(user.pk, (0, None))
+            if expires > time.monotonic():
+                return perms
+
+    ctype = ContentType.objects.get_for_model(Game)
+    user_perms = (
+        get_user_obj_perms_model(Game).objects
+        .filter(user=user, content_type=ctype)
+        .values_list('object_pk', 'permission__codename')
+    )
+    group_perms = (
+        get_group_obj_perms_model(Game).objects
+        .filter(group__user=user, content_type=ctype)
+        .values_list('object_pk', 'permission__codename')
+    )
+
+    perms = defaultdict(set)
+    for object_pk, codename in user_perms.union(group_perms):
+        perms[int(object_pk)].add(codename)
+    perms = dict(perms)
+
+    if ttl:
+        with _lock:
+            _cached[user.pk] = (time.monotonic() + ttl, perms)
+    return perms
+
@@ -0,0 +1,55 @@
+// Drag-and-drop reordering for the editor's page and question lists.
+// Items marked `[data-reorder-item]` can be dragged around inside their
+// `[data-reorder]` list. When one is dropped somewhere new, the list gets a
+// `reordered` event; its hx-post sends the hidden `order` inputs, which are
+// the items' ids in their new order.
+(() => {
+  let dragged = null;
+  let startIndex = -1;
+
+  const indexOf = (item) => Array.prototype.indexOf.call(item.parentElement.children, item);
+  const itemFor = (target) => target instanceof Element ? target.closest("[data-reorder-item]") : null;
+
+  document.addEventListener("dragstart", (e) => {
+    const item = itemFor(e.target);
+    if (!item) {
+      return;
+    }
+    dragged = item;
+    startIndex = indexOf(item);
+    e.dataTransfer.effectAllowed = "move";
+    item.classList.add("opacity-50");
+  });
+
+  document.addEventListener("dragover", (e) => {
+    const item = itemFor(e.target);
+    if (!dragged || !item || item.parentElement !== dragged.parentElement) {
+      return;
+    }
+    // allow the drop
+    e.preventDefault();
+    if (item === dragged) {
+      return;
+    }
+    const box = item.getBoundingClientRect();
+    const below = e.clientY > box.top + box.height / 2;
+    item.parentElement.insertBefore(dragged, below ? item.nextSibling : item);
+  });
+
+  document.addEventListener("drop", (e) => {
+    if (dragged) {
+      e.preventDefault();
+    }
+  });
+
+  document.addEventListener("dragend", () => {
+    if (!dragged) {
+      return;
+    }
+    dragged.classList.remove("opacity-50");
+    if (indexOf(dragged) !== startIndex) {
+      htmx.trigger(dragged.closest("[data-reorder]"), "reordered");
+    }
+    dragged = null;
+  });
+})();
@@ -1,10 +1,26 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Permission
-from django.test import Client, TestCase
+from django.contrib.auth.models import Group, Permission
+from django.contrib.sessions.models import Session
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, router
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from guardian.shortcuts import assign_perm
 
 from game import models
+from game.scores import rebuild_scores, refresh_team_round_score
+from host.forms import GameForm
+from host.permissions import GamePermissions, grant_game_perms, revoke_game_perms
+from triviagame import metrics, replica
 
 User = get_user_model()
 
@@ -85,6 +101,165 @@ class EditorTests(TestCase):
         self.assertTrue(self.user.has_perm('game.host_game', game))
         self.assertTrue(self.user.has_perm('game.view_game', game))
 
+    def test_import_game_creates_game_from_uploaded_file(self):
+        upload = SimpleUploadedFile(
+            'pub quiz.md',
+            b"## Round 1\n1. Q1\n   Answer: A1\n2. Q2\n",
+        )
+
+        response = self.client.post(reverse('import_game'), {'file': upload})
+
+        game = models.Game.objects.get(name='pub quiz')
+        self.assertRedirects(response, reverse('edit_game', args=(game.id,)))
+        self.assertEqual(game.page_set.get().question_set.count(), 2)
+        self.assertTrue(self.user.has_perm('game.host_game', game))
+
+    def test_import_game_shows_problems_with_the_file(self):
+        upload = SimpleUploadedFile('quiz.csv', b"page,question\nRound 1,\n")
+
+        response = self.client.post(reverse('import_game'), {'file': upload, 'name': 'Quiz'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Page 1, question 1: question: This field cannot be blank.')
+        self.assertFalse(models.Game.objects.exists())
+
+    def test_saving_a_game_never_reuses_a_version(self):
+        game = self._game_with_questions('Versions', pages=1, questions=1)
+        game.state = models.Game.GameState.CLOSED
+        game.save()
+        # the game as an edit_game request loaded it
+        stale = models.Game.objects.get(pk=game.pk)
+
+        # meanwhile, a page is edited in another request
+        page = game.page_set.get()
+        page.title = 'Round One'
+        page.save()
+        after_page_edit = models.Game.objects.get(pk=game.pk)
+
+        GameForm({'name': 'Versions 2'}, instance=stale).save()
+
+        saved = models.Game.objects.get(pk=game.pk)
+        self.assertEqual(saved.name, 'Versions 2')
+        self.assertEqual(saved.version, after_page_edit.version + 1)
+        self.assertEqual(saved.results_version, after_page_edit.results_version)
+
+    def _game_with_questions(self, name, pages, questions):
+        game = models.Game.objects.create(name=name, state=models.Game.GameState.ACCEPTING_TEAMS)
+        assign_perm('change_game', self.user, game)
+        for page_order in range(1, pages + 1):
+            page = models.Page.objects.create(
+                game=game,
+                order=page_order,
+                title=f'Round {page_order}',
+                is_hidden=page_order == pages,
+                state=models.Page.PageState.SCORING,
+            )
+            for order in range(1, questions + 1):
+                models.Question.objects.create(
+                    page=page,
+                    order=order,
+                    question=f'Q{order}',
+                    answer=f'A{order}',
+                    accepted_answers='a\nb',
+                    possible_points=2,
+                    numeric_tolerance=0.5,
+                )
+        models.Team.objects.create(game=game, name='Alpha')
+        return game
+
+    def test_clone_game_copies_pages_and_questions_into_a_closed_game(self):
+        game = self._game_with_questions('Monthly', pages=2, questions=3)
+        editor = self.client.get(reverse('edit_game', args=(game.id,)))
+        self.assertContains(editor, reverse('clone_game', args=(game.id,)))
+
+        response = self.client.post(reverse('clone_game', args=(game.id,)))
+
+        clone = models.Game.objects.exclude(pk=game.pk).get()
+        self.assertRedirects(response, reverse('edit_game', args=(clone.id,)))
+        self.assertEqual(clone.name, 'Monthly (copy)')
+        self.assertEqual(clone.state, models.Game.GameState.CLOSED)
+        self.assertNotEqual(clone.passcode, game.passcode)
+        self.assertTrue(self.user.has_perm('game.host_game', clone))
+        self.assertFalse(clone.team_set.exists())
+
+        def contents(g):
+            return list(
+                models.Question.objects
+                .filter(page__game=g)
+                .values_list(
+                    'page__order', 'page__title', 'page__is_hidden', 'page__state',
+                    'order', 'question', 'answer', 'accepted_answers', 'possible_points', 'numeric_tolerance',
+                )
+            )
+        copied = contents(clone)
+        self.assertEqual(len(copied), 6)
+        self.assertEqual(
+            copied,
+            [(*row[:3], models.Page.PageState.LOCKED, *row[4:]) for row in contents(game)],
+        )
+
+    def test_clone_game_query_count_does_not_grow_with_the_game(self):
+        small = self._game_with_questions('Small', pages=1, questions=1)
+        large = self._game_with_questions('Large', pages=5, questions=20)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            self.client.post(reverse('clone_game', args=(small.id,)))
+
+        with self.assertNumQueries(len(small_queries.captured_queries)):
+            self.client.post(reverse('clone_game', args=(large.id,)))
+
+    def test_question_reorder_applies_the_whole_order_in_two_updates(self):
+        game = self._game_with_questions('Reorder', pages=1, questions=5)
+        game.state = models.Game.GameState.CLOSED
+        game.save()
+        game.refresh_from_db()
+        page = game.page_set.get()
+        ids = list(page.question_set.values_list('id', flat=True))
+        new_order = [ids[4], *ids[:4]]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('question_reorder', args=(page.id,)),
+                {'order': new_order},
+                HTTP_HX_REQUEST='true',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(page.question_set.values_list('id', flat=True)), new_order)
+        self.assertEqual(list(page.question_set.values_list('order', flat=True)), [1, 2, 3, 4, 5])
+        question_updates = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE "game_question"')
+        ]
+        self.assertEqual(len(question_updates), 2)
+        self.assertContains(response, 'id="question-list"', count=1)
+        self.assertGreater(models.Game.objects.get(pk=game.pk).version, game.version)
+
+    def test_page_reorder_rejects_an_incomplete_order(self):
+        game = self._game_with_questions('Reorder', pages=3, questions=1)
+        game.state = models.Game.GameState.CLOSED
+        game.save()
+        ids = list(game.page_set.values_list('id', flat=True))
+
+        response = self.client.post(reverse('page_reorder', args=(game.id,)), {'order': ids[:2]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(game.page_set.values_list('id', flat=True)), ids)
+
+    def test_page_move_swaps_with_its_neighbour(self):
+        game = self._game_with_questions('Move', pages=3, questions=1)
+        game.state = models.Game.GameState.CLOSED
+        game.save()
+        first, second, third = game.page_set.all()
+
+        response = self.client.post(reverse('page_down', args=(first.id,)), HTTP_HX_REQUEST='true')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(game.page_set.values_list('id', flat=True)),
+            [second.id, first.id, third.id],
+        )
+
     def test_new_page_sets_next_order_value(self):
         game = models.Game.objects.create(name='Page Order Game')
         assign_perm('change_game', self.user, game)
@@ -148,6 +323,41 @@ class HostInterfaceTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(game.state, models.Game.GameState.ACCEPTING_TEAMS)
 
+    def test_set_page_state_notifies_players_only_when_state_changes(self):
+        game = models.Game.objects.create(name='Notify Game')
+        page = models.Page.objects.create(game=game, order=1, title='Round 1')
+        assign_perm('host_game', self.user, game)
+
+        with mock.patch('host.views.host.game_changed') as game_changed:
+            for state in ('OPEN', 'OPEN'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post(
+                        reverse('set_page_state', args=(game.id,)),
+                        {'page': page.id, 'state': state},
+                        HTTP_HX_REQUEST='true',
+                    )
+                self.assertEqual(response.status_code, 204)
+
+        game_changed.assert_called_once_with(game.id)
+
+    def test_moving_a_page_to_scoring_grades_it_automatically(self):
+        game = models.Game.objects.create(name='Autograde Game')
+        page = models.Page.objects.create(game=game, order=1, title='Round 1', state=models.Page.PageState.OPEN)
+        question = models.Question.objects.create(page=page, order=1, question='Q1', answer='Paris')
+        team = models.Team.objects.create(game=game, name='Team')
+        response_row = models.Response.objects.create(question=question, team=team, value='PARIS')
+        assign_perm('host_game', self.user, game)
+
+        self.client.post(
+            reverse('set_page_state', args=(game.id,)),
+            {'page': page.id, 'state': 'SCORING'},
+            HTTP_HX_REQUEST='true',
+        )
+
+        response_row.refresh_from_db()
+        self.assertTrue(response_row.graded)
+        self.assertEqual(response_row.score, 1)
+
     def test_assign_score_grades_response_when_page_is_scoring(self):
         game = models.Game.objects.create(name='Scoring Game')
         page = models.Page.objects.create(
@@ -177,7 +387,635 @@ class HostInterfaceTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response_row.graded)
         self.assertEqual(response_row.score, 2)
+        self.assertEqual(models.TeamRoundScore.objects.get(team=team, page=page).points, 2)
+
+
+class AssignScoresTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='hoster', password='hostpass123')
+        self.client.login(username='hoster', password='hostpass123')
+        self.game = models.Game.objects.create(name='Scoring Game')
+        assign_perm('host_game', self.user, self.game)
+        self.page = models.Page.objects.create(
+            game=self.game,
+            order=1,
+            title='Round 1',
+            state=models.Page.PageState.SCORING,
+        )
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1', possible_points=2)
+        self.teams = models.Team.objects.bulk_create(
+            models.Team(game=self.game, name=f'Team {n}') for n in range(20)
+        )
+        self.responses = models.Response.objects.bulk_create(
+            models.Response(question=self.question, team=team, value='Answer')
+            for team in self.teams
+        )
+
+    def post(self, scores):
+        return self.client.post(
+            reverse('assign_scores', args=(self.game.id,)),
+            json.dumps({'scores': scores}),
+            content_type='application/json',
+        )
+
+    def test_scores_many_responses_and_returns_only_changes(self):
+        self.post([[self.responses[0].id, 1]])
+
+        scores = [[r.id, 2] for r in self.responses[1:]] + [[self.responses[0].id, 1]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(scores)
+
+        self.assertEqual(response.status_code, 200)
+        changed = {row['response'] for row in response.json()['changed']}
+        self.assertEqual(changed, {r.id for r in self.responses[1:]})
+        self.assertLess(len(queries), 20)
+        self.assertEqual(
+            dict(models.TeamRoundScore.objects.values_list('team_id', 'points')),
+            {team.id: 1 if team == self.teams[0] else 2 for team in self.teams},
+        )
+
+    def test_negative_score_unscores(self):
+        self.post([[self.responses[0].id, 2]])
+
+        response = self.post([[self.responses[0].id, -1]])
+
+        self.assertEqual(response.json()['changed'], [{'response': self.responses[0].id, 'score': 0, 'graded': False}])
+        self.assertEqual(models.TeamRoundScore.objects.get(team=self.teams[0]).points, 0)
+
+    def test_rejects_the_whole_batch_if_any_score_is_invalid(self):
+        other_game = models.Game.objects.create(name='Other')
+        other_page = models.Page.objects.create(game=other_game, order=1, title='Other', state=models.Page.PageState.SCORING)
+        other_question = models.Question.objects.create(page=other_page, order=1, question='Q')
+        other_response = models.Response.objects.create(question=other_question, team=models.Team.objects.create(game=other_game, name='T'), value='A')
+
+        self.assertEqual(self.post([[self.responses[0].id, 1], [other_response.id, 1]]).status_code, 400)
+        self.assertEqual(self.post([[self.responses[0].id, 3]]).status_code, 400)
+        self.assertEqual(self.post([[self.responses[0].id, 1], [self.responses[0].id, 2]]).status_code, 400)
+        self.assertEqual(self.post('nope').status_code, 400)
+
+        self.page.state = models.Page.PageState.OPEN
+        self.page.save()
+        self.assertEqual(self.post([[self.responses[0].id, 1]]).status_code, 409)
+
+        self.assertFalse(models.Response.objects.filter(graded=True).exists())
+
+
+class GroupScoringTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='hoster', password='hostpass123')
+        self.client.login(username='hoster', password='hostpass123')
+        self.game = models.Game.objects.create(name='Scoring Game')
+        assign_perm('host_game', self.user, self.game)
+        self.page = models.Page.objects.create(
+            game=self.game,
+            order=1,
+            title='Round 1',
+            state=models.Page.PageState.SCORING,
+        )
+        self.question = models.Question.objects.create(page=self.page, order=1, question='Q1', answer='Zzz')
+        teams = models.Team.objects.bulk_create(
+            models.Team(game=self.game, name=f'Team {n}') for n in range(6)
+        )
+        self.responses = models.Response.objects.bulk_create(
+            models.Response(question=self.question, team=team, value=value)
+            for team, value in zip(teams, ['Paris', 'paris ', 'PARÍS', 'Paris', 'London', 'Lyon'])
+        )
+
+    def test_scoring_page_groups_normalized_answers(self):
+        response = self.client.get(reverse('score_page', args=(self.game.id, self.page.id)))
+
+        groups = response.context['questions'][0].response_groups()
+        self.assertEqual([len(group.responses) for group in groups], [4, 1, 1])
+        self.assertContains(response, '&times;4')
+        # every way the answer was written is shown
+        self.assertEqual(groups[0].values, ['Paris', 'paris ', 'PARÍS'])
+
+    def test_answers_differing_in_symbols_are_not_grouped(self):
+        question = models.Question.objects.create(page=self.page, order=2, question='Q2')
+        models.Response.objects.bulk_create(
+            models.Response(question=question, team=response.team, value=value)
+            for response, value in zip(self.responses, ['-40', '40', 'C++', 'C#', 'C', 'c++'])
+        )
+
+        groups = question.response_groups()
+
+        self.assertEqual(sorted(group.values for group in groups), [['-40'], ['40'], ['C'], ['C#'], ['C++', 'c++']])
+
+    def test_one_click_scores_the_whole_group(self):
+        paris = ','.join(str(r.id) for r in self.responses[:4])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('assign_group_score', args=(self.game.id,)),
+                {'question': self.question.id, 'responses': paris, 'score': 1},
+                HTTP_HX_REQUEST='true',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sum(q['sql'].startswith('UPDATE "game_response"') for q in queries.captured_queries),
+            1,
+        )
+        self.assertEqual(models.Response.objects.filter(graded=True, score=1).count(), 4)
+        self.assertEqual(models.TeamRoundScore.objects.filter(points=1).count(), 4)
+
+    def test_group_must_be_one_question_in_this_game(self):
+        other_question = models.Question.objects.create(page=self.page, order=2, question='Q2')
+        other = models.Response.objects.create(
+            question=other_question,
+            team=self.responses[0].team,
+            value='Paris',
+        )
+
+        response = self.client.post(
+            reverse('assign_group_score', args=(self.game.id,)),
+            {'question': self.question.id, 'responses': f'{self.responses[0].id},{other.id}', 'score': 1},
+            HTTP_HX_REQUEST='true',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Response.objects.filter(graded=True).exists())
+
+    def test_group_score_must_be_within_the_question_points(self):
+        response = self.client.post(
+            reverse('assign_group_score', args=(self.game.id,)),
+            {'question': self.question.id, 'responses': str(self.responses[0].id), 'score': 2},
+            HTTP_HX_REQUEST='true',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Response.objects.filter(graded=True).exists())
+
+
+class GameDataTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyst', password='analystpass123')
+        self.client.login(username='analyst', password='analystpass123')
+        self.game = models.Game.objects.create(name='Data Game')
+        assign_perm('view_game', self.user, self.game)
+        self.teams = [
+            models.Team.objects.create(game=self.game, name=name, members='m')
+            for name in ('Beta', 'Alpha')
+        ]
+        self.questions = []
+        for page_order in (1, 2):
+            page = models.Page.objects.create(game=self.game, order=page_order, title=f'Round {page_order}')
+            for order in (1, 2):
+                self.questions.append(models.Question.objects.create(page=page, order=order, question='Q'))
+        for question in self.questions[:3]:
+            for team in self.teams:
+                models.Response.objects.create(question=question, team=team, value='v', graded=True, score=1)
+
+    def _get(self, **headers):
+        response = self.client.get(reverse('game_data', args=(self.game.id,)), **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else None
+
+    def test_game_data_streams_every_question_with_responses_in_team_order(self):
+        response, body = self._get()
+
+        data = json.loads(body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['round'], row['question']) for row in data['data']], [(1, 1), (1, 2), (2, 1), (2, 2)])
+        alpha, beta = self.teams[1], self.teams[0]
+        self.assertEqual(
+            [r['team'] for r in data['data'][0]['responses']],
+            [f't{alpha.id}', f't{beta.id}'],
+        )
+        self.assertEqual(data['data'][3]['responses'], [])
+        self.assertEqual(set(data['teams']), {f't{alpha.id}', f't{beta.id}'})
+
+    def test_game_data_keeps_the_order_of_the_models_default_orderings(self):
+        # added out of order, so neither insertion order nor ids give this
+        first_page = models.Page.objects.create(game=self.game, order=0, title='Warm up')
+        late = models.Question.objects.create(page=first_page, order=2, question='Q')
+        early = models.Question.objects.create(page=first_page, order=1, question='Q')
+        aardvarks = models.Team.objects.create(game=self.game, name='Aardvarks')
+        for question in (late, early):
+            for team in (*self.teams, aardvarks):
+                models.Response.objects.create(question=question, team=team, value='v')
+
+        _, body = self._get()
+
+        # what game.json's per-question queries gave before it streamed
+        expected = [
+            (q.page.order, q.order, [
+                f"t{team_id}"
+                for team_id in models.Response.objects.filter(question=q).values_list('team_id', flat=True)
+            ])
+            for q in models.Question.objects.filter(page__game=self.game).select_related('page')
+        ]
+        self.assertEqual(
+            [
+                (row['round'], row['question'], [r['team'] for r in row['responses']])
+                for row in json.loads(body)['data']
+            ],
+            expected,
+        )
+        self.assertEqual(expected[0][:2], (0, 1))
+
+    def test_game_data_streams_lazily_under_asgi(self):
+        self.async_client.cookies = self.client.cookies
+
+        async def get():
+            response = await self.async_client.get(reverse('game_data', args=(self.game.id,)))
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        response, body = async_to_sync(get)()
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(json.loads(body), json.loads(self._get()[1]))
+
+    def test_game_data_query_count_does_not_grow_with_questions(self):
+        with CaptureQueriesContext(connection) as before:
+            self._get()
+
+        page = models.Page.objects.create(game=self.game, order=3, title='Round 3')
+        for order in range(1, 6):
+            models.Question.objects.create(page=page, order=order, question='Q')
+
+        with self.assertNumQueries(len(before.captured_queries)):
+            self._get()
+
+    def test_game_data_is_not_modified_until_a_score_changes(self):
+        first, _ = self._get()
+        unchanged, _ = self._get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+        assign_perm('host_game', self.user, self.game)
+        self.questions[0].page.state = models.Page.PageState.SCORING
+        self.questions[0].page.save()
+        row = models.Response.objects.filter(question=self.questions[0]).first()
+        self.client.post(
+            reverse('assign_score', args=(self.game.id,)),
+            {'response': row.id, 'score': '0'},
+            HTTP_HX_REQUEST='true',
+        )
+
+        changed, _ = self._get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+
+    def test_responses_stream_as_csv(self):
+        response = self.client.get(reverse('export_responses_csv', args=(self.game.id,)))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'team,round,question,value,score,graded')
+        self.assertEqual(lines[1:3], ['Alpha,1,1,v,1,True', 'Beta,1,1,v,1,True'])
+        self.assertEqual(len(lines), 1 + 6)
+
+    def test_responses_stream_lazily_under_asgi(self):
+        self.async_client.cookies = self.client.cookies
+        url = reverse('export_responses_csv', args=(self.game.id,))
+
+        async def get():
+            response = await self.async_client.get(url)
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        response, body = async_to_sync(get)()
+
+        self.assertTrue(response.is_async)
+        self.assertEqual(body, b''.join(self.client.get(url).streaming_content))
+
+    def test_responses_stream_as_ndjson_in_a_constant_number_of_queries(self):
+        url = reverse('export_responses_ndjson', args=(self.game.id,))
+        with CaptureQueriesContext(connection) as before:
+            b''.join(self.client.get(url).streaming_content)
+
+        team = models.Team.objects.create(game=self.game, name='Gamma')
+        for question in self.questions:
+            models.Response.objects.create(question=question, team=team, value='w')
+
+        with self.assertNumQueries(len(before.captured_queries)):
+            body = b''.join(self.client.get(url).streaming_content)
+
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[2], {
+            'team': 'Gamma', 'round': 1, 'question': 1, 'value': 'w', 'score': 0, 'graded': False,
+        })
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyst', password='analystpass123')
+        self.client.login(username='analyst', password='analystpass123')
+        self.game = self._finished_game('Last Month')
+        assign_perm('view_game', self.user, self.game)
+
+    def _finished_game(self, name, days_ago=60, state=models.Game.GameState.CLOSED):
+        game = models.Game.objects.create(name=name, state=state)
+        teams = [
+            models.Team.objects.create(game=game, name=team_name, members=f'{team_name} members')
+            for team_name in ('Beta', 'Alpha')
+        ]
+        for page_order in (1, 2):
+            page = models.Page.objects.create(game=game, order=page_order, title=f'Round {page_order}')
+            for order in (1, 2):
+                question = models.Question.objects.create(page=page, order=order, question='Q')
+                for points, team in enumerate(teams):
+                    models.Response.objects.create(
+                        question=question, team=team, value=f'{team.name} {order}',
+                        graded=True, score=points + order,
+                    )
+        rebuild_scores(game.id)
+        # update() leaves last_edit_time alone
+        models.Game.objects.filter(pk=game.pk).update(
+            last_edit_time=timezone.now() - timedelta(days=days_ago),
+        )
+        return game
+
+    def _reports(self):
+        stats = self.client.get(reverse('host_leaderboard_stats', args=(self.game.id,))).json()
+        data = self.client.get(reverse('game_data', args=(self.game.id,)))
+        return stats, json.loads(b''.join(data.streaming_content))
+
+    def test_archived_game_keeps_its_leaderboard_and_game_data(self):
+        before = self._reports()
+
+        call_command('archive_games', '--days', '30', stdout=StringIO())
+
+        self.assertTrue(models.GameArchive.objects.filter(game=self.game).exists())
+        self.assertFalse(models.Team.objects.filter(game=self.game).exists())
+        self.assertFalse(models.Response.objects.filter(question__page__game=self.game).exists())
+        self.assertFalse(models.TeamRoundScore.objects.filter(page__game=self.game).exists())
+        self.assertEqual(self._reports(), before)
+        page = self.client.get(reverse('host_leaderboard', args=(self.game.id,)))
+        self.assertContains(page, 'Alpha members')
+
+    def test_recent_and_open_games_are_not_archived(self):
+        recent = self._finished_game('Last Week', days_ago=7)
+        still_open = self._finished_game('Marathon', state=models.Game.GameState.NO_NEW_TEAMS)
+        out = StringIO()
+
+        call_command('archive_games', '--days', '30', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue(), f"Would archive Last Month ({self.game.id})\n")
+        self.assertFalse(models.GameArchive.objects.exists())
+
+        call_command('archive_games', '--days', '30', stdout=StringIO())
+        self.assertEqual(
+            list(models.GameArchive.objects.values_list('game', flat=True)),
+            [self.game.id],
+        )
+        self.assertEqual(models.Team.objects.filter(game__in=[recent, still_open]).count(), 4)
+
+    def test_archived_game_exports_its_archived_responses(self):
+        url = reverse('export_responses_csv', args=(self.game.id,))
+        before = b''.join(self.client.get(url).streaming_content)
+
+        call_command('archive_games', '--days', '30', stdout=StringIO())
+
+        after = b''.join(self.client.get(url).streaming_content)
+        self.assertEqual(after, before)
+        self.assertEqual(len(after.splitlines()), 1 + 8)
+
+    def test_archived_game_cannot_be_reopened_and_keeps_its_results(self):
+        assign_perm('host_game', self.user, self.game)
+        before = self._reports()
+        call_command('archive_games', '--days', '30', stdout=StringIO())
+
+        response = self.client.post(
+            reverse('update_game_state', args=(self.game.id, models.Game.GameState.ACCEPTING_TEAMS)),
+            HTTP_HX_REQUEST='true',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.state, models.Game.GameState.CLOSED)
+        # even a team added some other way doesn't hide the archive
+        models.Team.objects.create(game=self.game, name='Latecomers')
+        self.assertEqual(self._reports(), before)
+
+class GamePermissionsTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host', password='pw')
+        self.games = [
+            models.Game.objects.create(name=f'Game {n}')
+            for n in range(5)
+        ]
+        for game in self.games[:3]:
+            grant_game_perms(self.host, game)
+
+    def test_host_home_checks_every_game_in_one_query(self):
+        self.client.login(username='host', password='pw')
+        self.client.get(reverse('host_home'))
+
+        with CaptureQueriesContext(connection) as few_games:
+            self.client.get(reverse('host_home'))
+        for n in range(5, 10):
+            grant_game_perms(self.host, models.Game.objects.create(name=f'Game {n}'))
+        with CaptureQueriesContext(connection) as more_games:
+            response = self.client.get(reverse('host_home'))
+
+        self.assertEqual(len(more_games), len(few_games))
+        self.assertContains(response, reverse('edit_game', args=(self.games[0].id,)))
+        self.assertNotContains(response, reverse('pages', args=(self.games[4].id,)))
+
+    def test_group_perms_count(self):
+        group = Group.objects.create(name='hosts')
+        group.user_set.add(self.host)
+        assign_perm('host_game', group, self.games[4])
+
+        checker = GamePermissions(self.host)
+
+        self.assertTrue(checker.has_perm('game.host_game', self.games[4]))
+        self.assertFalse(checker.has_perm('game.change_game', self.games[4]))
+        self.assertEqual(checker.get_perms(self.games[0]), ['change_game', 'host_game', 'view_game'])
+
+    @override_settings(GAME_PERMS_CACHE_SECONDS=60)
+    def test_cached_perms_are_dropped_when_hosts_change(self):
+        self.assertFalse(GamePermissions(self.host).has_perm('game.view_game', self.games[4]))
+
+        grant_game_perms(self.host, self.games[4])
+        self.assertTrue(GamePermissions(self.host).has_perm('game.view_game', self.games[4]))
+
+        revoke_game_perms(self.host, self.games[4])
+        self.assertFalse(GamePermissions(self.host).has_perm('game.view_game', self.games[4]))
+
+
+class ServerStatsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.host = User.objects.create_user(username='host', password='pw')
+
+    def test_only_superusers_see_stats(self):
+        self.client.login(username='host', password='pw')
+        response = self.client.get(reverse('server_stats'))
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('server_stats'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_requests_are_recorded_by_view_name(self):
+        self.client.login(username='admin', password='pw')
+        self.client.get(reverse('host_home'))
+        self.client.get(reverse('host_home'))
+
+        data = self.client.get(reverse('server_stats_data')).json()
+
+        home = data['views']['host_home']
+        self.assertEqual(home['requests'], 2)
+        self.assertGreater(home['queries']['max'], 0)
+        self.assertGreater(home['response_bytes']['max'], 0)
+
+    @override_settings(QUERY_BUDGETS={'host_home': 0})
+    def test_going_over_budget_logs_a_warning(self):
+        self.client.login(username='admin', password='pw')
+
+        with self.assertLogs('triviagame.metrics', 'WARNING') as logs:
+            self.client.get(reverse('host_home'))
+
+        self.assertIn('host_home ran', logs.output[0])
+        self.assertEqual(metrics.report()['host_home']['over_budget'], 1)
+
+    def test_streamed_bodies_count_against_the_budget(self):
+        self.client.login(username='admin', password='pw')
+        game = models.Game.objects.create(name='Game')
+        page = models.Page.objects.create(game=game, order=1, title='Round 1')
+        models.Question.objects.create(page=page, order=1, question='Q1')
+        url = reverse('game_data', args=(game.id,))
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.client.get(url).streaming_content)
+        sent = len(queries)
+        metrics.reset()
+
+        # the body's own queries are what put it over
+        with override_settings(QUERY_BUDGETS={'game_data': sent - 1}):
+            with self.assertLogs('triviagame.metrics', 'WARNING') as logs:
+                b''.join(self.client.get(url).streaming_content)
+
+        self.assertIn('game_data ran', logs.output[0])
+        self.assertEqual(metrics.report()['game_data']['queries']['max'], sent)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(replica, 'is_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_in_reporting_view(self, model):
+        return replica.reads_from_replica(lambda request: router.db_for_read(model))(None)
+
+    def test_reporting_views_read_game_tables_from_the_replica(self):
+        self.assertEqual(self.read_in_reporting_view(models.Response), 'replica')
+        self.assertEqual(self.read_in_reporting_view(Session), 'default')
+        self.assertEqual(router.db_for_read(models.Response), 'default')
+
+    def test_writes_pin_the_rest_of_the_request_to_the_primary(self):
+        state, token = replica.start_request(pinned=False)
+        try:
+            self.assertEqual(router.db_for_write(models.Response), 'default')
+            self.assertEqual(self.read_in_reporting_view(models.Response), 'default')
+        finally:
+            replica.end_request(token)
+
+        self.assertTrue(state.wrote)
+
+    def test_pinned_browsers_read_from_the_primary(self):
+        _, token = replica.start_request(pinned=True)
+        try:
+            self.assertEqual(self.read_in_reporting_view(models.Response), 'default')
+        finally:
+            replica.end_request(token)
+
+
+class ReplicaPinTests(TestCase):
+    @mock.patch.object(replica, 'is_configured', return_value=True)
+    def test_scoring_pins_the_host_to_the_primary(self, _):
+        user = User.objects.create_user(username='hoster', password='hostpass123')
+        self.client.login(username='hoster', password='hostpass123')
+        game = models.Game.objects.create(name='Game')
+        assign_perm('host_game', user, game)
+        page = models.Page.objects.create(game=game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+        question = models.Question.objects.create(page=page, order=1, question='Q1', possible_points=2)
+        team = models.Team.objects.create(game=game, name='Team')
+        row = models.Response.objects.create(question=question, team=team, value='A')
+
+        response = self.client.post(
+            reverse('assign_score', args=(game.id,)),
+            {'response': row.id, 'score': '2'},
+            HTTP_HX_REQUEST='true',
+        )
+
+        self.assertEqual(response.cookies[replica.PIN_COOKIE]['max-age'], 10)
+
+
+@skipUnless(replica.is_configured(), "set REPLICA_DATABASE_URL to an SQLite file to run")
+class ReplicaIntegrationTests(TransactionTestCase):
+    databases = '__all__'
+
+    def test_host_reads_the_replica_until_they_score(self):
+        user = User.objects.create_user(username='hoster', password='hostpass123')
+        self.client.login(username='hoster', password='hostpass123')
+        game = models.Game.objects.create(name='Game')
+        assign_perm('host_game', user, game)
+        assign_perm('view_game', user, game)
+        page = models.Page.objects.create(game=game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+        question = models.Question.objects.create(page=page, order=1, question='Q1', possible_points=3)
+        team = models.Team.objects.create(game=game, name='Team')
+        row = models.Response.objects.create(question=question, team=team, value='A')
+        replica.sync_sqlite_replica()
+
+        def scores():
+            stats = self.client.get(reverse('host_leaderboard_stats', args=(game.id,))).json()
+            return stats['leaderboard'][0]['scores']
+
+        # scored behind the replica's back
+        row.score, row.graded = 1, True
+        row.save()
+        refresh_team_round_score(team.id, page.id)
+        self.assertEqual(scores(), [0, 0])
+
+        self.client.post(
+            reverse('assign_score', args=(game.id,)),
+            {'response': row.id, 'score': '3'},
+            HTTP_HX_REQUEST='true',
+        )
+        self.assertEqual(scores(), [3, 3])
+
+    def test_game_data_etag_matches_the_replica_body(self):
+        user = User.objects.create_user(username='analyst', password='analystpass123')
+        self.client.login(username='analyst', password='analystpass123')
+        game = models.Game.objects.create(name='Game')
+        assign_perm('view_game', user, game)
+        page = models.Page.objects.create(game=game, order=1, title='Round 1', state=models.Page.PageState.SCORING)
+        question = models.Question.objects.create(page=page, order=1, question='Q1', possible_points=3)
+        team = models.Team.objects.create(game=game, name='Team')
+        row = models.Response.objects.create(question=question, team=team, value='A')
+        replica.sync_sqlite_replica()
+        url = reverse('game_data', args=(game.id,))
+        first = self.client.get(url)
+
+        # scored behind the replica's back
+        row.score, row.graded = 2, True
+        row.save()
+        models.Game.bump_results_version(game.id)
+
+        # the replica still has the old body, and says so
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        replica.sync_sqlite_replica()
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        data = json.loads(b''.join(fresh.streaming_content))
+        self.assertEqual(data['data'][0]['responses'][0]['awarded_points'], 2)
+
+
+    def test_a_team_the_replica_has_not_seen_stays_in_the_session(self):
+        game = models.Game.objects.create(name='Game', state=models.Game.GameState.ACCEPTING_TEAMS)
+        replica.sync_sqlite_replica()
+        team = models.Team.objects.create(game=game, name='Team')
+        session = self.client.session
+        session['game'] = game.id
+        session['team'] = team.id
+        session.save()
+
+        self.client.get(reverse('leaderboard'))
 
+        self.assertEqual(self.client.session.get('team'), team.id)
 
 class GameLifecycleIntegrationTests(TestCase):
     def setUp(self):
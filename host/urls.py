@@ -11,13 +11,20 @@ urlpatterns = [
     path('<int:game_id>/pages/<int:page_id>', views.score_page, name='score_page'),
     path('<int:game_id>/pages/<int:page_id>/state/', views.toggle_hidden_questions, name='toggle_hidden_questions'),
     path('<int:game_id>/score/', views.assign_score, name='assign_score'),
+    path('<int:game_id>/scores/', views.assign_scores, name='assign_scores'),
+    path('<int:game_id>/score/group/', views.assign_group_score, name='assign_group_score'),
     path('<int:game_id>/game.json', views.game_data, name='game_data'),
     path('<int:game_id>/leaderboard.json', views.host_leaderboard_stats, name='host_leaderboard_stats'),
+    path('<int:game_id>/responses.csv', views.export_responses, { 'format': 'csv' }, name='export_responses_csv'),
+    path('<int:game_id>/responses.ndjson', views.export_responses, { 'format': 'ndjson' }, name='export_responses_ndjson'),
     path('<int:game_id>/leaderboard', views.host_leaderboard, name='host_leaderboard'),
     path('<int:game_id>/team/<int:team_id>', views.team_page, name='team_page'),
     path('<int:game_id>/team/<int:team_id>/edit', views.hx_edit_team, name='edit_team'),
     path('editor/new/', views.new_game, name='new_game'),
+    path('editor/import/', views.import_game, name='import_game'),
     path('editor/<int:game_id>/', views.edit_game, name='edit_game'),
+    path('editor/<int:game_id>/clone', views.clone_game, name='clone_game'),
+    path('editor/<int:game_id>/pages/order/', views.page_reorder, name='page_reorder'),
     path('editor/<int:game_id>/audit', views.audit_game, name='audit_game'),
     path('editor/<int:game_id>/hosts', views.edit_game_hosts, name='edit_game_hosts'),
     path('editor/<int:game_id>/hosts/<int:user_id>', views.hx_remove_game_host, name='remove_game_host'),
@@ -25,6 +32,7 @@ urlpatterns = [
     path('editor/page/<int:page_id>/metadata/', views.hx_edit_page_metadata, name='edit_page_metadata'),
     path('editor/page/<int:page_id>/up/', views.page_move, { 'delta': -1 }, name='page_up'),
     path('editor/page/<int:page_id>/down/', views.page_move, { 'delta': 1 }, name='page_down'),
+    path('editor/page/<int:page_id>/questions/order/', views.question_reorder, name='question_reorder'),
     path('editor/page/new/<int:game_id>/', views.new_page, name='new_page'),
     path('editor/page/<int:page_id>/delete/', views.delete_page, name='delete_page'),
     path('editor/question/<int:question_id>/', views.edit_question, name='edit_question'),
@@ -32,6 +40,8 @@ urlpatterns = [
     path('editor/question/<int:question_id>/down/', views.question_move, { 'delta': 1 }, name='question_down'),
     path('editor/question/new/<int:page_id>/', views.new_question, name='new_question'),
     path('editor/question/<int:question_id>/delete/', views.delete_question, name='delete_question'),
+    path('stats/', views.server_stats, name='server_stats'),
+    path('stats.json', views.server_stats_data, name='server_stats_data'),
     path('auth/prelogout', views.host_confirm_logout, name='confirm_logout'),
     path('auth/password_change/', auth_views.PasswordChangeView.as_view(
         template_name='host/password_change_form.html',
@@ -1,9 +1,14 @@
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseForbidden, StreamingHttpResponse
 from functools import wraps
+from itertools import islice
+
+from asgiref.sync import sync_to_async
 
 from game.models import Game, Page, Question
+from host.permissions import get_game_permissions
 
 
 def _can_edit_obj(klass, pk_name, path_to_game):
@@ -18,7 +23,7 @@ def _can_edit_obj(klass, pk_name, path_to_game):
             for part in path_to_game.split('.'):
                 game = getattr(game, part)
 
-            if not request.user.has_perm('game.change_game', game):
+            if not get_game_permissions(request).has_perm('game.change_game', game):
                 if request.htmx:
                     messages.error(request, "You don't have permission to do that.")
                 return HttpResponseForbidden("You don't have permission to do that.")
@@ -46,7 +51,8 @@ def _has_any_perm(perms_list):
         def inner(request, *args, **kwargs):
             game_id = kwargs['game_id']
             game = Game.objects.get(pk=game_id)
-            if not any([request.user.has_perm(perm, game) for perm in perms_list]):
+            checker = get_game_permissions(request)
+            if not any(checker.has_perm(perm, game) for perm in perms_list):
                 if request.htmx:
                     messages.error(request, "You don't have permission to do that.")
                 return HttpResponseForbidden("You don't have permission to do that.")
@@ -81,3 +87,25 @@ def build_absolute_uri(request, relative_url):
     if not settings.DEBUG:
         full_url = full_url.replace('http://', 'https://')
     return full_url
+
+
+# lines handed from the worker thread to the event loop at a time
+_STREAM_BATCH = 200
+
+
+def streaming_response(request, lines, **kwargs):
+    """A `StreamingHttpResponse` of `lines`, a generator which reads the
+    database as it goes. Under ASGI, Django would read a plain generator
+    into a list before sending any of it, so the lines are fed from a
+    thread in batches instead."""
+    if isinstance(request, ASGIRequest):
+        lines = _in_batches_from_a_thread(lines)
+    return StreamingHttpResponse(lines, **kwargs)
+
+
+async def _in_batches_from_a_thread(lines):
+    lines = iter(lines)
+    next_batch = sync_to_async(lambda: list(islice(lines, _STREAM_BATCH)))
+    while batch := await next_batch():
+        for line in batch:
+            yield line
@@ -1,3 +1,4 @@
 from host.views.host import *
 from host.views.editor import *
 from host.views.monaco import *
+from host.views.stats import *
@@ -1,4 +1,5 @@
 from http import HTTPStatus
+from pathlib import PurePath
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
@@ -20,24 +21,28 @@ from django.views.decorators.http import require_POST, require_http_methods
 from django_htmx.http import HttpResponseClientRedirect, HttpResponseClientRefresh
 from guardian.ctypes import get_content_type
 from guardian.shortcuts import (
-    assign_perm,
-    remove_perm,
     get_users_with_perms,
 )
 from guardian.utils import get_group_obj_perms_model, get_user_obj_perms_model
 
+from game import importer
 from game.models import Game, Page, Question
-from host.forms import GameForm, GameHostForm, PageForm, QuestionForm
+from game.scores import rebuild_scores
+from host.forms import GameForm, GameHostForm, ImportGameForm, PageForm, QuestionForm
+from host.permissions import grant_game_perms, revoke_game_perms
 from host.view_utils import (
     can_edit_game, can_edit_page, can_edit_question
 )
+from triviagame.replica import reads_from_replica
 
 User = get_user_model()
 
 
 __all__ = [
     'new_game',
+    'import_game',
     'edit_game',
+    'clone_game',
     'audit_game',
     'edit_game_hosts',
     'hx_remove_game_host',
@@ -46,10 +51,12 @@ __all__ = [
     'hx_edit_page_metadata',
     'delete_page',
     'page_move',
+    'page_reorder',
     'new_question',
     'edit_question',
     'delete_question',
     'question_move',
+    'question_reorder',
 ]
 
 
@@ -67,9 +74,7 @@ def new_game(request):
         if form.is_valid():
             with transaction.atomic():
                 game = form.save()
-                assign_perm('host_game', request.user, game)
-                assign_perm('change_game', request.user, game)
-                assign_perm('view_game', request.user, game)
+                grant_game_perms(request.user, game)
             return HttpResponseRedirect(reverse('edit_game', args=(game.id,)))
     
     else:
@@ -80,6 +85,42 @@ def new_game(request):
     })
 
 
+@login_required
+def import_game(request):
+    if not request.user.has_perm('game.add_game'):
+        return HttpResponseForbidden("Not authorized to create games.")
+
+    if request.method == 'POST':
+        form = ImportGameForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                with transaction.atomic():
+                    game = importer.import_game(
+                        form.cleaned_data['text'],
+                        form.cleaned_data['format'],
+                        name=form.cleaned_data['name'],
+                        default_name=PurePath(upload.name).stem,
+                    )
+                    grant_game_perms(request.user, game)
+            except ValidationError as e:
+                form.add_error('file', e)
+            else:
+                messages.success(
+                    request,
+                    f"Imported {game.page_set.count()} pages and "
+                    f"{Question.objects.filter(page__game=game).count()} questions.",
+                )
+                return HttpResponseRedirect(reverse('edit_game', args=(game.id,)))
+
+    else:
+        form = ImportGameForm()
+
+    return render(request, 'editor/import_game.html', {
+        'form': form,
+    })
+
+
 @login_required
 @can_edit_game
 def edit_game(request, game_id):
@@ -123,6 +164,21 @@ def edit_game(request, game_id):
 
 @login_required
 @can_edit_game
+@require_POST
+def clone_game(request, game_id):
+    if not request.user.has_perm('game.add_game'):
+        return HttpResponseForbidden("Not authorized to create games.")
+
+    with transaction.atomic():
+        game = importer.clone_game(request.game)
+        grant_game_perms(request.user, game)
+    messages.success(request, f"Copied {request.game.name} as {game.name}.")
+    return HttpResponseRedirect(reverse('edit_game', args=(game.id,)))
+
+
+@login_required
+@can_edit_game
+@reads_from_replica
 def audit_game(request, game_id):
     game = request.game
     game_hosts = get_users_with_perms(
@@ -237,10 +293,7 @@ def edit_game_hosts(request, game_id):
         if game_host_form.is_valid():
             # we allow adding hosts to an open game
             new_host = game_host_form.cleaned_data['host']
-            with transaction.atomic():
-                assign_perm('host_game', new_host, game)
-                assign_perm('change_game', new_host, game)
-                assign_perm('view_game', new_host, game)
+            grant_game_perms(new_host, game)
 
             if request.htmx:
                 Redirect = HttpResponseClientRedirect
@@ -280,10 +333,7 @@ def hx_remove_game_host(request, game_id, user_id):
         return HttpResponse(f'Cannot remove {friendly_name} as a host while the game is open.')
 
     if removable_host:
-        with transaction.atomic():
-            remove_perm('host_game', removable_host, game)
-            remove_perm('change_game', removable_host, game)
-            remove_perm('view_game', removable_host, game)
+        revoke_game_perms(removable_host, game)
         redo_link = reverse('edit_game_hosts', args=(game.id,))
         hx_vals = f'{{"host":{user_to_remove.id}}}'
         return HttpResponse(f'{friendly_name} was removed as host. <a class="btn btn-sm btn-outline-primary" hx-post="{redo_link}" hx-vals=\'{hx_vals}\'>Undo</a> to add them back.')
@@ -391,26 +441,9 @@ def page_move(request, page_id, delta):
     if page.game.is_open:
         return HttpResponseConflict('Cannot edit an open game')
 
-    max_page = page.game.page_set.last()
-    if delta == 1 and page.id == max_page.id:
-        raise IndexError
-    if delta == -1 and page.order == 1:
-        raise IndexError
-
-    try:
-        other_page = Page.objects.get(game=page.game, order=page.order + delta)
-        with transaction.atomic():
-            desired_order = page.order + delta
-            placeholder_order = max_page.order + 1
-            page.order = placeholder_order
-            page.save()
-            other_page.order = F('order') - delta
-            other_page.save()
-            page.order = desired_order
-            page.save()
-    except Page.DoesNotExist:
-        page.order = F('order') + delta
-        page.save()
+    ids = list(page.game.page_set.values_list('id', flat=True))
+    _move(ids, page.id, delta)
+    _apply_order(page.game.page_set, ids, page.game_id)
     
     if request.htmx:
         return render(request, 'editor/_page_list.html', {
@@ -487,6 +520,8 @@ def delete_question(request, question_id):
         with transaction.atomic():
             question.delete()
             page.question_set.filter(order__gt=order).update(order=F('order') - 1)
+            # any scored responses to the question went with it
+            rebuild_scores(page.game_id, page.id)
         messages.success(request, f"Question {order} deleted.")
         return HttpResponseRedirect(reverse('edit_page', args=(page.id,)))
 
@@ -506,26 +541,9 @@ def question_move(request, question_id, delta):
     if question.page.game.is_open:
         return HttpResponseConflict('Cannot edit an open game')
 
-    max_question = question.page.question_set.last()
-    if delta == 1 and question.id == max_question.id:
-        raise IndexError
-    if delta == -1 and question.order == 1:
-        raise IndexError
-
-    try:
-        other_question = Question.objects.get(page=question.page, order=question.order + delta)
-        with transaction.atomic():
-            desired_order = question.order + delta
-            placeholder_order = max_question.order + 1
-            question.order = placeholder_order
-            question.save()
-            other_question.order = F('order') - delta
-            other_question.save()
-            question.order = desired_order
-            question.save()
-    except Question.DoesNotExist:
-        question.order = F('order') + delta
-        question.save()
+    ids = list(question.page.question_set.values_list('id', flat=True))
+    _move(ids, question.id, delta)
+    _apply_order(question.page.question_set, ids, question.page.game_id)
     
     if request.htmx:
         return render(request, 'editor/_question_list.html', {
@@ -533,3 +551,90 @@ def question_move(request, question_id, delta):
         })
 
     return HttpResponseRedirect(reverse('edit_page', args=(question.page.id,)))
+
+
+@login_required
+@can_edit_game
+@require_POST
+def page_reorder(request, game_id):
+    """Puts the game's pages in the order of the `order` ids posted, which
+    must name every page exactly once."""
+    game = request.game
+    if game.is_open:
+        return HttpResponseConflict('Cannot edit an open game')
+
+    try:
+        _apply_order(game.page_set, _posted_ids(request), game.id)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if request.htmx:
+        return render(request, 'editor/_page_list.html', {
+            'game': game,
+        })
+
+    return HttpResponseRedirect(reverse('edit_game', args=(game.id,)))
+
+
+@login_required
+@can_edit_page
+@require_POST
+def question_reorder(request, page_id):
+    """Puts the page's questions in the order of the `order` ids posted,
+    which must name every question exactly once."""
+    page = request.page
+    if page.game.is_open:
+        return HttpResponseConflict('Cannot edit an open game')
+
+    try:
+        _apply_order(page.question_set, _posted_ids(request), page.game_id)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if request.htmx:
+        return render(request, 'editor/_question_list.html', {
+            'page': page,
+        })
+
+    return HttpResponseRedirect(reverse('edit_page', args=(page.id,)))
+
+
+def _posted_ids(request):
+    try:
+        return [int(id) for id in request.POST.getlist('order')]
+    except ValueError:
+        raise ValueError("expected integer ids")
+
+
+def _move(ids, id, delta):
+    "Swaps `id` with its neighbour `delta` away in `ids`"
+    index = ids.index(id)
+    other = index + delta
+    if other < 0 or other >= len(ids):
+        raise IndexError
+    ids[index], ids[other] = ids[other], ids[index]
+
+
+def _apply_order(queryset, ids, game_id):
+    """Numbers the rows in `queryset` (a game's pages or a page's
+    questions) from 1 in the order of `ids`, which must name each of them
+    exactly once. Takes two UPDATEs however many rows move."""
+    current = dict(queryset.values_list('id', 'order'))
+    if len(ids) != len(current) or set(ids) != set(current):
+        raise ValueError(f"expected each of the {len(current)} ids exactly once")
+
+    moved = [
+        queryset.model(id=id, order=order)
+        for order, id in enumerate(ids, start=1)
+        if current[id] != order
+    ]
+    if not moved:
+        return
+
+    with transaction.atomic():
+        # Negate first: orders are unique, and no negated order can clash
+        # with a final one, however the database orders the second UPDATE.
+        queryset.filter(pk__in=[row.id for row in moved]).update(order=-F('order'))
+        queryset.model.objects.bulk_update(moved, ['order'])
+        # neither UPDATE sends signals, so tell players' caches ourselves
+        Game.bump_version(game_id)
@@ -1,32 +1,44 @@
+import json
 from http import HTTPStatus
 from io import BytesIO
+from itertools import groupby
+from operator import itemgetter
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.exceptions import BadRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import (
     HttpResponse,
     HttpResponseBadRequest,
     JsonResponse,
     QueryDict,
 )
-from django.db.models import Sum
+from django.db import router, transaction
+from django.db.models import Prefetch, Sum
 from django.shortcuts import get_object_or_404, render
+from django.template.defaultfilters import pluralize
 from django.urls import reverse
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
 from django_htmx.http import trigger_client_event, HttpResponseClientRefresh
 from guardian.shortcuts import (
     get_objects_for_user,
     get_users_with_perms,
 )
 
-from game.models import Game, Page, Question, Response, Team
-from game.views import compute_leaderboard_data
+from game import autosave, export
+from game.archive import load_archive
+from game.events import game_changed
+from game.grading import grade_page
+from game.leaderboard import get_leaderboard
+from game.models import Game, GameArchive, Page, Question, Response, Team
+from game.scores import refresh_team_round_score, refresh_team_round_scores
 from host.forms import TeamForm
 from host.view_utils import (
-    can_host_game, can_view_game, build_absolute_uri,
+    can_host_game, can_view_game, build_absolute_uri, streaming_response,
 )
+from triviagame.replica import reads_from_replica
 
 User = get_user_model()
 
@@ -40,8 +52,11 @@ __all__ = [
     'toggle_hidden_questions',
     'score_page',
     'assign_score',
+    'assign_scores',
+    'assign_group_score',
     'host_leaderboard',
     'host_leaderboard_stats',
+    'export_responses',
     'game_data',
     'team_page',
     'hx_edit_team',
@@ -55,12 +70,9 @@ class HttpResponseNoContent(HttpResponse):
 @login_required
 def host_home(request):
     all_games = Game.objects.order_by('-last_edit_time')
-    
-    # TODO: might need these if perf suffers
-    # (from guardian.core import ObjectPermissionChecker)
-    # checker = ObjectPermissionChecker(request.user)
-    # checker.prefetch_perms(all_games)
 
+    # the games list checks each game's perms with the request's
+    # `game_perms`, which loads them all at once
     games = get_objects_for_user(
         request.user,
         'game.view_game',
@@ -107,18 +119,25 @@ def update_game_state(request, game_id, new_state):
         print("game.id != game_id")
         ... # TODO, this means something has gone wrong
 
-    if new_state in Game.GameState.values:
-        game.state = new_state
-        game.save()
-
-    messages.success(
-        request,
-        {
-            Game.GameState.CLOSED: "You closed the game.",
-            Game.GameState.ACCEPTING_TEAMS: "You opened the game. New teams can join.",
-            Game.GameState.NO_NEW_TEAMS: "Game is open, but no new teams can join.",
-        }[game.state],
-    )
+    if GameArchive.objects.filter(game=game).exists():
+        # its teams and responses are in the archive, where new ones
+        # wouldn't be seen
+        messages.error(request, "This game has been archived, so it can't be reopened.")
+    else:
+        if new_state in Game.GameState.values and new_state != game.state:
+            game.state = new_state
+            # leave `version` alone; saving the game bumps it in the database
+            game.save(update_fields=['state', 'last_edit_time'])
+            _notify_players(game.id)
+
+        messages.success(
+            request,
+            {
+                Game.GameState.CLOSED: "You closed the game.",
+                Game.GameState.ACCEPTING_TEAMS: "You opened the game. New teams can join.",
+                Game.GameState.NO_NEW_TEAMS: "Game is open, but no new teams can join.",
+            }[game.state],
+        )
     
     response = render(request, 'host/_update_game_state.html', {
         'user': request.user,
@@ -192,9 +211,15 @@ def set_page_state(request, game_id):
     page_id = int(request.POST['page'])
     page = get_object_or_404(Page, pk=page_id)
     new_state = Page.PageState[request.POST['state']]
-    page.state = new_state
-    page.save()
-    messages.success(request, f"{page.title} is now {page.state.label}.")
+    if new_state != page.state:
+        # buffered answers were accepted while the page was open
+        autosave.buffer.flush()
+        page.state = new_state
+        page.save()
+        _notify_players(page.game_id)
+        if new_state == Page.PageState.SCORING:
+            _grade_automatically(request, page)
+    messages.success(request, f"{page.title} is now {new_state.label}.")
 
     response = HttpResponseNoContent()
     # report that some page's state has updated
@@ -205,6 +230,16 @@ def set_page_state(request, game_id):
     )
 
 
+def _grade_automatically(request, page):
+    scored, suggested = grade_page(page)
+    if scored or suggested:
+        messages.info(
+            request,
+            f"Automatically scored {scored} response{pluralize(scored)}; "
+            f"suggested scores for {suggested} more.",
+        )
+
+
 @login_required
 @can_host_game
 @require_POST
@@ -220,6 +255,7 @@ def toggle_hidden_questions(request, game_id, page_id):
     
     page.hide_questions = not page.hide_questions
     page.save()
+    _notify_players(page.game_id)
     # messages.success(request, f"{page.title} questions are now {page.state.label}.")
 
     response = HttpResponseNoContent()
@@ -231,6 +267,11 @@ def toggle_hidden_questions(request, game_id, page_id):
     )
 
 
+def _notify_players(game_id):
+    "Tell connected players' event streams to refresh, once the change is committed."
+    transaction.on_commit(lambda: game_changed(game_id))
+
+
 @login_required
 @can_host_game
 def score_page(request, game_id, page_id):
@@ -240,6 +281,7 @@ def score_page(request, game_id, page_id):
     return render(request, 'host/scoring.html', {
         'game': request.game,
         'page': page,
+        'questions': page.question_set.prefetch_related(_responses_with_teams()),
     })
 
 @login_required
@@ -257,7 +299,11 @@ def assign_score(request, game_id):
         return HttpResponseBadRequest("expected score")
 
     response_id = int(request.POST['response'])
-    response = get_object_or_404(Response, pk=response_id)
+    response = get_object_or_404(
+        Response.objects.select_related('question__page'),
+        pk=response_id,
+        question__page__game=request.game,
+    )
 
     if response.question.page.is_scoring:
         score = int(request.POST['score'])
@@ -267,113 +313,269 @@ def assign_score(request, game_id):
         else:
             response.score = 0
             response.graded = False
-        response.save()
+        with transaction.atomic():
+            response.save()
+            refresh_team_round_score(response.team_id, response.question.page_id)
     else:
         return HttpResponseClientRefresh()
 
+    question = (
+        Question.objects
+        .prefetch_related(_responses_with_teams())
+        .get(pk=response.question_id)
+    )
     return render(request, 'host/_question_score.html', {
         'game': request.game,
-        'question': response.question,
+        'question': question,
     })
 
 
+@login_required
+@can_host_game
+@require_POST
+def assign_group_score(request, game_id):
+    # this is an HTMX-only view
+    if not request.htmx:
+        return HttpResponseBadRequest("expected HTMX request")
+
+    try:
+        question_id = int(request.POST['question'])
+        response_ids = {int(id) for id in request.POST['responses'].split(',')}
+        score = int(request.POST['score'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("expected a question, response ids and a score")
+
+    question = get_object_or_404(
+        Question.objects.select_related('page'),
+        pk=question_id,
+        page__game=request.game,
+    )
+    # as in `assign_scores`, a negative score un-scores the responses
+    if score > question.possible_points:
+        return HttpResponseBadRequest("score is more than the question is worth")
+
+    # the group's responses all answer that question
+    team_ids = list(
+        Response.objects
+        .filter(pk__in=response_ids, question=question)
+        .values_list('team_id', flat=True)
+    )
+    if len(team_ids) != len(response_ids):
+        return HttpResponseBadRequest("expected responses to the question")
+    if not question.page.is_scoring:
+        return HttpResponseClientRefresh()
+
+    with transaction.atomic():
+        # one UPDATE for the whole group
+        responses = Response.objects.filter(pk__in=response_ids)
+        if score >= 0:
+            responses.update(score=score, graded=True)
+        else:
+            responses.update(score=0, graded=False)
+        refresh_team_round_scores((team_id, question.page_id) for team_id in team_ids)
+
+    question = (
+        Question.objects
+        .prefetch_related(_responses_with_teams())
+        .get(pk=question_id)
+    )
+    return render(request, 'host/_question_score.html', {
+        'game': request.game,
+        'question': question,
+    })
+
+
+def _responses_with_teams():
+    # the scoring card names each response's team
+    return Prefetch('response_set', queryset=Response.objects.select_related('team'))
+
+
+@login_required
+@can_host_game
+@require_POST
+def assign_scores(request, game_id):
+    """Scores many responses in one go. Expects a JSON body like
+    `{"scores": [[response_id, score], ...]}`; as in `assign_score`, a
+    negative score un-scores the response. Returns the responses which
+    actually changed."""
+    try:
+        scores = _parse_scores(request.body)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    with transaction.atomic():
+        responses = list(
+            Response.objects
+            .filter(pk__in=scores, question__page__game=request.game)
+            .select_related('question__page')
+        )
+        if len(responses) != len(scores):
+            return HttpResponseBadRequest("unknown response id")
+        if not all(r.question.page.is_scoring for r in responses):
+            return JsonResponse(
+                {'error': "Only pages being scored can be scored."},
+                status=HTTPStatus.CONFLICT,
+            )
+        if any(scores[r.id] > r.question.possible_points for r in responses):
+            return HttpResponseBadRequest("score is more than the question is worth")
+
+        changed = []
+        for response in responses:
+            score = scores[response.id]
+            graded = score >= 0
+            score = max(score, 0)
+            if (response.score, response.graded) != (score, graded):
+                response.score = score
+                response.graded = graded
+                changed.append(response)
+
+        Response.objects.bulk_update(changed, ['score', 'graded'])
+        refresh_team_round_scores(
+            (response.team_id, response.question.page_id)
+            for response in changed
+        )
+
+    return JsonResponse({
+        'changed': [
+            {'response': r.id, 'score': r.score, 'graded': r.graded}
+            for r in changed
+        ],
+    })
+
+
+def _parse_scores(body):
+    "response id -> score from an `assign_scores` body, or ValueError"
+    try:
+        pairs = json.loads(body)['scores']
+    except (ValueError, KeyError, TypeError):
+        pairs = None
+    if not isinstance(pairs, list):
+        raise ValueError("expected a JSON object with a list of scores")
+
+    scores = {}
+    for pair in pairs:
+        if (
+            not isinstance(pair, list)
+            or len(pair) != 2
+            or not all(type(n) is int for n in pair)
+        ):
+            raise ValueError("expected [response id, score] pairs of integers")
+        response_id, score = pair
+        if response_id in scores:
+            raise ValueError(f"response {response_id} was scored twice")
+        scores[response_id] = score
+    return scores
+
+
 @login_required
 @can_view_game
+@reads_from_replica
 def host_leaderboard(request, game_id):
     game = request.game
 
-    rounds, ldr_board, gold_medals = compute_leaderboard_data(game)
+    board = get_leaderboard(game)
 
     return render(request, 'host/leaderboard.html', {
         'game': game,
-        'rounds': rounds,
-        'teams': { t.name: t.members for t in game.team_set.all() },
-        'leaderboard': ldr_board,
-        'gold_medals': gold_medals,
+        'rounds': board.rounds,
+        'teams': board.teams,
+        'leaderboard': board.lines,
+        'gold_medals': board.gold_medals,
     })
 
 
 @login_required
 @can_view_game
+@reads_from_replica
 def host_leaderboard_stats(request, game_id):
-    game = request.game
+    board = get_leaderboard(request.game)
+    return HttpResponse(board.json, content_type='application/json')
 
-    rounds, ldr_board, gold_medals = compute_leaderboard_data(game)
 
-    response = JsonResponse({
-        'game': {
-            'name': game.name,
-        },
-        'rounds': [
-            {'name': str(round)}
-            for round in rounds
-        ],
-        'teams': [
-            { 'name': t.name, 'members': t.members }
-            for t in game.team_set.all()
-        ],
-        'leaderboard': [
-            { 'name': l[0], 'scores': l[1:], 'has_gold_medal': l[0] in gold_medals }
-            for l in ldr_board
-        ],
-    })
+@login_required
+@can_view_game
+@reads_from_replica
+def export_responses(request, game_id, format):
+    lines, content_type = export.FORMATS[format]
+    # the body streams out after the view returns, so it's told where to read
+    rows = export.response_rows(request.game, router.db_for_read(Response))
+    response = streaming_response(request, lines(rows), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="game-{request.game.id}-responses.{format}"'
+    )
     return response
 
 
+def _game_data_etag(request, game_id):
+    # Responses only show up in game.json by score, so new answers and
+    # scoring (plus team and structure edits) are all that change it.
+    # Everything is read where the body will be, so a lagging replica's
+    # body is never cached under the primary's fresher versions.
+    using = router.db_for_read(Response)
+    versions = (
+        Game.objects
+        .using(using)
+        .filter(pk=request.game.pk)
+        .values_list('version', 'results_version')
+        .first()
+    )
+    if versions is None:
+        # not on the replica yet
+        return None
+    response_count = Response.objects.using(using).filter(question__page__game=request.game).count()
+    return f"{request.game.id}-{versions[0]}-{versions[1]}-{response_count}"
+
+
 @login_required
 @can_view_game
+@reads_from_replica
+@condition(etag_func=_game_data_etag)
 def game_data(request, game_id):
-    game = request.game
+    # the body streams out after the view returns, so it's told where to read
+    return streaming_response(
+        request,
+        _stream_game_data(request.game, router.db_for_read(Response)),
+        content_type='application/json',
+    )
+
 
-    # all this ugly preloading saves us from some, but not all,
-    # SQL "n+1" problems. I stopped trying to whittle it down
-    # any further when it had saved half the original queries
-    # and half the time.
-    questions = (
+def _stream_game_data(game, using):
+    # One query for the questions and one ordered scan of the responses,
+    # written out as we go so memory use doesn't grow with the game. The
+    # order is the one the models' default orderings always gave game.json:
+    # questions by round, then by order; each one's responses by team name.
+    questions = list(
         Question.objects
+        .using(using)
         .filter(page__game=game)
         .select_related('page')
+        .order_by('page__order', 'order')
     )
-    responses = (
-        Response.objects
-        .filter(question__page__game=game)
-        .select_related('question', 'team')
-        .values('question__id', 'team__id', 'score', 'graded')
-    )
-
-    data_out = [
-        {
-            'round': q.page.order,
-            'question': q.order,
-            'possible_points': q.possible_points,
-            # we'll process each question in the next step
-            'q_id': q.id,
-        }
-        for q in questions
-    ]
-
-    for row in data_out:
-        q_id = row.pop('q_id')
-        q_responses = responses.filter(question__id=q_id)
-        row['responses'] = [
-            {
-                'team': f"t{r['team__id']}",
-                'awarded_points': r['score'],
-                'is_graded': r['graded'],
-            }
-            for r in q_responses
-        ]
-
-    response = JsonResponse({
+    archive = load_archive(game, using)
+    if archive:
+        teams = archive['teams']
+        responses = _archived_responses(archive, questions)
+    else:
+        teams = list(game.team_set.using(using).values_list('id', 'name', 'members'))
+        responses = (
+            Response.objects
+            .using(using)
+            .filter(question__page__game=game)
+            .order_by('question__page__order', 'question__order', 'team__name')
+            .values_list('question_id', 'team_id', 'score', 'graded')
+            .iterator(chunk_size=2000)
+        )
+
+    header = json.dumps({
         'game': {
             'name': game.name,
         },
         'teams': { 
-            f"t{t.id}": {
-                'name': t.name,
-                'members': t.members,
+            f"t{team_id}": {
+                'name': name,
+                'members': members,
             }
-            for t in game.team_set.all()
+            for team_id, name, members in teams
         },
         'rounds': [
             {
@@ -381,11 +583,51 @@ def game_data(request, game_id):
                 'order': r.order,
                 'is_hidden': r.is_hidden,
             }
-            for r in game.page_set.all()
+            for r in game.page_set.using(using)
         ],
-        'data': data_out
-    })
-    return response
+    }, cls=DjangoJSONEncoder)
+    # reopen the object to append "data"
+    yield header[:-1] + ', "data": ['
+
+    by_question = groupby(responses, key=itemgetter(0))
+    current = next(by_question, None)
+    for n, q in enumerate(questions):
+        q_responses = []
+        # both are in question order, so this question's responses (if
+        # any) are the next group
+        if current and current[0] == q.id:
+            q_responses = list(current[1])
+            current = next(by_question, None)
+
+        row = json.dumps({
+            'round': q.page.order,
+            'question': q.order,
+            'possible_points': q.possible_points,
+            'responses': [
+                {
+                    'team': f"t{team_id}",
+                    'awarded_points': score,
+                    'is_graded': graded,
+                }
+                for _, team_id, score, graded in q_responses
+            ],
+        }, cls=DjangoJSONEncoder)
+        yield (', ' if n else '') + row
+
+    yield ']}'
+
+
+def _archived_responses(archive, questions):
+    "An archived game's responses, in the order `_stream_game_data` reads them"
+    position = {question.id: n for n, question in enumerate(questions)}
+    team_names = {team_id: name for team_id, name, _ in archive['teams']}
+    responses = [
+        (question_id, team_id, score, graded)
+        for question_id, team_id, _, score, graded, _ in archive['responses']
+        if question_id in position
+    ]
+    responses.sort(key=lambda r: (position[r[0]], team_names[r[1]]))
+    return responses
 
 
 @login_required
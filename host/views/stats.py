@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import JsonResponse
+from django.shortcuts import render
+
+from triviagame import metrics
+
+
+__all__ = [
+    'server_stats',
+    'server_stats_data',
+]
+
+
+def _is_superuser(user):
+    return user.is_superuser
+
+
+@login_required
+@user_passes_test(_is_superuser)
+def server_stats(request):
+    return render(request, 'host/stats.html', {
+        'views': metrics.report(),
+        'budgets': settings.QUERY_BUDGETS,
+    })
+
+
+@login_required
+@user_passes_test(_is_superuser)
+def server_stats_data(request):
+    return JsonResponse({
+        'views': metrics.report(),
+        'budgets': settings.QUERY_BUDGETS,
+    })
@@ -0,0 +1,169 @@
+"""
+Always-on, in-memory request metrics, per resolved view: how many queries
+each request ran, how long they took, how long the whole request took, and
+how big the response was.
+
+Each measurement goes into a histogram with fixed buckets, so memory stays
+bounded no matter how long the process runs. Like the snapshot cache, the
+numbers belong to one worker process; each worker reports its own.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of each bucket; anything bigger goes in a final, open bucket
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BYTES_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# requests which didn't resolve to a view (mostly 404s) share one entry
+UNRESOLVED = '<unresolved>'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        "Upper bound of the bucket holding the `fraction` point, or the max for the last bucket"
+        wanted = fraction * sum(self.counts)
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        count = sum(self.counts)
+        return {
+            'mean': self.total / count if count else 0,
+            'p50': self.percentile(.5),
+            'p95': self.percentile(.95),
+            'max': self.max,
+            'buckets': [
+                {'le': bound, 'count': count}
+                for bound, count in zip(self.buckets + (None,), self.counts)
+            ],
+        }
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.over_budget = 0
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_ms = Histogram(MS_BUCKETS)
+        self.total_ms = Histogram(MS_BUCKETS)
+        self.response_bytes = Histogram(BYTES_BUCKETS)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'over_budget': self.over_budget,
+            'queries': self.queries.as_dict(),
+            'sql_ms': self.sql_ms.as_dict(),
+            'total_ms': self.total_ms.as_dict(),
+            'response_bytes': self.response_bytes.as_dict(),
+        }
+
+
+_lock = threading.Lock()
+_views: dict[str, ViewStats] = {}
+
+
+def record(view_name, queries, sql_seconds, total_seconds, response_bytes=None):
+    with _lock:
+        stats = _views.get(view_name)
+        if stats is None:
+            stats = _views[view_name] = ViewStats()
+        stats.requests += 1
+        stats.queries.add(queries)
+        stats.sql_ms.add(sql_seconds * 1000)
+        stats.total_ms.add(total_seconds * 1000)
+        if response_bytes is not None:
+            stats.response_bytes.add(response_bytes)
+
+        budget = settings.QUERY_BUDGETS.get(view_name)
+        if budget is not None and queries > budget:
+            stats.over_budget += 1
+            logger.warning(
+                "%s ran %d queries, over its budget of %d",
+                view_name, queries, budget,
+            )
+
+
+def report():
+    "Everything recorded so far, by view name"
+    with _lock:
+        return {name: stats.as_dict() for name, stats in sorted(_views.items())}
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# the counter for the request being handled, if any
+_counter: ContextVar[QueryCounter | None] = ContextVar('query_counter', default=None)
+
+
+def count_queries(counter=None):
+    """Start counting queries in this context, into `counter` or a new
+    one. Returns the counter and a token for `stop_counting`."""
+    if counter is None:
+        counter = QueryCounter()
+    return counter, _counter.set(counter)
+
+
+def stop_counting(token):
+    _counter.reset(token)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.queries += 1
+        counter.seconds += time.perf_counter() - start
+
+
+def install(connection, **kwargs):
+    "Wrap every query on `connection`; safe to call more than once"
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def install_everywhere():
+    connection_created.connect(install, dispatch_uid='triviagame.metrics.install')
+    # connections made before we were listening
+    for connection in connections.all(initialized_only=True):
+        install(connection)
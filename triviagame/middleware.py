@@ -1,7 +1,14 @@
 import json
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
 from django.contrib.messages import get_messages
+from django.core.exceptions import MiddlewareNotUsed
 from django.http import HttpResponse
-from django.utils.decorators import async_only_middleware
+from django.utils.decorators import async_only_middleware, sync_and_async_middleware
+
+from triviagame import metrics, replica
 
 
 # https://docs.djangoproject.com/en/5.0/ref/request-response/#django.http.HttpRequest.get_host
@@ -28,6 +35,137 @@ class MultipleProxyMiddleware:
         return self.get_response(request)
 
 
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Records queries, SQL time, total time, and response size for each
+    view into `triviagame.metrics`. A streamed response is measured until
+    its body has been sent, since that's when its queries run.
+    """
+    metrics.install_everywhere()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            counter, token = metrics.count_queries()
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                metrics.stop_counting(token)
+            return _record_when_sent(request, response, counter, start)
+    else:
+        def middleware(request):
+            counter, token = metrics.count_queries()
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                metrics.stop_counting(token)
+            return _record_when_sent(request, response, counter, start)
+
+    return middleware
+
+def _record_when_sent(request, response, counter, start):
+    def finish():
+        _record(request, response, counter, time.perf_counter() - start)
+
+    if not response.streaming:
+        finish()
+    elif response.is_async:
+        response.streaming_content = _acounted(response.streaming_content, counter, finish)
+    else:
+        response.streaming_content = _counted(response.streaming_content, counter, finish)
+    return response
+
+
+def _counted(chunks, counter, finish):
+    # the body is produced after the middleware has returned, so count
+    # around each chunk, and record once it's used up or closed
+    chunks = iter(chunks)
+    try:
+        while True:
+            _, token = metrics.count_queries(counter)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                metrics.stop_counting(token)
+            yield chunk
+    finally:
+        finish()
+
+
+async def _acounted(chunks, counter, finish):
+    "`_counted` for async bodies"
+    chunks = aiter(chunks)
+    try:
+        while True:
+            _, token = metrics.count_queries(counter)
+            try:
+                chunk = await anext(chunks)
+            except StopAsyncIteration:
+                return
+            finally:
+                metrics.stop_counting(token)
+            yield chunk
+    finally:
+        finish()
+
+
+def _record(request, response, counter, seconds):
+    match = request.resolver_match
+    metrics.record(
+        match.view_name if match else metrics.UNRESOLVED,
+        counter.queries,
+        counter.seconds,
+        seconds,
+        # streamed bodies haven't been produced yet
+        None if response.streaming else len(response.content),
+    )
+
+
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    """
+    Tracks each request for the replica router, and pins browsers which
+    wrote to the game's tables to the primary for a while.
+    """
+    if not replica.is_configured():
+        raise MiddlewareNotUsed()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = replica.start_request(replica.PIN_COOKIE in request.COOKIES)
+            try:
+                response = await get_response(request)
+            finally:
+                replica.end_request(token)
+            _pin_writers(response, state)
+            return response
+    else:
+        def middleware(request):
+            state, token = replica.start_request(replica.PIN_COOKIE in request.COOKIES)
+            try:
+                response = get_response(request)
+            finally:
+                replica.end_request(token)
+            _pin_writers(response, state)
+            return response
+
+    return middleware
+
+def _pin_writers(response, state):
+    if state.wrote:
+        response.set_cookie(
+            replica.PIN_COOKIE,
+            '1',
+            max_age=settings.REPLICA_STICKY_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+
+
 @async_only_middleware
 def htmx_message_middleware(get_response):
     async def middleware(request):
@@ -0,0 +1,123 @@
+"""
+Sends the reporting views' reads -- leaderboards, game.json, the audit page --
+to a read replica, when `REPLICA_DATABASE_URL` sets one up, so they don't
+compete with players' autosaves for the primary.
+
+Only views wrapped in `reads_from_replica` use the replica, and only for the
+game's own tables; sessions, users, permissions and the player's own game
+and team (see `game.player`) always come from the primary, as does
+everything inside a transaction. Every write goes to the
+primary. Once a request writes to the game's tables, `replica_middleware`
+pins that browser to the primary for `REPLICA_STICKY_SECONDS`, so a host who
+just scored sees their scores even while the replica catches up.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA = 'replica'
+
+# browsers carrying this cookie read from the primary
+PIN_COOKIE = 'primary_pin'
+
+# apps whose tables the replica serves
+REPLICA_APPS = frozenset({'game'})
+
+
+def is_configured():
+    return REPLICA in settings.DATABASES
+
+
+class RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+# the request being handled, if any
+_request: ContextVar[RequestState | None] = ContextVar('replica_request', default=None)
+# whether we're inside a `reads_from_replica` view
+_reporting: ContextVar[bool] = ContextVar('replica_reporting', default=False)
+
+
+def start_request(pinned):
+    """Start tracking a request. Returns its state and a token for
+    `end_request`."""
+    state = RequestState(pinned)
+    return state, _request.set(state)
+
+
+def end_request(token):
+    _request.reset(token)
+
+
+def reads_from_replica(view):
+    "View decorator sending the view's reads to the replica, where it's safe to"
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            token = _reporting.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _reporting.reset(token)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            token = _reporting.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _reporting.reset(token)
+    return inner
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _reporting.get() or model._meta.app_label not in REPLICA_APPS:
+            return None
+        if not is_configured():
+            return None
+
+        state = _request.get()
+        if state and (state.pinned or state.wrote):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # the transaction's own view of the data
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state and model._meta.app_label in REPLICA_APPS:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema from the primary
+        if db == REPLICA:
+            return False
+        return None
+
+
+def sync_sqlite_replica(primary=DEFAULT_DB_ALIAS, replica=REPLICA):
+    """Copies an SQLite primary over an SQLite replica, for trying the
+    replica out (and testing it) locally. Real replicas are kept up to date
+    by the database server."""
+    source, target = connections[primary], connections[replica]
+    if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+        raise ValueError("only SQLite databases can be copied this way")
+
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     # 'triviagame.middleware.NonHtmlDebugToolbarMiddleware', # enable only in local dev
+    'triviagame.middleware.metrics_middleware',
+    'triviagame.middleware.replica_middleware',
     'triviagame.middleware.MultipleProxyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,6 +84,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'triviagame.context_processors.deployment_details',
+                'host.context_processors.game_permissions',
             ],
         },
     },
@@ -109,6 +112,58 @@ DATABASES = {
     )
 }
 
+# Deployed SQLite databases get WAL and IMMEDIATE transactions (see
+# triviagame/sqlite/base.py). SQLITE_SERIALIZE_WRITES also queues each
+# process's write transactions, and writes made outside of one, on a lock.
+if (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+    and config('SQLITE_TUNED', default=True, cast=bool)
+):
+    DATABASES['default']['ENGINE'] = 'triviagame.sqlite'
+    DATABASES['default'].setdefault('OPTIONS', {})['serialize_writes'] = config(
+        'SQLITE_SERIALIZE_WRITES', default=False, cast=bool,
+    )
+
+# An optional read replica for the leaderboards and other reporting views
+# (see triviagame/replica.py)
+REPLICA_DATABASE_URL = config('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = db_url(REPLICA_DATABASE_URL)
+DATABASE_ROUTERS = ['triviagame.replica.ReplicaRouter']
+# Seconds a browser which just wrote keeps reading from the primary
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+# Buffer players' autosaved answers in memory and write them in batches
+# (see game/autosave.py). Best with a single worker process.
+AUTOSAVE_WRITE_BEHIND = config('AUTOSAVE_WRITE_BEHIND', default=False, cast=bool)
+AUTOSAVE_FLUSH_SECONDS = config('AUTOSAVE_FLUSH_SECONDS', default=1.0, cast=float)
+
+# Seconds to keep each host's game permissions between requests, per worker
+# process (see host/permissions.py). 0 looks them up once per request.
+GAME_PERMS_CACHE_SECONDS = config('GAME_PERMS_CACHE_SECONDS', default=0, cast=float)
+
+# Seconds between checks, one per game per worker, for changes made in other
+# worker processes, which players' event streams otherwise never hear about
+# (see game/events.py). It's the most such a change is delayed.
+EVENT_VERSION_CHECK_SECONDS = config('EVENT_VERSION_CHECK_SECONDS', default=10, cast=float)
+
+# Most queries a view should need, by URL name. Going over logs a warning
+# and counts against the view on the host stats page (triviagame/metrics.py).
+QUERY_BUDGETS = {
+    'play': 6,
+    'page_list_hx': 6,
+    'play_poll_hx': 3,
+    'answer_sheet': 6,
+    'page_questions_hx': 7,
+    'question_hx': 7,
+    'respond': 8,
+    'leaderboard': 8,
+    'assign_score': 20,
+    'assign_scores': 16,
+    'assign_group_score': 16,
+    'game_data': 12,
+}
+
 
 # Password validation
 
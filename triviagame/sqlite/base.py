@@ -0,0 +1,119 @@
+"""
+SQLite set up for serving a game night from one file. Use it as the ENGINE
+`triviagame.sqlite`; settings does so for any sqlite DATABASE_URL.
+
+Every connection gets write-ahead logging, so readers and the writer stop
+blocking each other, plus a busy timeout, `synchronous = NORMAL` (safe with
+WAL) and a bigger page cache. Transactions begin IMMEDIATE, taking the write
+lock up front. A deferred transaction which reads and then writes can't wait
+for the lock: SQLite fails it straight away with "database is locked", which
+is what sessions and autosaves kept running into.
+
+Besides Django's own, OPTIONS may have:
+
+- `busy_timeout`: milliseconds to wait for the write lock (default 5000)
+- `cache_size`: KiB of page cache per connection (default 20000)
+- `serialize_writes`: queue this process's transactions, and its writes
+  outside of one, on a lock, so its threads take turns in order rather than
+  polling SQLite's busy handler
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.backends.sqlite3 import base
+
+
+# statements which take SQLite's write lock when run under autocommit
+_WRITES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+# one per database file
+_write_locks = defaultdict(threading.Lock)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.busy_timeout = int(kwargs.pop('busy_timeout', 5000))
+        self.cache_size = int(kwargs.pop('cache_size', 20000))
+        self.serialize_writes = kwargs.pop('serialize_writes', False)
+        if 'transaction_mode' not in self.settings_dict['OPTIONS']:
+            self.transaction_mode = 'IMMEDIATE'
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        # in-memory databases keep their own journal mode, which is fine
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        # negative means KiB rather than pages
+        conn.execute(f"PRAGMA cache_size = {-self.cache_size}")
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SerializedCursorWrapper)
+        cursor.db = self
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        if self.serialize_writes:
+            _write_locks[self.settings_dict['NAME']].acquire()
+            self._holds_write_lock = True
+        try:
+            super()._start_transaction_under_autocommit()
+        except BaseException:
+            self._release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self._release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self._release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self._release_write_lock()
+
+    def _release_write_lock(self):
+        if getattr(self, '_holds_write_lock', False):
+            self._holds_write_lock = False
+            _write_locks[self.settings_dict['NAME']].release()
+
+
+class SerializedCursorWrapper(base.SQLiteCursorWrapper):
+    """
+    Takes the write lock around each write run under autocommit, which is a
+    transaction of its own that `_start_transaction_under_autocommit` never
+    sees. Inside `atomic()` the transaction already holds it.
+    """
+    def execute(self, query, params=None):
+        with self._serialized(query):
+            return super().execute(query, params)
+
+    def executemany(self, query, param_list):
+        with self._serialized(query):
+            return super().executemany(query, param_list)
+
+    @contextmanager
+    def _serialized(self, query):
+        db = self.db
+        if (
+            not db.serialize_writes
+            or not db.autocommit
+            or not query.lstrip()[:7].upper().startswith(_WRITES)
+        ):
+            yield
+            return
+        with _write_locks[db.settings_dict['NAME']]:
+            yield